@@ -1,14 +1,29 @@
 import logging
 import asyncio
+import bisect
+import functools
+import html
+import hashlib
+import heapq
+import hmac
 import aiosqlite
 import re
 import os
-from datetime import datetime
-from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command, StateFilter
+import json
+import signal
+import string
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from aiogram import BaseMiddleware, Bot, Dispatcher, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.filters import Command, CommandObject, Filter, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.enums import ParseMode, ChatType, ContentType
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
@@ -19,7 +34,7 @@ from aiohttp import web # Импорт для работы с веб-серве
 API_TOKEN = os.environ.get('API_TOKEN')
 ADMIN_CHAT_IDS_STR = os.environ.get('ADMIN_CHAT_IDS', '')
 GROUP_CHAT_ID_STR = os.environ.get('GROUP_CHAT_ID')
-PRICE_PER_BOTTLE_STR = os.environ.get('PRICE_PER_BOTTLE', '16000')
+PRICE_PER_BOTTLE_STR = os.environ.get('PRICE_PER_BOTTLE', '16000') # Начальная цена для пустой таблицы prices (дальше - /price)
 
 # !!! НОВЫЕ ПЕРЕМЕННЫЕ ДЛЯ WEBHOOK НА RENDER !!!
 # Render предоставляет EXTERNAL_HOSTNAME (публичный адрес) и PORT (порт, который нужно слушать)
@@ -41,6 +56,13 @@ WEBHOOK_URL = f"https://{WEBHOOK_HOST}/{WEBHOOK_SECRET_PATH}"
 # IP-адрес, который будет слушать ваш веб-сервер (0.0.0.0 означает все доступные интерфейсы)
 WEBAPP_HOST = '0.0.0.0'
 
+# Остановка (SIGTERM при деплое/рестарте на Render): сколько секунд ждать обработки текущих обновлений и фоновых задач.
+# Render ждёт 30 секунд после SIGTERM, потом убивает процесс.
+SHUTDOWN_TIMEOUT_STR = os.environ.get('SHUTDOWN_TIMEOUT')
+# Удалять webhook при остановке. По умолчанию нет: при деплое новый экземпляр уже установил webhook,
+# и его удаление старым экземпляром оставило бы бота без обновлений.
+DELETE_WEBHOOK_ON_SHUTDOWN = os.environ.get('DELETE_WEBHOOK_ON_SHUTDOWN', '').strip().lower() in ('1', 'true', 'yes')
+
 # Путь к файлу базы данных. Render сохраняет файлы в файловой системе сервиса.
 # Указание имени файла или пути позволяет контролировать, где он будет создан/найден.
 # На Render Free Tier это может быть не полностью персистентно между деплоями,
@@ -48,6 +70,62 @@ WEBAPP_HOST = '0.0.0.0'
 # Задание пути явно - хорошая практика. Дефолт 'clients.db' создаст его в рабочей директории.
 DATABASE_PATH = os.environ.get('DATABASE_PATH', 'clients.db')
 
+# Каталог со статическими данными бота (полигоны районов и т.п.), лежит рядом со скриптом
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Переводы: по файлу <язык>.json на язык. Чтобы добавить язык, достаточно положить файл (ru.json - базовый, обязателен).
+LOCALES_DIR = os.environ.get('LOCALES_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'locales'))
+# Языки, загружаемые при старте (в этом порядке они и стоят на клавиатуре выбора языка); остальные - при первом обращении
+PRELOAD_LANGUAGES_STR = os.environ.get('PRELOAD_LANGUAGES', 'ru,uz')
+
+# Часовой пояс для времени заказов, "сегодня" у слотов доставки и дат цен (сервер Render работает в UTC)
+TIMEZONE_NAME = os.environ.get('TIMEZONE', 'Asia/Tashkent')
+
+# GeoJSON с границами районов (туманов) Ташкента для офлайн-определения района по локации.
+# Загружается один раз при старте, внешний геокодер не нужен. У района свойства "id" и названия "ru", "uz" (и других языков).
+# Файл не поставляется: укажите выверенные границы (например, упрощённую выгрузку OSM admin_level=8, лицензия ODbL -
+# указывайте источник). Пока путь не задан, район у заказов не определяется.
+DISTRICTS_PATH = os.environ.get('DISTRICTS_PATH', '')
+
+# GeoJSON с зонами доставки. У зоны может быть свойство "price" - цена за бутылку в этой зоне.
+# Если файл отсутствует, проверка зоны отключена и принимаются любые координаты.
+SERVICE_ZONES_PATH = os.environ.get('SERVICE_ZONES_PATH', os.path.join(DATA_DIR, 'service_zones.json'))
+# Что делать с локацией вне зон: 'reject' - сразу попросить другую локацию, 'flag' - принять и пометить для админов
+SERVICE_ZONE_MODE = os.environ.get('SERVICE_ZONE_MODE', 'reject').strip().lower()
+
+# Токен для read-only JSON API (/api/...) для бэк-офиса: "Authorization: Bearer <token>".
+# Если не задан, API не подключается.
+ADMIN_API_TOKEN = os.environ.get('ADMIN_API_TOKEN')
+
+# ADMIN_CHAT_IDS и GROUP_CHAT_ID только заполняют таблицу settings при первом запуске, дальше - /set.
+# Необязательный JSON-файл настроек: при изменении (проверка mtime) записывается в таблицу settings и применяется без рестарта.
+SETTINGS_FILE = os.environ.get('SETTINGS_FILE')
+SETTINGS_POLL_SECONDS_STR = os.environ.get('SETTINGS_POLL_SECONDS')
+
+# Интервалы доставки, которые клиент выбирает после количества: "ЧЧ:ММ-ЧЧ:ММ" через запятую.
+# У интервала можно указать свою вместимость в бутылях: "09:00-13:00=150". Пустое значение отключает выбор времени.
+DELIVERY_SLOTS_STR = os.environ.get('DELIVERY_SLOTS', '09:00-13:00,13:00-17:00,17:00-21:00')
+SLOT_CAPACITY_STR = os.environ.get('SLOT_CAPACITY') # Вместимость интервала по умолчанию (бутылей)
+SLOT_DAYS_AHEAD_STR = os.environ.get('SLOT_DAYS_AHEAD') # На сколько дней вперёд (включая сегодня) предлагать интервалы
+
+# Через сколько секунд бездействия забывается незаконченный диалог (состояние FSM и его данные), по умолчанию сутки
+FSM_TTL_SECONDS_STR = os.environ.get('FSM_TTL_SECONDS')
+
+# Антифлуд: у каждого пользователя "ведро" на FLOOD_BURST обновлений подряд, пополняется на FLOOD_RATE в секунду.
+# Сверх лимита обновления отбрасываются до обращения к БД (один раз пользователь получает предупреждение).
+# Админы не ограничиваются. FLOOD_RATE=0 отключает антифлуд.
+FLOOD_RATE_STR = os.environ.get('FLOOD_RATE')
+FLOOD_BURST_STR = os.environ.get('FLOOD_BURST')
+FLOOD_MAX_USERS_STR = os.environ.get('FLOOD_MAX_USERS') # Сколько пользователей помнить (давно не писавшие вытесняются)
+
+# Проверка готовности /health/ready: раз в HEALTH_CHECK_SECONDS фоновая задача делает SELECT 1 в БД,
+# сами проверки читают только её результат (их можно вызывать хоть каждую секунду).
+# Сервис "не готов" (503), если БД не ответила, цикл событий задерживается больше HEALTH_MAX_LOOP_LAG_MS
+# миллисекунд или обрабатывается больше HEALTH_MAX_IN_FLIGHT обновлений одновременно.
+HEALTH_CHECK_SECONDS_STR = os.environ.get('HEALTH_CHECK_SECONDS')
+HEALTH_MAX_LOOP_LAG_MS_STR = os.environ.get('HEALTH_MAX_LOOP_LAG_MS')
+HEALTH_MAX_IN_FLIGHT_STR = os.environ.get('HEALTH_MAX_IN_FLIGHT')
+
 
 # Convert string variables to required types
 ADMIN_CHAT_IDS = []
@@ -75,6 +153,147 @@ if PRICE_PER_BOTTLE_STR:
         logging.warning(f"Environment variable PRICE_PER_BOTTLE is set incorrectly: {PRICE_PER_BOTTLE_STR}. Using default value: {PRICE_PER_BOTTLE}")
 
 
+if SERVICE_ZONE_MODE not in ('reject', 'flag'):
+    logging.warning(f"Environment variable SERVICE_ZONE_MODE is set incorrectly: {SERVICE_ZONE_MODE}. Using default value: reject")
+    SERVICE_ZONE_MODE = 'reject'
+
+SLOT_CAPACITY = 100
+if SLOT_CAPACITY_STR:
+    try:
+        SLOT_CAPACITY = int(SLOT_CAPACITY_STR)
+        if SLOT_CAPACITY <= 0:
+            raise ValueError
+    except (ValueError, TypeError):
+        SLOT_CAPACITY = 100
+        logging.warning(f"Environment variable SLOT_CAPACITY is set incorrectly: {SLOT_CAPACITY_STR}. Using default value: {SLOT_CAPACITY}")
+
+SLOT_DAYS_AHEAD = 2
+if SLOT_DAYS_AHEAD_STR:
+    try:
+        SLOT_DAYS_AHEAD = int(SLOT_DAYS_AHEAD_STR)
+        if SLOT_DAYS_AHEAD <= 0:
+            raise ValueError
+    except (ValueError, TypeError):
+        SLOT_DAYS_AHEAD = 2
+        logging.warning(f"Environment variable SLOT_DAYS_AHEAD is set incorrectly: {SLOT_DAYS_AHEAD_STR}. Using default value: {SLOT_DAYS_AHEAD}")
+
+DELIVERY_SLOTS = {} # "HH:MM-HH:MM" -> capacity in bottles, in the configured order
+for slot_item in DELIVERY_SLOTS_STR.split(','):
+    if not slot_item.strip():
+        continue
+    slot_range, _, slot_capacity_str = slot_item.partition('=')
+    try:
+        slot_start, slot_end = (datetime.strptime(part.strip(), "%H:%M") for part in slot_range.split('-'))
+        slot_capacity = int(slot_capacity_str) if slot_capacity_str.strip() else SLOT_CAPACITY
+        if slot_start >= slot_end or slot_capacity <= 0:
+            raise ValueError
+    except (ValueError, TypeError):
+        logging.warning(f"Delivery slot '{slot_item.strip()}' in DELIVERY_SLOTS is set incorrectly and will be ignored.")
+        continue
+    DELIVERY_SLOTS[f"{slot_start:%H:%M}-{slot_end:%H:%M}"] = slot_capacity
+
+
+PRELOAD_LANGUAGES = tuple(lang.strip() for lang in PRELOAD_LANGUAGES_STR.split(',') if lang.strip())
+
+try:
+    TIMEZONE = ZoneInfo(TIMEZONE_NAME)
+except (ZoneInfoNotFoundError, ValueError):
+    # No tz database (e.g. slim image without tzdata): Tashkent is UTC+5 all year, no DST
+    TIMEZONE = timezone(timedelta(hours=5), 'Asia/Tashkent')
+    logging.warning(f"Time zone {TIMEZONE_NAME} (TIMEZONE) is not available. Using UTC+05:00")
+
+
+SETTINGS_POLL_SECONDS = 10
+if SETTINGS_POLL_SECONDS_STR:
+    try:
+        SETTINGS_POLL_SECONDS = int(SETTINGS_POLL_SECONDS_STR)
+        if SETTINGS_POLL_SECONDS <= 0:
+            raise ValueError
+    except (ValueError, TypeError):
+        SETTINGS_POLL_SECONDS = 10
+        logging.warning(f"Environment variable SETTINGS_POLL_SECONDS is set incorrectly: {SETTINGS_POLL_SECONDS_STR}. Using default value: {SETTINGS_POLL_SECONDS}")
+
+SHUTDOWN_TIMEOUT = 25
+if SHUTDOWN_TIMEOUT_STR:
+    try:
+        SHUTDOWN_TIMEOUT = int(SHUTDOWN_TIMEOUT_STR)
+        if SHUTDOWN_TIMEOUT < 0:
+            raise ValueError
+    except (ValueError, TypeError):
+        SHUTDOWN_TIMEOUT = 25
+        logging.warning(f"Environment variable SHUTDOWN_TIMEOUT is set incorrectly: {SHUTDOWN_TIMEOUT_STR}. Using default value: {SHUTDOWN_TIMEOUT}")
+
+FSM_TTL_SECONDS = 86400
+if FSM_TTL_SECONDS_STR:
+    try:
+        FSM_TTL_SECONDS = int(FSM_TTL_SECONDS_STR)
+        if FSM_TTL_SECONDS <= 0:
+            raise ValueError
+    except (ValueError, TypeError):
+        FSM_TTL_SECONDS = 86400
+        logging.warning(f"Environment variable FSM_TTL_SECONDS is set incorrectly: {FSM_TTL_SECONDS_STR}. Using default value: {FSM_TTL_SECONDS}")
+
+FLOOD_RATE = 1.0
+if FLOOD_RATE_STR:
+    try:
+        FLOOD_RATE = float(FLOOD_RATE_STR)
+        if FLOOD_RATE < 0:
+            raise ValueError
+    except (ValueError, TypeError):
+        FLOOD_RATE = 1.0
+        logging.warning(f"Environment variable FLOOD_RATE is set incorrectly: {FLOOD_RATE_STR}. Using default value: {FLOOD_RATE}")
+
+FLOOD_BURST = 5
+if FLOOD_BURST_STR:
+    try:
+        FLOOD_BURST = int(FLOOD_BURST_STR)
+        if FLOOD_BURST <= 0:
+            raise ValueError
+    except (ValueError, TypeError):
+        FLOOD_BURST = 5
+        logging.warning(f"Environment variable FLOOD_BURST is set incorrectly: {FLOOD_BURST_STR}. Using default value: {FLOOD_BURST}")
+
+FLOOD_MAX_USERS = 10000
+if FLOOD_MAX_USERS_STR:
+    try:
+        FLOOD_MAX_USERS = int(FLOOD_MAX_USERS_STR)
+        if FLOOD_MAX_USERS <= 0:
+            raise ValueError
+    except (ValueError, TypeError):
+        FLOOD_MAX_USERS = 10000
+        logging.warning(f"Environment variable FLOOD_MAX_USERS is set incorrectly: {FLOOD_MAX_USERS_STR}. Using default value: {FLOOD_MAX_USERS}")
+
+HEALTH_CHECK_SECONDS = 5.0
+if HEALTH_CHECK_SECONDS_STR:
+    try:
+        HEALTH_CHECK_SECONDS = float(HEALTH_CHECK_SECONDS_STR)
+        if HEALTH_CHECK_SECONDS <= 0:
+            raise ValueError
+    except (ValueError, TypeError):
+        HEALTH_CHECK_SECONDS = 5.0
+        logging.warning(f"Environment variable HEALTH_CHECK_SECONDS is set incorrectly: {HEALTH_CHECK_SECONDS_STR}. Using default value: {HEALTH_CHECK_SECONDS}")
+
+HEALTH_MAX_LOOP_LAG_MS = 500
+if HEALTH_MAX_LOOP_LAG_MS_STR:
+    try:
+        HEALTH_MAX_LOOP_LAG_MS = int(HEALTH_MAX_LOOP_LAG_MS_STR)
+        if HEALTH_MAX_LOOP_LAG_MS <= 0:
+            raise ValueError
+    except (ValueError, TypeError):
+        HEALTH_MAX_LOOP_LAG_MS = 500
+        logging.warning(f"Environment variable HEALTH_MAX_LOOP_LAG_MS is set incorrectly: {HEALTH_MAX_LOOP_LAG_MS_STR}. Using default value: {HEALTH_MAX_LOOP_LAG_MS}")
+
+HEALTH_MAX_IN_FLIGHT = 100
+if HEALTH_MAX_IN_FLIGHT_STR:
+    try:
+        HEALTH_MAX_IN_FLIGHT = int(HEALTH_MAX_IN_FLIGHT_STR)
+        if HEALTH_MAX_IN_FLIGHT <= 0:
+            raise ValueError
+    except (ValueError, TypeError):
+        HEALTH_MAX_IN_FLIGHT = 100
+        logging.warning(f"Environment variable HEALTH_MAX_IN_FLIGHT is set incorrectly: {HEALTH_MAX_IN_FLIGHT_STR}. Using default value: {HEALTH_MAX_IN_FLIGHT}")
+
+
 # --- End configuration values ---
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -96,41 +315,515 @@ if not WEBHOOK_SECRET_PATH:
     exit(1)
 
 
-bot = Bot(token=API_TOKEN, timeout=60) # Timeout can be adjusted
-storage = MemoryStorage() # Consider FileStorage or RedisStorage for production state persistence
+class KeyboardRegistry:
+    """
+    Static keyboards (see @keyboards.static): a builder runs once per distinct arguments, and the same markup object
+    is returned after that. aiogram markups are frozen models, so sharing them is safe. The JSON sent to Telegram
+    is also kept per markup (KeyboardCachingSession), so a reply with a static keyboard neither constructs nor dumps models.
+    """
+
+    def __init__(self):
+        self.markups = {} # (builder name, *args) -> markup
+        self.payloads = {} # id(markup) -> [markup, serialized JSON or None until first sent]
+
+    def static(self, builder):
+        """Decorator for keyboard builders whose result depends only on their (hashable) arguments."""
+        name = builder.__name__
+
+        def get(*args, **kwargs):
+            key = (name, *args, *kwargs.items())
+            markup = self.markups.get(key)
+            if markup is None:
+                markup = self.markups[key] = builder(*args, **kwargs)
+                self.payloads[id(markup)] = [markup, None]
+            return markup
+
+        return functools.wraps(builder)(get)
+
+    def payload(self, markup, session, bot) -> str:
+        """Serialized JSON of a registry keyboard (dumped once); None for keyboards built per call."""
+        entry = self.payloads.get(id(markup))
+        if entry is None or entry[0] is not markup:
+            return None
+        if entry[1] is None:
+            entry[1] = session.prepare_value(markup, bot=bot, files={})
+        return entry[1]
+
+
+keyboards = KeyboardRegistry()
+
+
+class KeyboardCachingSession(AiohttpSession):
+    """AiohttpSession that sends registry keyboards as their cached JSON instead of dumping the markup on every request."""
+
+    def build_form_data(self, bot, method):
+        payload = keyboards.payload(getattr(method, 'reply_markup', None), self, bot)
+        if payload is None:
+            return super().build_form_data(bot, method)
+        form = super().build_form_data(bot, method.model_copy(update={'reply_markup': None}))
+        form.add_field('reply_markup', payload)
+        return form
+
+
+class FSMRecord:
+    __slots__ = ('state', 'data', 'tick')
+
+    def __init__(self):
+        self.state = None # State name
+        self.data = None # FSM data; None while empty
+        self.tick = None # Wheel tick at which the record expires
+
+
+class TTLMemoryStorage(BaseStorage):
+    """
+    In-memory FSM storage that forgets flows left idle for `ttl` seconds (aiogram's MemoryStorage keeps every
+    user who ever opened a flow, and even creates a record when a state is merely read).
+    Records are compact __slots__ objects under plain tuple keys; a record that goes back to no state and
+    no data is dropped at once. Expiry is a timer wheel of `resolution`-second ticks: touching a record moves
+    its key to the bucket of its new expiry tick, and each access sweeps the buckets of the ticks passed since
+    the previous one, so expiring costs O(expired keys) and needs no background task.
+    """
+
+    def __init__(self, ttl: int, resolution: int = 60, clock=time.monotonic):
+        self.ttl_ticks = -(-ttl // resolution) # TTL rounded up to whole ticks
+        self.resolution = resolution
+        self.clock = clock
+        self.records = {} # (bot_id, chat_id, user_id, thread_id, business_connection_id, destiny) -> FSMRecord
+        self.wheel = [set() for _ in range(self.ttl_ticks + 1)] # Keys by expiry tick % len(wheel)
+        self.tick = int(clock() // resolution) # Last swept tick
+        self.expired = 0 # Records expired since start
+
+    @staticmethod
+    def record_key(key: StorageKey) -> tuple:
+        return (key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny)
+
+    def sweep(self) -> int:
+        """Drops the records whose expiry tick has passed. Returns the current tick."""
+        now = int(self.clock() // self.resolution)
+        if now > self.tick:
+            size = len(self.wheel)
+            expired = 0
+            # A jump longer than the wheel visits every bucket once
+            for tick in range(max(self.tick + 1, now - size + 1), now + 1):
+                bucket = self.wheel[tick % size]
+                due = [key for key in bucket if self.records[key].tick <= now]
+                for key in due:
+                    bucket.discard(key)
+                    del self.records[key]
+                expired += len(due)
+            self.tick = now
+            if expired:
+                self.expired += expired
+                logger.info(f"FSM storage: {expired} idle flows expired, {len(self.records)} kept")
+        return now
+
+    def touch(self, key: tuple, record: FSMRecord, now: int):
+        """Keeps the record for another TTL, or drops it if it holds nothing."""
+        if record.state is None and not record.data:
+            self.records.pop(key, None)
+            if record.tick is not None:
+                self.wheel[record.tick % len(self.wheel)].discard(key)
+            return
+        due = now + self.ttl_ticks
+        if record.tick != due:
+            if record.tick is not None:
+                self.wheel[record.tick % len(self.wheel)].discard(key)
+            self.wheel[due % len(self.wheel)].add(key)
+            record.tick = due
+
+    def get_record(self, key: StorageKey, create: bool = False):
+        now = self.sweep()
+        record_key = self.record_key(key)
+        record = self.records.get(record_key)
+        if record is None and create:
+            record = self.records[record_key] = FSMRecord()
+        return record_key, record, now
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        record_key, record, now = self.get_record(key, create=state is not None)
+        if record is not None:
+            record.state = state.state if isinstance(state, State) else state
+            self.touch(record_key, record, now)
+
+    async def get_state(self, key: StorageKey):
+        record_key, record, now = self.get_record(key)
+        if record is None:
+            return None
+        self.touch(record_key, record, now)
+        return record.state
+
+    async def set_data(self, key: StorageKey, data) -> None:
+        record_key, record, now = self.get_record(key, create=bool(data))
+        if record is not None:
+            record.data = dict(data) if data else None
+            self.touch(record_key, record, now)
+
+    async def get_data(self, key: StorageKey) -> dict:
+        record_key, record, now = self.get_record(key)
+        if record is None:
+            return {}
+        self.touch(record_key, record, now)
+        return dict(record.data) if record.data else {}
+
+    async def close(self) -> None:
+        self.records.clear()
+        for bucket in self.wheel:
+            bucket.clear()
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def stats(self) -> dict:
+        """Size report: records kept (and how many are inside a flow), records expired since start."""
+        return {
+            'records': len(self.records),
+            'in_flow': sum(1 for record in self.records.values() if record.state is not None),
+            'expired': self.expired,
+            'ttl_seconds': self.ttl_ticks * self.resolution,
+        }
+
+
+bot = Bot(token=API_TOKEN, session=KeyboardCachingSession(timeout=60)) # Timeout can be adjusted
+storage = TTLMemoryStorage(FSM_TTL_SECONDS) # In memory: flows are lost on restart and forgotten after FSM_TTL_SECONDS idle
 dp = Dispatcher(storage=storage)
 db: aiosqlite.Connection = None # Global connection; initialized in main()
+district_index = None # PolygonIndex of Tashkent districts; loaded in main()
+zone_index = None # PolygonIndex of delivery zones; loaded in main(). None means "deliver anywhere"
+fts_enabled = False # Set by init_db() when the SQLite build supports FTS5
+subscription_scheduler = None # SubscriptionScheduler; started in main()
+slot_index = None # SlotIndex of delivery slot capacity; loaded in main(). None means no slot step
+settings_watcher = None # Task polling SETTINGS_FILE; started in main()
+
+
+# --- Database unit of work ---
+async def run_in_db(work, *args):
+    """
+    Runs `work(conn, *args)` on aiosqlite's thread with the plain sqlite3 connection, inside a savepoint: if it
+    raises, only its own statements are rolled back. The connection is shared, so the unit never commits or rolls
+    back the whole transaction: releasing the savepoint commits when no other coroutine has uncommitted writes
+    pending, otherwise the unit's writes are committed together with those.
+    Every `await db.execute(...)`/fetch/commit is its own hop to that thread; a unit of work is one hop
+    however many statements it runs, and no other coroutine's statements can interleave with it.
+    `work` is plain synchronous code: it must not touch the event loop or await anything.
+    """
+    def unit(conn):
+        conn.execute("SAVEPOINT unit_of_work")
+        try:
+            result = work(conn, *args)
+        except BaseException:
+            conn.execute("ROLLBACK TO unit_of_work")
+            conn.execute("RELEASE unit_of_work")
+            raise
+        conn.execute("RELEASE unit_of_work")
+        return result
+
+    return await db._execute(unit, db._conn)
 
 
 # --- Helper functions ---
+PHONE_CLEAN_RE = re.compile(r'[^\d+]') # Everything except digits and +
+PHONE_DIGITS_RE = re.compile(r'\D') # Everything except digits
+# Uzbek number = optional international/trunk prefix + 9-digit national number.
+# Old Tashkent numbers were written with the 371 area code, which is 71 today.
+UZ_PHONE_RE = re.compile(r'(?:00998|810998|998|8|0)?(?:3(71\d{7})|(\d{9}))')
+
+
+def normalize_phone(num: str):
+    """
+    Returns an Uzbek phone number in canonical E.164 form (+998XXXXXXXXX), or None if it is not one.
+
+    >>> normalize_phone('+998901234567')
+    '+998901234567'
+    >>> normalize_phone('998901234567')
+    '+998901234567'
+    >>> normalize_phone('+998 (90) 123-45-67')
+    '+998901234567'
+    >>> normalize_phone('90 123 45 67')
+    '+998901234567'
+    >>> normalize_phone('(90)1234567')
+    '+998901234567'
+    >>> normalize_phone('8 90 123 45 67')
+    '+998901234567'
+    >>> normalize_phone('00998 90 1234567')
+    '+998901234567'
+    >>> normalize_phone('8-10-998-90-123-45-67')
+    '+998901234567'
+    >>> normalize_phone('+998 71 123 45 67')
+    '+998711234567'
+    >>> normalize_phone('8 (371) 123-45-67')
+    '+998711234567'
+    >>> normalize_phone('+998 371 123 45 67')
+    '+998711234567'
+    >>> normalize_phone('889012345')
+    '+998889012345'
+    >>> normalize_phone('+7 916 123-45-67') is None
+    True
+    >>> normalize_phone('12345') is None
+    True
+    """
+    if not num:
+        return None
+    match = UZ_PHONE_RE.fullmatch(PHONE_DIGITS_RE.sub('', num))
+    if not match:
+        return None
+    return "+998" + (match.group(1) or match.group(2))
+
+
 def fmt_phone(num: str) -> str:
-    """Formats a phone number, removing excess characters."""
-    cleaned_num = re.sub(r'[^\D+]', '', num) # Keep digits and + symbol
-    # Optional: Add basic validation or re-formatting for Uzbekistan numbers
-    # Example: ensure it starts with +998
-    if cleaned_num and cleaned_num.startswith('998') and len(cleaned_num) == 12:
-         return f"+{cleaned_num}"
-    elif cleaned_num and len(cleaned_num) == 9 and cleaned_num.isdigit():
-         return f"+998{cleaned_num}"
-    elif cleaned_num and cleaned_num.startswith('+998') and len(cleaned_num) == 13:
-         return cleaned_num
-    # Fallback for other formats or invalid input, keep as is
-    return cleaned_num
+    """Formats a phone number: canonical +998... for Uzbek numbers, digits and + only for anything else."""
+    return normalize_phone(num) or PHONE_CLEAN_RE.sub('', num or '')
 
 
 def localize_date(dt: datetime, lang: str) -> str:
-    """Localizes date and time in a given format."""
-    day = dt.day
-    year = dt.year
-    time_str = dt.strftime("%H:%M")
-    if lang == "ru":
-        months = {1:"января", 2:"февраля", 3:"марта", 4:"апреля", 5:"мая", 6:"июня",
-                  7:"июля", 8:"августа", 9:"сентября", 10:"октября", 11:"ноября", 12:"декабря"}
-        return f"{day:02d} {months.get(dt.month, str(dt.month))} {year} г., {time_str}"
-    else: # uz
-        months = {1:"yanvar", 2:"fevral", 3:"mart", 4:"aprel", 5:"may", 6:"iyun",
-                  7:"iyul", 8:"avgust", 9:"sentyabr", 10:"oktyabr", 11:"noyabr", 12:"dekabr"}
-        return f"{day:02d} {months.get(dt.month, str(dt.month))} {year}, {time_str}"
+    """Localizes date and time with the language's 'date_format' and 'months' texts."""
+    texts = TEXT[lang]
+    return texts['date_format'].format(day=dt.day, month=texts['months'][dt.month - 1], year=dt.year, time=dt.strftime("%H:%M"))
+
+
+def local_now() -> datetime:
+    """Current time in TIMEZONE."""
+    return datetime.now(TIMEZONE)
+
+
+def local_timestamp(text: str) -> int:
+    """Unix time of a "YYYY-MM-DD HH:MM:SS" time in TIMEZONE. Raises ValueError."""
+    return int(datetime.strptime(text, "%Y-%m-%d %H:%M:%S").replace(tzinfo=TIMEZONE).timestamp())
+
+
+@functools.lru_cache(maxsize=4096)
+def localize_minute(minute: int, lang: str) -> str:
+    return localize_date(datetime.fromtimestamp(minute * 60, TIMEZONE), lang)
+
+
+def localize_ts(ts: int, lang: str) -> str:
+    """localize_date of a Unix timestamp in TIMEZONE. Cached per minute and language (order lists repeat the same few)."""
+    return localize_minute(int(ts) // 60, lang)
+
+
+def format_order_time(order_ts: int, order_time: str, lang: str) -> str:
+    """Localized order time; the stored order_time text for old rows whose order_ts could not be backfilled."""
+    return localize_ts(order_ts, lang) if order_ts is not None else (order_time or '-')
+
+# --- Offline geo lookup (point-in-polygon over a grid index) ---
+class PolygonIndex:
+    """
+    Point-in-polygon lookup over GeoJSON polygons.
+    Polygons are bucketed into a uniform lat/lon grid once at load time, so a lookup
+    only tests the few polygons whose bounding box covers the point's grid cell.
+    """
+
+    def __init__(self, features: list, cell_size: float = 0.01):
+        self.cell_size = cell_size
+        self.features = {} # feature id -> properties
+        self._polygons = [] # (feature id, bbox, rings); first ring is outer, others are holes
+        self._grid = {} # (row, col) -> list of indexes in self._polygons
+
+        for feature in features:
+            props = feature.get('properties') or {}
+            feature_id = props.get('id')
+            geometry = feature.get('geometry') or {}
+            if feature_id is None or geometry.get('type') not in ('Polygon', 'MultiPolygon'):
+                logger.warning(f"Skipping GeoJSON feature without id or polygon geometry: {props}")
+                continue
+            self.features[feature_id] = props
+            polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+            for polygon in polygons:
+                # GeoJSON stores points as [lon, lat]
+                rings = tuple(tuple((float(pt[0]), float(pt[1])) for pt in ring) for ring in polygon)
+                lons = [pt[0] for pt in rings[0]]
+                lats = [pt[1] for pt in rings[0]]
+                bbox = (min(lons), min(lats), max(lons), max(lats))
+                idx = len(self._polygons)
+                self._polygons.append((feature_id, bbox, rings))
+                for row in range(self._cell(bbox[1]), self._cell(bbox[3]) + 1):
+                    for col in range(self._cell(bbox[0]), self._cell(bbox[2]) + 1):
+                        self._grid.setdefault((row, col), []).append(idx)
+
+    def _cell(self, value: float) -> int:
+        return int(value // self.cell_size)
+
+    @staticmethod
+    def _in_ring(lon: float, lat: float, ring: tuple) -> bool:
+        """Ray casting test for a single ring."""
+        inside = False
+        x1, y1 = ring[-1]
+        for x2, y2 in ring:
+            if (y2 > lat) != (y1 > lat) and lon < (x1 - x2) * (lat - y2) / (y1 - y2) + x2:
+                inside = not inside
+            x1, y1 = x2, y2
+        return inside
+
+    def lookup(self, lat: float, lon: float):
+        """Returns the id of the feature containing the point, or None."""
+        for idx in self._grid.get((self._cell(lat), self._cell(lon)), ()):
+            feature_id, (min_lon, min_lat, max_lon, max_lat), rings = self._polygons[idx]
+            if not (min_lon <= lon <= max_lon and min_lat <= lat <= max_lat):
+                continue
+            if self._in_ring(lon, lat, rings[0]) and not any(self._in_ring(lon, lat, hole) for hole in rings[1:]):
+                return feature_id
+        return None
+
+    def name(self, feature_id, lang: str) -> str:
+        """Localized feature name (from 'ru'/'uz' properties), falls back to the id."""
+        props = self.features.get(feature_id) or {}
+        return props.get(lang) or props.get('ru') or str(feature_id)
+
+
+def load_polygon_index(path: str):
+    """Loads a GeoJSON FeatureCollection into a PolygonIndex. Returns None if the file is missing or invalid."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            collection = json.load(f)
+        index = PolygonIndex(collection.get('features', []))
+        logger.info(f"Loaded {len(index.features)} polygons from {path}")
+        return index
+    except FileNotFoundError:
+        logger.warning(f"GeoJSON file {path} not found. Lookup disabled.")
+    except (ValueError, TypeError, KeyError, IndexError) as e:
+        logger.error(f"Failed to load GeoJSON file {path}: {e}")
+    return None
+
+
+class EventBus:
+    """
+    In-process pub/sub for live order events (see /api/events).
+    Each event is serialized once; every subscriber has its own bounded queue, and a subscriber whose queue
+    is full is dropped (it gets None and should disconnect) so a slow consumer never holds up the bot.
+    """
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.last_event_id = 0
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(self.queue_size)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    def publish(self, event_type: str, data: dict):
+        """Queues an event for all subscribers (as a ready-to-send SSE frame). Never blocks."""
+        if not self.subscribers:
+            return
+        self.last_event_id += 1
+        payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str)
+        frame = f"id: {self.last_event_id}\nevent: {event_type}\ndata: {payload}\n\n".encode('utf-8')
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                # Slow consumer: drop it instead of buffering without bound
+                self.subscribers.discard(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+                logger.warning(f"Dropped a slow event subscriber (queue of {self.queue_size} events full)")
+
+    def close(self):
+        """Ends every subscriber's stream after the events already queued (on shutdown)."""
+        for queue in list(self.subscribers):
+            self.subscribers.discard(queue)
+            try:
+                queue.put_nowait(None)
+            except asyncio.QueueFull:
+                queue.get_nowait()
+                queue.put_nowait(None)
+
+
+event_bus = EventBus()
+
+
+class PriceBook:
+    """
+    Immutable compiled view of the prices table: price lists sorted by effective_from, each with volume tiers
+    sorted by min_quantity. A lookup is two bisects and no DB reads; a change builds a new PriceBook
+    and swaps the global `price_book` reference, so readers never see a half-updated list.
+    Lookups take Unix time (orders are priced by order_ts): effective_from, a time in TIMEZONE, is converted once here.
+    """
+    __slots__ = ('starts', 'start_ts', 'lists')
+
+    def __init__(self, rows):
+        """`rows`: (effective_from, min_quantity, price); rows with the same effective_from form one price list."""
+        lists = {}
+        for effective_from, min_quantity, price in rows:
+            lists.setdefault(effective_from, {})[min_quantity] = price
+        starts = []
+        for start in lists:
+            try:
+                starts.append((local_timestamp(start), start))
+            except ValueError:
+                logger.warning(f"Price list with invalid effective_from {start!r} ignored")
+        starts.sort()
+        self.start_ts = tuple(ts for ts, _ in starts)
+        self.starts = tuple(start for _, start in starts)
+        self.lists = tuple(
+            (tuple(sorted(lists[start])), tuple(lists[start][q] for q in sorted(lists[start])))
+            for start in self.starts
+        )
+
+    def index(self, at: int = None) -> int:
+        """Position of the list in effect at Unix time `at` (default now); -1 before the first one."""
+        return bisect.bisect_right(self.start_ts, time.time() if at is None else at) - 1
+
+    def tiers(self, at: int = None) -> list:
+        """[(min_quantity, price)] of the list in effect at `at` (Unix time, default now)."""
+        i = self.index(at)
+        return list(zip(*self.lists[i])) if i >= 0 else [(1, PRICE_PER_BOTTLE)]
+
+    def since(self, at: int = None) -> str:
+        """effective_from of the list in effect at `at`."""
+        i = self.index(at)
+        return self.starts[i] if i >= 0 else None
+
+    def upcoming(self, at: int = None) -> list:
+        """[(effective_from, tiers)] of the lists scheduled after `at`."""
+        return [(self.starts[j], list(zip(*self.lists[j]))) for j in range(self.index(at) + 1, len(self.starts))]
+
+    def unit_price(self, quantity: int = 1, at: int = None) -> int:
+        """Price per bottle for `quantity` bottles: the highest tier whose min_quantity <= quantity."""
+        i = self.index(at)
+        if i < 0:
+            return PRICE_PER_BOTTLE
+        min_quantities, prices = self.lists[i]
+        return prices[max(bisect.bisect_right(min_quantities, quantity) - 1, 0)]
+
+
+price_book = PriceBook(()) # Replaced by reload_price_book() once the DB is open
+
+
+async def reload_price_book():
+    """Compiles the prices table into a new PriceBook and swaps it in."""
+    global price_book
+    async with db.execute("SELECT effective_from, min_quantity, price FROM prices") as cur:
+        rows = await cur.fetchall()
+    price_book = PriceBook(rows)
+    logger.info(f"Price book loaded: {len(price_book.starts)} price lists, current tiers {price_book.tiers()}")
+
+
+def zone_price(zone: str = None):
+    """The delivery zone's flat price per bottle (property "price" in the zones file), or None."""
+    if zone and zone_index:
+        price = (zone_index.features.get(zone) or {}).get('price')
+        if price:
+            return int(price)
+    return None
+
+
+def price_per_bottle(zone: str = None, quantity: int = 1, at: int = None) -> int:
+    """Price per bottle for an order placed at Unix time `at` (default now); the delivery zone's price override wins over the volume tiers."""
+    return zone_price(zone) or price_book.unit_price(quantity, at)
+
+
+def quantity_prompt(lang: str, zone: str = None) -> str:
+    """Quantity prompt with the price per bottle and the volume discounts, if any apply."""
+    text = TEXT[lang]['input_quantity'].format(price=price_per_bottle(zone))
+    if zone_price(zone) is None:
+        text += "".join("\n" + TEXT[lang]['price_tier'].format(quantity=q, price=p) for q, p in price_book.tiers()[1:])
+    return text
+
 
 async def get_user_lang(user_id: int, state: FSMContext = None) -> str:
     """
@@ -154,7 +847,7 @@ async def get_user_lang(user_id: int, state: FSMContext = None) -> str:
         try:
             async with db.execute("SELECT language FROM clients WHERE user_id=?", (user_id,)) as cur:
                 row = await cur.fetchone()
-                if row and row[0]:
+                if row and row[0] in TEXT: # A language whose locale file was removed falls back to the default
                     # If found in DB, save to state for faster future access
                     if state:
                         try:
@@ -191,6 +884,525 @@ async def is_user_registered(user_id: int) -> bool:
         return False # Assume not registered in case of error
 
 
+# --- Saved address book ---
+SAVED_ADDRESS_PREFIX = "📌 " # Saved address buttons in kb_location start with this
+SAVED_ADDRESSES_LIMIT = 3 # How many recently used addresses to offer at the location step
+
+
+def address_key(address: str, lat: float, lon: float) -> str:
+    """Key used to deduplicate address book entries: normalized address text, or rounded coordinates (~10 m)."""
+    if address:
+        return " ".join(address.lower().split())
+    return f"{lat:.4f},{lon:.4f}"
+
+
+async def location_keyboard(uid: int, lang: str, state: FSMContext):
+    """
+    kb_location with the user's most recently used saved addresses.
+    Remembers which button text maps to which address_id in FSM data.
+    """
+    rows = []
+    if db:
+        try:
+            async with db.execute(
+                "SELECT address_id, address, district FROM addresses WHERE user_id=? ORDER BY last_used DESC LIMIT ?",
+                (uid, SAVED_ADDRESSES_LIMIT)
+            ) as cur:
+                rows = await cur.fetchall()
+        except Exception as e:
+            logger.error(f"Error loading saved addresses for user {uid}: {e}")
+
+    buttons = {}
+    for i, (address_id, address, district) in enumerate(rows, 1):
+        label = address or (district_index.name(district, lang) if district and district_index else TEXT[lang]['location'])
+        if len(label) > 40:
+            label = label[:39] + "…"
+        buttons[f"{SAVED_ADDRESS_PREFIX}{i}. {label}"] = address_id
+    await state.update_data(saved_addresses=buttons)
+    return kb_location(lang, list(buttons))
+
+
+# --- Delivery time slots ---
+class SlotIndex:
+    """
+    Reserved bottles per (date, slot), held in memory so the slot keyboard is built without a query per slot.
+    slot_reservations stays the source of truth: a reservation is a conditional UPDATE in the order transaction
+    that fails when the slot would overflow, and the index takes the value returned by that UPDATE.
+    """
+
+    def __init__(self, slots: dict, days_ahead: int):
+        self.slots = slots # "HH:MM-HH:MM" -> capacity in bottles
+        self.days_ahead = days_ahead
+        self.reserved = {} # ("YYYY-MM-DD", slot) -> bottles reserved
+
+    async def load(self):
+        """Reads reservations from today on (past days are never offered again)."""
+        today = local_now().strftime("%Y-%m-%d")
+        async with db.execute("SELECT slot_date, slot, reserved FROM slot_reservations WHERE slot_date >= ?", (today,)) as cur:
+            self.reserved = {(slot_date, slot): reserved for slot_date, slot, reserved in await cur.fetchall()}
+        logger.info(f"Delivery slots loaded: {len(self.slots)} per day, {len(self.reserved)} with reservations")
+
+    def remaining(self, slot_date: str, slot: str) -> int:
+        return self.slots.get(slot, 0) - self.reserved.get((slot_date, slot), 0)
+
+    def available(self, quantity: int, now: datetime) -> list:
+        """(date, slot) pairs that can still take `quantity` bottles, soonest first. Today's started slots are skipped."""
+        current_time = now.strftime("%H:%M")
+        result = []
+        for offset in range(self.days_ahead):
+            slot_date = (now + timedelta(days=offset)).strftime("%Y-%m-%d")
+            for slot in self.slots:
+                if offset == 0 and slot[:5] <= current_time:
+                    continue
+                if self.remaining(slot_date, slot) >= quantity:
+                    result.append((slot_date, slot))
+        return result
+
+    def reserve(self, conn, slot_date: str, slot: str, quantity: int) -> tuple:
+        """
+        Reserves `quantity` bottles in the slot inside the caller's unit of work (run_in_db, so on the DB thread).
+        Returns (ok, reserved): False if the slot can no longer take them, and the slot's reserved bottles
+        for the caller to store in `self.reserved` once the unit of work is committed.
+        """
+        capacity = self.slots.get(slot)
+        if capacity is None: # Slot removed from DELIVERY_SLOTS after it was offered
+            return False, None
+        conn.execute("INSERT INTO slot_reservations(slot_date, slot) VALUES(?, ?) ON CONFLICT DO NOTHING", (slot_date, slot))
+        rows = conn.execute(
+            "UPDATE slot_reservations SET reserved = reserved + ? WHERE slot_date = ? AND slot = ? AND reserved + ? <= ? RETURNING reserved",
+            (quantity, slot_date, slot, quantity, capacity)
+        ).fetchall()
+        if not rows:
+            # Full: return the current count, so the index is resynced in case it was behind the DB
+            rows = conn.execute("SELECT reserved FROM slot_reservations WHERE slot_date = ? AND slot = ?", (slot_date, slot)).fetchall()
+            return False, rows[0][0]
+        return True, rows[0][0]
+
+    def release(self, slot_date: str, slot: str, quantity: int):
+        """Mirrors the orders_slot_release trigger (a rejected order frees its bottles)."""
+        key = (slot_date, slot)
+        if key in self.reserved:
+            self.reserved[key] = max(self.reserved[key] - quantity, 0)
+
+
+def format_delivery_slot(slot_date: str, slot: str, lang: str, now: datetime = None) -> str:
+    """
+    "21.10, 09:00-13:00". With `now`, today and tomorrow are named instead ("Сегодня, 09:00-13:00");
+    texts that stay around (admin cards) are rendered without it.
+    """
+    day = f"{slot_date[8:10]}.{slot_date[5:7]}"
+    if now is not None:
+        offset = (datetime.strptime(slot_date, "%Y-%m-%d").date() - now.date()).days
+        day = {0: TEXT[lang]['today'], 1: TEXT[lang]['tomorrow']}.get(offset, day)
+    return f"{day}, {slot}"
+
+
+async def ask_delivery_slot(message: types.Message, state: FSMContext, lang: str) -> bool:
+    """
+    Offers the delivery slots that can take the order (from slot_index, no queries) and moves to OrderForm.slot.
+    Returns False if the slot step is off or every slot is full; the order then goes without a slot.
+    """
+    await state.update_data(delivery_date=None, delivery_slot=None)
+    if not slot_index:
+        return False
+    data = await state.get_data()
+    now = local_now()
+    options = {format_delivery_slot(slot_date, slot, lang, now): [slot_date, slot]
+               for slot_date, slot in slot_index.available(data['quantity'], now)}
+    if not options:
+        await message.reply(TEXT[lang]['no_slots_available'])
+        return False
+    await state.update_data(slot_options=options)
+    await message.reply(TEXT[lang]['choose_slot'], reply_markup=kb_slots(lang, list(options)))
+    await state.set_state(OrderForm.slot)
+    return True
+
+
+# --- Order message templates ---
+class MessageTemplate:
+    """
+    A message template compiled once: every line is pre-split into literal text and fields (str.format syntax).
+    Rendering is a single pass over the parts. A line whose fields are all empty (None, "" or False) is left out,
+    so optional lines (district, zone, slot...) need no branching in the callers; True fills a field with nothing
+    (for flag lines like "out of zone").
+    """
+    __slots__ = ('lines',)
+
+    def __init__(self, source: str):
+        self.lines = tuple(
+            tuple((literal, field, spec) for literal, field, spec, _ in string.Formatter().parse(line))
+            for line in source.split('\n')
+        )
+
+    def render(self, values: dict, escape: bool = False) -> str:
+        """`escape`: HTML-escape the values (for parse_mode=HTML messages); the template's own markup is kept."""
+        out = []
+        for parts in self.lines:
+            chunks, has_fields, filled = [], False, False
+            for literal, field, spec in parts:
+                chunks.append(literal)
+                if field is None:
+                    continue
+                has_fields = True
+                value = values.get(field)
+                if value is None or value == "" or value is False:
+                    continue
+                filled = True
+                if value is not True:
+                    text = format(value, spec)
+                    chunks.append(html.escape(text) if escape else text)
+            if filled or not has_fields:
+                out.append("".join(chunks))
+        return "\n".join(out)
+
+
+ORDER_TEMPLATES = {} # lang -> {'summary', 'admin', 'status'}: MessageTemplate; filled by order_templates()
+ADMIN_TEXT_CACHE_SIZE = 1000
+admin_text_cache = OrderedDict() # (order_id, lang, status, client name/username/contact) -> rendered admin notification (LRU)
+
+
+def order_templates(lang: str) -> dict:
+    """
+    The order templates of a language, compiled on first use.
+    The three order messages share the 'order_details' block, joined in at compile time.
+    """
+    templates = ORDER_TEMPLATES.get(lang)
+    if templates is None:
+        texts = TEXT[lang]
+        details = texts['order_details']
+        templates = ORDER_TEMPLATES[lang] = {
+            'summary': MessageTemplate(texts['order_summary'] + "\n\n" + details),
+            'admin': MessageTemplate(texts['admin_order_header'] + "\n\n" + details + "\n" + texts['admin_order_footer']),
+            'status': MessageTemplate(texts['client_status_update'].replace('{order_summary}', details)),
+        }
+    return templates
+
+
+def reset_order_templates():
+    """Drops the compiled templates and rendered admin texts (after text overrides change)."""
+    ORDER_TEMPLATES.clear()
+    admin_text_cache.clear()
+    localize_minute.cache_clear()
+
+
+def order_template_values(order: dict, lang: str, now: datetime = None) -> dict:
+    """
+    Values for the order templates from an order card (or FSM order data shaped like one).
+    `now` names the slot day relatively ("Сегодня"), for messages that are read right away.
+    """
+    name = order.get('name') or TEXT[lang]['not_specified']
+    district, zone, quantity = order.get('district'), order.get('zone'), order['quantity']
+    status_key = order.get('status') or 'pending'
+    order_time = format_order_time(order.get('order_ts'), order.get('order_time'), lang)
+    return {
+        'order_id': order.get('order_id'),
+        'user_id': order.get('user_id'),
+        'name': f"{name} (@{order['username']})" if order.get('username') else name,
+        'contact': order.get('contact') or order.get('client_contact') or TEXT[lang]['not_specified'],
+        'additional_contact': order.get('additional_contact') or '–',
+        'address': order.get('address') or (TEXT[lang]['location_not_specified'] if order.get('location_lat') is None else TEXT[lang]['location']),
+        # District resolved from the location (only for geolocation orders inside a known district)
+        'district': district_index.name(district, lang) if district and district_index else None,
+        'zone': zone_index.name(zone, lang) if zone and zone_index else None,
+        # In 'flag' mode out-of-zone locations are accepted, but admins must see it before accepting the order
+        'out_of_zone': not zone and zone_index is not None and order.get('location_lat') is not None,
+        'subscription_id': order.get('subscription_id'),
+        'slot': format_delivery_slot(order['delivery_date'], order['delivery_slot'], lang, now) if order.get('delivery_slot') else None,
+        'quantity': quantity,
+        'total': order.get('total') or quantity * price_per_bottle(zone, quantity, order.get('order_ts')),
+        'order_time': order_time,
+        'status': status_text(status_key, lang),
+    }
+
+
+def build_order_summary(lang: str, data: dict, client: dict) -> str:
+    """
+    Order summary shown to the customer before confirmation.
+    `data` is the FSM order data, `client` holds name/contact/username from DB (preferred over FSM data).
+    """
+    order = {
+        **data,
+        'name': client.get('name') or data.get('name'),
+        'username': client.get('username'),
+        'contact': client.get('contact') or data.get('contact'),
+        'total': data['quantity'] * price_per_bottle(data.get('zone'), data['quantity']),
+    }
+    return order_templates(lang)['summary'].render(order_template_values(order, lang, local_now()))
+
+
+# --- Admin order notifications ---
+FINAL_STATUSES = ('completed', 'rejected') # Keys of final statuses
+OPEN_STATUSES = ('pending', 'accepted', 'in_progress') # Orders still waiting for admins
+# Literal (not bound parameters) so SQLite can match it against the idx_orders_open partial index
+OPEN_STATUSES_SQL = "status IN (" + ", ".join(f"'{status}'" for status in OPEN_STATUSES) + ")"
+STATUS_NOTIFY_CONCURRENCY = 5 # Orders notified in parallel after a (bulk) status change, keeps us under Telegram flood limits
+
+
+# Everything needed to render an order: the order row + client info.
+# Client columns are scalar subqueries (not a JOIN) so the same list works in UPDATE ... RETURNING.
+ORDER_CARD_COLUMNS = (
+    "order_id, user_id, contact, additional_contact, address, location_lat, location_lon, "
+    "district, zone, quantity, unit_price, total, order_time, order_ts, status, subscription_id, delivery_date, delivery_slot, "
+    "(SELECT name FROM clients c WHERE c.user_id = orders.user_id) AS name, "
+    "(SELECT username FROM clients c WHERE c.user_id = orders.user_id) AS username, "
+    "(SELECT contact FROM clients c WHERE c.user_id = orders.user_id) AS client_contact, "
+    "(SELECT language FROM clients c WHERE c.user_id = orders.user_id) AS language"
+)
+
+
+async def fetch_order_card(order_id: int):
+    """Loads everything needed to render an order in one query. Returns a dict or None."""
+    async with db.execute(f"SELECT {ORDER_CARD_COLUMNS} FROM orders WHERE order_id=?", (order_id,)) as cur:
+        row = await cur.fetchone()
+        if row is None:
+            return None
+        return dict(zip([col[0] for col in cur.description], row))
+
+
+async def transition_orders_status(order_ids: list, action: str, admin_id: int) -> list:
+    """
+    Applies an admin action (see ORDER_STATUS_TRANSITIONS) to orders as one compare-and-set UPDATE
+    (a single statement, so a single transaction).
+    Returns the cards of the orders actually changed, sorted by order_id. Orders that do not exist or whose
+    current status does not allow the action (e.g. another admin changed it first) are left untouched.
+    Status changes are recorded in order_status_history by a trigger.
+    """
+    if not order_ids:
+        return []
+    new_status, allowed = ORDER_STATUS_TRANSITIONS[action]
+    async with db.execute(
+        f"UPDATE orders SET status=?, status_admin_id=? "
+        f"WHERE order_id IN ({', '.join('?' * len(order_ids))}) AND status IN ({', '.join('?' * len(allowed))}) "
+        f"RETURNING {ORDER_CARD_COLUMNS}",
+        (new_status, admin_id, *order_ids, *allowed)
+    ) as cur:
+        rows = await cur.fetchall()
+        columns = [col[0] for col in cur.description or ()]
+    await db.commit()
+    orders = sorted((dict(zip(columns, row)) for row in rows), key=lambda order: order['order_id'])
+    for order in orders:
+        if new_status == 'rejected' and order.get('delivery_slot') and slot_index:
+            slot_index.release(order['delivery_date'], order['delivery_slot'], order['quantity'])
+        event_bus.publish('order_status', {**order, 'admin_id': admin_id})
+    return orders
+
+
+async def transition_order_status(order_id: int, action: str, admin_id: int):
+    """Single-order version of transition_orders_status(). Returns the updated order card or None."""
+    orders = await transition_orders_status([order_id], action, admin_id)
+    return orders[0] if orders else None
+
+
+def render_admin_order_text(order: dict, lang: str = 'ru', log: dict = None) -> str:
+    """
+    Text of the order notification in admin chats and the group (HTML), in the recipient's language.
+    Rendered from order data, so every copy can be re-rendered on status change; cached per (order_id, lang, status)
+    and the client's current name, username and contact, so a client who changes them gets a new entry.
+    `log` (admin_name, admin_username) appends the "changed by" line.
+    """
+    status_key = order.get('status') or 'pending'
+    key = (order['order_id'], lang, status_key, order.get('name'), order.get('username'), order.get('contact') or order.get('client_contact'))
+    text = admin_text_cache.get(key)
+    if text is None:
+        text = order_templates(lang)['admin'].render(order_template_values(order, lang), escape=True)
+        admin_text_cache[key] = text
+        if len(admin_text_cache) > ADMIN_TEXT_CACHE_SIZE:
+            admin_text_cache.popitem(last=False)
+    else:
+        admin_text_cache.move_to_end(key)
+    if log:
+        log_message = TEXT[lang]['admin_status_update_log'].format(
+            order_id=order['order_id'], status=status_text(status_key, lang), **log
+        )
+        text += f"\n\n<i>{html.escape(log_message)}</i>"
+    return text
+
+
+async def chat_languages(chat_ids) -> dict:
+    """Language of each admin chat: the admin's own language for private chats, Russian for the group."""
+    langs = dict.fromkeys(chat_ids, 'ru')
+    private_ids = [chat_id for chat_id in langs if chat_id > 0]
+    if private_ids and db:
+        rows = await db.execute_fetchall(
+            f"SELECT user_id, language FROM clients WHERE user_id IN ({', '.join('?' * len(private_ids))})", private_ids
+        )
+        langs.update({user_id: lang for user_id, lang in rows if lang in TEXT})
+    return langs
+
+
+async def refresh_admin_order_messages(order: dict, log: dict = None, extra_message: tuple = None):
+    """
+    Re-renders every tracked copy of the order notification (admin chats + group) concurrently,
+    once per distinct chat language. Buttons follow the new status; final orders lose them so nobody can
+    click a stale copy. `extra_message` is a (chat_id, message_id) to update as well, e.g. an untracked copy an admin clicked.
+    """
+    order_id = order['order_id']
+    async with db.execute("SELECT chat_id, message_id FROM order_messages WHERE order_id=?", (order_id,)) as cur:
+        copies = {(row[0], row[1]) for row in await cur.fetchall()}
+    if extra_message:
+        copies.add(extra_message)
+
+    langs = await chat_languages({chat_id for chat_id, _ in copies})
+    rendered = {
+        lang: (render_admin_order_text(order, lang, log), kb_admin_order_status(order_id, lang, order.get('status') or 'pending'))
+        for lang in set(langs.values())
+    }
+    results = await asyncio.gather(
+        *(bot.edit_message_text(rendered[langs[chat_id]][0], chat_id=chat_id, message_id=message_id,
+                                parse_mode=ParseMode.HTML, reply_markup=rendered[langs[chat_id]][1])
+          for chat_id, message_id in copies),
+        return_exceptions=True
+    )
+    for (chat_id, message_id), result in zip(copies, results):
+        if isinstance(result, Exception) and "message is not modified" not in str(result):
+            logger.warning(f"Failed to update order message {order_id} in chat {chat_id} (message {message_id}): {result}")
+
+
+def render_client_status_update(order: dict) -> str:
+    """Status update notification for the client, in the client's language."""
+    client_lang = order.get('language') or 'ru' # Client's language (loaded with the order)
+    return order_templates(client_lang)['status'].render(order_template_values(order, client_lang))
+
+
+async def notify_status_changes(orders: list, admin_name: str, admin_username: str, extra_message: tuple = None):
+    """
+    Fan-out after status changes: re-renders the admin copies of every order and notifies the clients.
+    Orders are processed concurrently, STATUS_NOTIFY_CONCURRENCY at a time.
+    `extra_message` is passed to refresh_admin_order_messages (meant for single-order changes).
+    """
+    semaphore = asyncio.Semaphore(STATUS_NOTIFY_CONCURRENCY)
+
+    async def notify_one(order):
+        async with semaphore:
+            log = {'admin_name': admin_name, 'admin_username': admin_username}
+            await refresh_admin_order_messages(order, log, extra_message=extra_message)
+            try:
+                await bot.send_message(order['user_id'], render_client_status_update(order))
+            except Exception as e:
+                # Client might have blocked the bot or chat doesn't exist
+                logger.error(f"Failed to send status update notification for order {order['order_id']} to client {order['user_id']}: {e}")
+
+    await asyncio.gather(*(notify_one(order) for order in orders))
+
+
+async def notify_new_order(order: dict):
+    """
+    Sends a new order to admins and the group (with status buttons and location), remembers every copy
+    in order_messages and publishes it to the live feed. Used by confirm_order and the subscription scheduler.
+    """
+    order_id = order['order_id']
+    location_lat, location_lon = order.get('location_lat'), order.get('location_lon')
+    event_bus.publish('order_created', order) # Live feed for dispatch screens
+
+    # Collect all recipients (admins + group chat if configured)
+    all_recipients = set(settings.admin_ids)
+    if settings.group_chat_id is not None:
+        all_recipients.add(settings.group_chat_id)
+
+    # Notify admins and group with inline status buttons, rendered once per recipient language
+    langs = await chat_languages(all_recipients)
+    rendered = {lang: (render_admin_order_text(order, lang), kb_admin_order_status(order_id, lang)) for lang in set(langs.values())}
+
+    async def notify_chat(chat_id):
+        """Sends the notification (and location) to one chat; returns the notification message or None."""
+        text, kb = rendered[langs[chat_id]]
+        try:
+            # Send text message first
+            sent = await bot.send_message(chat_id, text, parse_mode=ParseMode.HTML, reply_markup=kb)
+            # Then send location if available
+            if location_lat is not None and location_lon is not None:
+                await bot.send_location(chat_id, location_lat, location_lon)
+            return sent
+        except Exception as e:
+            # Log error if sending to a specific chat fails, but continue
+            logger.error(f"Failed to send order notification {order_id} to chat {chat_id}: {e}")
+            return None
+
+    # Send notification message and location to all recipients concurrently
+    sent_messages = await asyncio.gather(*(notify_chat(chat_id) for chat_id in all_recipients))
+
+    # Remember every copy so status changes can update all of them
+    copies = [(order_id, sent.chat.id, sent.message_id) for sent in sent_messages if sent is not None]
+    if copies and db:
+        try:
+            await run_in_db(lambda conn: conn.executemany(
+                "INSERT OR IGNORE INTO order_messages(order_id, chat_id, message_id) VALUES(?, ?, ?)", copies
+            ))
+        except Exception as e:
+            logger.error(f"Failed to save notification message ids for order {order_id}: {e}")
+
+
+# --- Flood control ---
+class FloodControlMiddleware(BaseMiddleware):
+    """
+    Outer update middleware: a token bucket per user (`burst` updates in a row, refilled at `rate` per second).
+    Over-limit updates are dropped before any handler or DB access; the first dropped one is answered with a short
+    notice in the user's language from the FSM data (in Russian and Uzbek if it is not known); later dropped callback
+    queries are answered without text, so the client's button does not spin until it times out. Admins are exempt.
+    Buckets live in an OrderedDict kept in LRU order and capped at `max_users`: a user evicted from it
+    had been quiet for longer than any of the others, so their bucket would have been full anyway.
+    """
+
+    def __init__(self, rate: float, burst: int, max_users: int, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self.clock = clock
+        self.buckets = OrderedDict() # user_id -> [tokens, last refill time, notified since last allowed update]
+
+    def allow(self, user_id: int) -> tuple:
+        """(allowed, notify): whether the update may pass, and if not, whether to send the notice."""
+        now = self.clock()
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = self.buckets[user_id] = [float(self.burst), now, False]
+            if len(self.buckets) > self.max_users:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(user_id)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = False
+            return True, False
+        notify = not bucket[2]
+        bucket[2] = True
+        return False, notify
+
+    async def __call__(self, handler, event: types.Update, data: dict):
+        user = data.get('event_from_user')
+        if user is None or is_admin(user.id):
+            return await handler(event, data)
+        allowed, notify = self.allow(user.id)
+        if allowed:
+            return await handler(event, data)
+        notice = None
+        if notify:
+            logger.warning(f"Flood control: dropping updates from user {user.id}")
+            notice = await self.notice(data.get('state'))
+        try:
+            if event.callback_query:
+                await event.callback_query.answer(notice)
+            elif notice and event.message and event.message.chat.type == ChatType.PRIVATE:
+                await bot.send_message(event.message.chat.id, notice)
+        except Exception as e:
+            logger.warning(f"Failed to answer dropped update from user {user.id}: {e}")
+        return None
+
+    @staticmethod
+    async def notice(state: FSMContext = None) -> str:
+        """The flood notice in the language kept in the user's FSM data (in memory, set by the outer FSM middleware)."""
+        lang = (await state.get_data()).get('language') if state else None
+        if lang in TEXT:
+            return TEXT[lang]['flood_wait']
+        return TEXT['ru']['flood_wait'] + "\n" + TEXT['uz']['flood_wait']
+
+
+if FLOOD_RATE > 0:
+    dp.update.outer_middleware(FloodControlMiddleware(FLOOD_RATE, FLOOD_BURST, FLOOD_MAX_USERS))
+
+
 # --- FSM States ---
 class LangSelect(StatesGroup):
     choosing = State()
@@ -202,178 +1414,419 @@ class OrderForm(StatesGroup):
     address = State() # Text address, required after location
     additional = State()
     quantity = State()
+    slot = State() # Delivery time slot (skipped when DELIVERY_SLOTS is empty)
     confirm = State()
 
 class AdminStates(StatesGroup):
     main = State() # Main admin menu
     confirm_clear_clients = State()
     confirm_clear_orders = State()
-    # Possibility to add state for order management if it becomes complex
+    bulk_status = State() # Bulk status panel: selected orders are kept in FSM data
 
 # --- Localized Texts and Buttons ---
-TEXT = {
-    'ru': {
-        'choose_language': "Выберите язык:",
-        'welcome': "👋 Добро пожаловать, {name}!",
-        'greeting_prompt': "👋 Добро пожаловать, {name}!\n\n", # Added separate text for greeting before the next step
-        'send_contact': "Для начала, пожалуйста, отправьте ваш номер телефона.",
-        'prompt_contact': "Пожалуйста, нажмите кнопку '📞 Отправить контакт' для отправки вашего номера.",
-        'contact_saved': "✅ Контакт сохранён. Теперь введите ваше полное имя (имя и фамилия) или отправьте фото паспорта.",
-        'please_full_name': "Пожалуйста, введите полное имя и фамилию текстом (например, 'Иван Иванов'), либо отправьте фото паспорта.",
-        'name_saved': "Спасибо, {name}! Теперь отправьте локацию или введите адрес вручную.",
-        'send_location': "Отправьте геолокацию или введите адрес вручную.",
-        'address_prompt': "Укажите полный адрес доставки: район, улицу, номер дома и квартиры (если есть).",
-        'additional_prompt': "Укажите дополнительный контактный номер (например, номер соседей или родственников) или нажмите 'Пропустить'.",
-        'input_quantity': "Введите количество бутылей (шт.).\nЦена за бутылку: {price:,} сум.",
-        'order_summary': "🛍️ Подтвердите ваш заказ:",
-        'order_confirmed': "✅ Ваш заказ принят! Мы скоро свяжемся с вами для уточнения деталей.",
-        'order_cancelled': "❌ Заказ отменён. Нажмите /start или '🔄 Начать сначала' для нового заказа.",
-        'main_menu': "🏠 Главное меню:",
-        'change_lang': "🔄 Сменить язык", # Language change button text
-        'my_orders_title': "📦 Мои заказы:",
-        'no_orders': "У вас пока нет заказов.",
-        'order_info': "№{order_id} | {order_time} | {quantity} шт | Статус: {status}\nАдрес: {address}",
-        'access_denied': "🚫 У вас нет доступа к этой команде.",
-        'choose_admin_action': "🔧 Выберите действие с базой данных:",
-        'clear_clients_confirm': "⚠️ Вы уверены, что хотите УДАЛИТЬ ВСЕХ клиентов И ИХ ЗАКАЗЫ? Это необратимо.",
-        'clear_orders_confirm': "⚠️ Вы уверены, что хотите УДАЛИТЬ ВСЕ заказы? Это необратимо.",
-        'db_clients_cleared': "✅ База данных клиентов (и заказов) очищена.",
-        'db_orders_cleared': "✅ База данных заказов очищена.",
-        'action_cancelled': "Действие отменено.",
-        'feature_not_implemented': "🚧 Эта функция пока не реализована.",
-        'invalid_input': "Неверный ввод. Пожалуйста, попробуйте еще раз или отмените процесс.",
-        'back_to_main': "Возврат в главное меню.",
-        'process_cancelled': "Процесс отменен.",
-        'error_processing': "Произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте снова или свяжитесь с поддержкой.",
-        'location_not_specified': 'Локация не указана',
-         'by_photo': 'по фото', # Placeholder when name is passport photo
-        # Order statuses (keys should be consistent with DB)
-        'status_pending': 'Ожидание обработки',
-        'status_accepted': 'Принят',
-        'status_in_progress': 'В работе',
-        'status_completed': 'Выполнен',
-        'status_rejected': 'Отменен',
-        # Admin status buttons (inline) - text for buttons shown to ADMIN
-        'admin_status_accept': '✅ Принять',
-        'admin_status_reject': '❌ Отменить',
-        'admin_status_complete': '📦 Выполнить',
-        # Client notifications about status change
-        'client_status_update': "📦 Статус вашего заказа №{order_id} обновлен: {status}\n\n{order_summary}",
-        'admin_status_update_log': "Заказ №{order_id} переведен в статус '{status}' админом {admin_name} (@{admin_username}).",
-        'order_already_finalized': "Статус заказа №{order_id} уже финальный ({status}). Изменение невозможно.",
-        'order_not_found': "Заказ с ID {order_id} не найден.",
-        'not_specified': 'Не указано', # For contact/name if missing
-    },
-    'uz': {
-        'choose_language': "Tilni tanlang:",
-        'welcome': "👋 Xush kelibsiz, {name}!",
-        'greeting_prompt': "👋 Xush kelibsiz, {name}!\n\n", # Added separate text
-        'send_contact': "Boshlash uchun, iltimas, telefon raqamingizni yuboring.",
-        'prompt_contact': "Iltimas, raqamingizni yuborish uchun '📞 Kontaktni yuborish' tugmasini bosing.",
-        'contact_saved': "✅ Kontakt saqlandi. Endi to'liq ism va familiyangizni kiriting yoki pasport rasmini yuboring.",
-        'please_full_name': "Iltimas, to'liq ism va familiyangizni matn shaklida kiriting (masalan, 'Ali Aliyev'), yoki pasport rasmini yuboring.",
-        'name_saved': "Rahmat, {name}! Endi joylashuvingizni yuboring yoki manzilingizni qo'lda kiriting.",
-        'send_location': "Geolokatsiyani yuboring yoki manzilni qo'lda kiriting.",
-        'address_prompt': "To'liq yetkazib berish manzilini kiriting: tuman, ko'cha, uy va kvartira raqami (agar mavjud bo'lsa).",
-        'additional_prompt': "Qo'shimcha aloqa raqamini kiriting (masalan, qo'shnilar yoki qarindoshlaringiz raqami) yoki 'O'tkazib yuborish' tugmasini bosing.",
-        'input_quantity': "Iltimos, butilkalar sonini kiriting (dona).\nButilka narxi: {price:,} so'm.",
-        'order_summary': "🛍️ Buyurtmangizni tasdiqlang:",
-        'order_confirmed': "✅ Buyurtmangiz qabul qilindi! Tafsilotlarni aniqlash uchun tez orada siz bilan bog'lanamiz.",
-        'order_cancelled': "❌ Buyurtma bekor qilindi. Yangi buyurtma berish uchun /start yoki '🔄 Yangi boshlash' tugmasini bosing.",
-        'main_menu': "🏠 Bosh menyu:",
-        'change_lang': "🔄 Tilni almashtirish", # Language change button text
-        'my_orders_title': "📦 Mening buyurtmalarim:",
-        'no_orders': "Sizda hali buyurtmalar yo'q.",
-        'order_info': "№{order_id} | {order_time} | {quantity} dona | Holati: {status}\nManzil: {address}",
-        'access_denied': "🚫 Bu buyruqqa ruxsat yo'q.",
-        'choose_admin_action': "🔧 Ma'lumotlar bazasi bilan amalni tanlang:",
-        'clear_clients_confirm': "⚠️ BARCHA mijozlarni VA ULARNING BUYURTMALARINI O'CHIRIB yubormoqchimisiz? Bu qaytarilmaydigan amal.",
-        'clear_orders_confirm': "⚠️ BARCHA buyurtmalarni O'CHIRIB yubormoqchimisiz? Bu qaytarilmaydigan amal.",
-        'db_clients_cleared': "✅ Mijozlar (va buyurtmalar) ma'lumotlar bazasi tozalandi.",
-        'db_orders_cleared': "✅ Buyurtmalar ma'lumotlar bazasi tozalandi.",
-        'action_cancelled': "Amal bekor qilindi.",
-        'feature_not_implemented': "🚧 Bu funksiya hali ishga tushirilmagan.",
-        'invalid_input': "Noto'g'ri kiritish. Iltimas, qaytadan urinib ko'ring yoki jarayonni bekor qiling.",
-        'back_to_main': "Bosh menyuga qaytish.",
-        'process_cancelled': "Jarayon bekor qilindi.",
-        'error_processing': "So'rovingizni qayta ishlashda xatolik yuz berdi. Iltimas, qaytadan urinib ko'ring yoki qo'llab-quvvatlash xizmati bilan bog'laning.",
-        'location_not_specified': 'Joylashuv belgilanmagan',
-        'by_photo': 'fotosurat orqali', # Placeholder when name is passport photo
-        # Order statuses (keys should be consistent with DB)
-        'status_pending': 'Ishlov berish kutilmoqda',
-        'status_accepted': 'Qabul qilindi',
-        'status_in_progress': 'Jarayonda',
-        'status_completed': 'Bajarildi',
-        'status_rejected': 'Bekor qilindi',
-        # Admin status buttons (inline) - text for buttons shown to ADMIN
-        'admin_status_accept': '✅ Qabul qilish',
-        'admin_status_reject': '❌ Bekor qilish',
-        'admin_status_complete': '📦 Bajarildi',
-        # Client notifications about status change
-        'client_status_update': "📦 Sizning №{order_id} buyurtmangiz holati yangilandi: {status}\n\n{order_summary}",
-        'admin_status_update_log': "Buyurtma №{order_id} holati admin {admin_name} (@{admin_username}) tomonidan '{status}' ga o'zgartirildi.",
-        'order_already_finalized': "№{order_id} buyurtmasining holati allaqachon yakunlangan ({status}). O'zgartirish mumkin emas.",
-        'order_not_found': "{order_id} ID raqamli buyurtma topilmadi.",
-        'not_specified': 'Belgilangan emas', # For contact/name if missing
-    }
-}
+# Translations live in LOCALES_DIR/<lang>.json: {"name": "🇷🇺 Русский", "text": {...}, "buttons": {...}}.
+# The base language file defines the keys; every other file is checked against it when it is loaded.
+BASE_LANG = 'ru'
+LOCALE_SECTIONS = ('text', 'buttons')
+
+
+def template_fields(text: str) -> set:
+    """Placeholder names of a str.format template. Raises ValueError for unbalanced braces."""
+    return {name for _, name, _, _ in string.Formatter().parse(text) if name is not None}
+
+
+class Messages(Mapping):
+    """
+    The strings of one section of one language: a tuple, indexed through the key -> position dict that all
+    languages share. Read-only; TEXT[lang]['key'] and TEXT[lang].get('key') work as with a dict.
+    """
+    __slots__ = ('index', 'values')
+
+    def __init__(self, index: dict, values: tuple):
+        self.index = index
+        self.values = values
 
-# Mapping status keys to texts
-STATUS_MAP = {
-    'pending': {'ru': TEXT['ru']['status_pending'], 'uz': TEXT['uz']['status_pending']},
-    'accepted': {'ru': TEXT['ru']['status_accepted'], 'uz': TEXT['uz']['status_accepted']},
-    'in_progress': {'ru': TEXT['ru']['status_in_progress'], 'uz': TEXT['uz']['status_in_progress']},
-    'completed': {'ru': TEXT['ru']['status_completed'], 'uz': TEXT['uz']['status_completed']},
-    'rejected': {'ru': TEXT['ru']['status_rejected'], 'uz': TEXT['uz']['status_rejected']},
+    def __getitem__(self, key):
+        return self.values[self.index[key]]
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+class LocaleCatalog:
+    """
+    Translations from LOCALES_DIR. A language file is read, validated and packed into Messages tables on first use
+    (the preloaded ones at start), so extra languages cost nothing until somebody picks one. Only their button
+    labels are read at start, so that a button pressed in a language not loaded yet is recognized (see Button).
+    Validation against the base language: a missing string, one of another type or with placeholders the base text
+    does not have falls back to the base text; unknown keys are dropped. Both are logged once, at load.
+    The base file itself must be readable, or the bot does not start.
+    """
+
+    def __init__(self, directory: str, base_lang: str, preload: tuple = ()):
+        found = sorted(name[:-len('.json')] for name in os.listdir(directory) if name.endswith('.json'))
+        order = [lang for lang in preload if lang in found] + [lang for lang in found if lang not in preload]
+        self.files = {lang: os.path.join(directory, f"{lang}.json") for lang in order} # Also the language keyboard order
+        self.base_lang = base_lang
+        self.names = {} # lang -> language name (the language keyboard button)
+        self.shipped = {} # lang -> {section: tuple of strings} as validated from the file
+        self.tables = {} # lang -> {section: Messages}, text overrides applied
+        self.overrides = {} # {lang: {text_key: text}} from the settings table
+        self.buttons = {} # button key -> frozenset of its texts in all loaded languages (for the Button filter)
+        self.pending_buttons = {} # button text -> set of languages not loaded yet that have a button with it
+        base = self.read(base_lang)
+        self.index = {section: {key: i for i, key in enumerate(base[section])} for section in LOCALE_SECTIONS}
+        self.install(base_lang, base)
+        for lang in preload:
+            if lang in self.files:
+                self.load(lang)
+            else:
+                logger.warning(f"Preloaded language {lang} has no file in {directory}")
+        for lang in self.files:
+            if lang not in self.tables:
+                self.read_button_labels(lang)
+
+    def read(self, lang: str) -> dict:
+        """Parses a locale file. Raises OSError/ValueError."""
+        with open(self.files[lang], encoding='utf-8') as f:
+            data = json.load(f)
+        if not isinstance(data, dict) or not all(isinstance(data.get(section), dict) for section in LOCALE_SECTIONS):
+            raise ValueError(f"expected an object with {', '.join(LOCALE_SECTIONS)} sections")
+        return data
+
+    def read_button_labels(self, lang: str):
+        """Notes the button labels (and the name) of a language that is not loaded; a broken file is reported at load."""
+        try:
+            data = self.read(lang)
+        except (OSError, ValueError):
+            return
+        if isinstance(data.get('name'), str):
+            self.names[lang] = data['name']
+        for text in data['buttons'].values():
+            if isinstance(text, str):
+                self.pending_buttons.setdefault(text, set()).add(lang)
+
+    def load_button_languages(self, text: str) -> bool:
+        """Loads the languages not loaded yet that have a button with this text. False if there are none."""
+        langs = self.pending_buttons.pop(text, None)
+        if not langs:
+            return False
+        for lang in langs:
+            self.load(lang)
+        return True
+
+    def load(self, lang: str) -> dict:
+        """{section: Messages} of a language, loading it on first use. KeyError if there is no such locale file."""
+        tables = self.tables.get(lang)
+        if tables is None:
+            if lang not in self.files:
+                raise KeyError(lang)
+            try:
+                data = self.read(lang)
+            except (OSError, ValueError) as e:
+                logger.error(f"Locale {lang} is broken, using {self.base_lang} texts instead: {e}")
+                data = {'name': lang}
+            self.install(lang, data)
+            tables = self.tables[lang]
+        return tables
+
+    def install(self, lang: str, data: dict):
+        base = self.shipped.get(self.base_lang)
+        self.shipped[lang] = {section: self.validate(lang, section, data.get(section) or {}, base and base[section])
+                              for section in LOCALE_SECTIONS}
+        self.names[lang] = data['name'] if isinstance(data.get('name'), str) else lang
+        self.apply(lang)
+        for key, text in zip(self.index['buttons'], self.shipped[lang]['buttons']):
+            self.buttons[key] = self.buttons.get(key, frozenset()) | {text}
+        for text, langs in list(self.pending_buttons.items()):
+            langs.discard(lang)
+            if not langs:
+                del self.pending_buttons[text]
+        logger.info(f"Locale {lang} loaded ({len(self.index['text'])} texts, {len(self.index['buttons'])} buttons)")
+
+    def validate(self, lang: str, section: str, strings: dict, base: tuple = None) -> tuple:
+        """The section's strings in index order; `base` is None when loading the base language itself."""
+        if base is None:
+            return tuple(tuple(value) if isinstance(value, list) else value for value in strings.values())
+        values, missing, invalid = [], [], []
+        for key, base_value in zip(self.index[section], base):
+            value = strings.get(key)
+            if value is None:
+                missing.append(key)
+                value = base_value
+            elif isinstance(base_value, tuple):
+                if not isinstance(value, list) or len(value) != len(base_value):
+                    invalid.append(key)
+                    value = base_value
+                value = tuple(value)
+            else:
+                try:
+                    valid = isinstance(value, str) and template_fields(value) <= template_fields(base_value)
+                except ValueError:
+                    valid = False
+                if not valid:
+                    invalid.append(key)
+                    value = base_value
+            values.append(value)
+        unknown = sorted(strings.keys() - self.index[section].keys())
+        listed = lambda keys: ", ".join(keys[:10]) + (", ..." if len(keys) > 10 else "")
+        for problem, keys in (('missing', missing), ('invalid', invalid)):
+            if keys:
+                logger.warning(f"Locale {lang}: {len(keys)} {problem} {section} ({listed(keys)}), using {self.base_lang}")
+        if unknown:
+            logger.warning(f"Locale {lang}: {len(unknown)} unknown {section} ignored ({listed(unknown)})")
+        return tuple(values)
+
+    def apply(self, lang: str):
+        """(Re)builds a loaded language's tables with its text overrides."""
+        texts = list(self.shipped[lang]['text'])
+        for key, text in self.overrides.get(lang, {}).items():
+            if key in self.index['text']:
+                texts[self.index['text'][key]] = text
+        self.tables[lang] = {
+            'text': Messages(self.index['text'], tuple(texts)),
+            'buttons': Messages(self.index['buttons'], self.shipped[lang]['buttons']),
+        }
+
+    def set_overrides(self, overrides: dict):
+        """Replaces the text overrides ({lang: {text_key: text}}); languages loaded later get them at load."""
+        self.overrides = overrides
+        for lang in self.tables:
+            self.apply(lang)
+
+    def shipped_text(self, lang: str, key: str):
+        """A text as shipped in the locale file (no overrides); None for an unknown language or key."""
+        if lang not in self.files or key not in self.index['text']:
+            return None
+        self.load(lang)
+        return self.shipped[lang]['text'][self.index['text'][key]]
+
+    def language_name(self, lang: str) -> str:
+        """Name for the language keyboard. Of a language not loaded yet only the name is read; its strings wait for first use."""
+        if lang not in self.names:
+            try:
+                name = self.read(lang).get('name')
+            except (OSError, ValueError):
+                name = None
+            self.names[lang] = name if isinstance(name, str) else lang
+        return self.names[lang]
+
+    def language_by_name(self, name: str):
+        """Language code of a language keyboard button text, or None."""
+        return next((lang for lang in self.files if self.language_name(lang) == name), None)
+
+
+class LocaleSection(Mapping):
+    """TEXT / BTN: lang -> Messages of one catalog section. Looking up a language that is not loaded yet loads it."""
+    __slots__ = ('catalog', 'section')
+
+    def __init__(self, catalog: LocaleCatalog, section: str):
+        self.catalog = catalog
+        self.section = section
+
+    def __getitem__(self, lang):
+        return self.catalog.load(lang)[self.section]
+
+    def __contains__(self, lang):
+        return lang in self.catalog.files # Without loading it
+
+    def __iter__(self):
+        return iter(self.catalog.files)
+
+    def __len__(self):
+        return len(self.catalog.files)
+
+
+catalog = LocaleCatalog(LOCALES_DIR, BASE_LANG, PRELOAD_LANGUAGES)
+TEXT = LocaleSection(catalog, 'text')
+BTN = LocaleSection(catalog, 'buttons')
+
+# Order status keys, as stored in orders.status; their names are the 'status_<key>' texts
+ORDER_STATUSES = ('pending', 'accepted', 'in_progress', 'completed', 'rejected')
+
+
+def status_text(status_key: str, lang: str) -> str:
+    """Localized status name (the key itself for an unknown status)."""
+    return TEXT[lang].get(f'status_{status_key}', status_key)
+
+
+class Button(Filter):
+    """
+    Message text is the given button (BTN key) in any language. The text may be a button of a language not loaded
+    yet (e.g. after a restart nobody has used it): then that language is loaded and the text checked again.
+    No query either way: the labels of the languages not loaded are known from the start (see LocaleCatalog).
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+
+    async def __call__(self, message: types.Message) -> bool:
+        if message.text in catalog.buttons[self.key]:
+            return True
+        return catalog.load_button_languages(message.text) and message.text in catalog.buttons[self.key]
+
+
+class LanguageButton(Filter):
+    """Message text is a button of the language keyboard; the handler gets the language code as `chosen_lang`."""
+
+    async def __call__(self, message: types.Message):
+        lang = catalog.language_by_name(message.text)
+        return {'chosen_lang': lang} if lang else False
+
+
+# Admin actions (callback "set_status:<order_id>:<action>"): action -> (new status, statuses it can be applied to).
+# Order of the dict is the order of the buttons.
+ORDER_STATUS_TRANSITIONS = {
+    'accept': ('accepted', ('pending',)), # Accept -> Accepted
+    'start': ('in_progress', ('accepted',)), # Out for delivery -> In progress
+    'reject': ('rejected', ('pending', 'accepted', 'in_progress')), # Reject -> Rejected
+    'complete': ('completed', ('pending', 'accepted', 'in_progress')), # Complete -> Completed
 }
 
-# Mapping status keys for callbacks (to get 'accepted' from 'accept')
-ADMIN_STATUS_CALLBACK_MAP = {
-    'accept': 'accepted', # Accept -> Accepted
-    'reject': 'rejected', # Reject -> Rejected
-    'complete': 'completed', # Complete -> Completed
-}
+
+# --- Runtime settings (settings table, hot reload) ---
+class Settings(NamedTuple):
+    """Immutable snapshot of the settings table. Replaced as a whole by apply_settings(), never modified."""
+    admin_ids: frozenset
+    group_chat_id: int # None if orders are not posted to a group
+    texts: dict # {lang: {text_key: override}}, applied over the shipped texts by the catalog
+
+
+settings = Settings(frozenset(ADMIN_CHAT_IDS), GROUP_CHAT_ID, {}) # Environment values until the table is loaded
+
+
+def is_admin(user_id: int) -> bool:
+    return user_id in settings.admin_ids
+
+
+def normalize_setting(key: str, value: str) -> str:
+    """
+    Validates a setting and returns the value to store. Raises ValueError.
+    Keys: admin_chat_ids ("1,2"), group_chat_id ("" for none), text:<lang>:<text_key> (override of a TEXT entry;
+    buttons cannot be overridden, handler filters match them).
+    """
+    value = str(value).strip()
+    if key == 'admin_chat_ids':
+        return ",".join(str(int(part)) for part in re.split(r'[,\s]+', value) if part)
+    if key == 'group_chat_id':
+        return "" if value.lower() in ('', 'off', 'none', '-') else str(int(value))
+    if key.startswith('text:'):
+        _, lang, text_key = (key.split(':', 2) + ['', ''])[:3]
+        base = catalog.shipped_text(lang, text_key)
+        if not isinstance(base, str):
+            raise ValueError(f"unknown text {lang}:{text_key}")
+        if not value:
+            raise ValueError("empty text")
+        # The override may only use the placeholders the code fills in for this text
+        unknown = template_fields(value) - template_fields(base)
+        if unknown:
+            raise ValueError(f"unknown placeholders {sorted(unknown)} in {lang}:{text_key}")
+        return value
+    raise ValueError(f"unknown setting {key}")
+
+
+def apply_settings(new_settings: Settings):
+    """Swaps in a new snapshot (and the texts with its overrides); no await in between, so handlers see old or new."""
+    global settings
+    catalog.set_overrides(new_settings.texts)
+    settings = new_settings
+    reset_order_templates()
+
+
+async def reload_settings():
+    """Builds a new snapshot from the settings table (invalid rows are skipped) and applies it."""
+    async with db.execute("SELECT key, value FROM settings") as cur:
+        rows = await cur.fetchall()
+    values, texts = {}, {}
+    for key, value in rows:
+        try:
+            value = normalize_setting(key, value)
+        except ValueError as e:
+            logger.warning(f"Ignoring setting {key}: {e}")
+            continue
+        if key.startswith('text:'):
+            _, lang, text_key = key.split(':', 2)
+            texts.setdefault(lang, {})[text_key] = value
+        else:
+            values[key] = value
+    apply_settings(Settings(
+        admin_ids=frozenset(int(part) for part in values.get('admin_chat_ids', '').split(',') if part),
+        group_chat_id=int(values['group_chat_id']) if values.get('group_chat_id') else None,
+        texts=texts,
+    ))
+    logger.info(f"Settings loaded: admins {sorted(settings.admin_ids)}, group {settings.group_chat_id}, "
+                f"{sum(map(len, texts.values()))} text overrides")
+
+
+async def save_settings(values: dict, updated_by: int = None):
+    """
+    Validates and stores settings, then reloads the snapshot. A None value removes a text override.
+    Raises ValueError (nothing is stored) if any value is invalid.
+    """
+    rows = {}
+    for key, value in values.items():
+        if value is None and not key.startswith('text:'):
+            raise ValueError(f"{key} cannot be removed")
+        rows[key] = None if value is None else normalize_setting(key, value)
+    for key, value in rows.items():
+        if value is None:
+            await db.execute("DELETE FROM settings WHERE key=?", (key,))
+        else:
+            await db.execute(
+                "INSERT INTO settings(key, value, updated_by) VALUES(?, ?, ?) ON CONFLICT(key) DO UPDATE SET "
+                "value=excluded.value, updated_by=excluded.updated_by, updated_at=CURRENT_TIMESTAMP",
+                (key, value, updated_by)
+            )
+    await db.commit()
+    await reload_settings()
 
 
-BTN = {
-    'ru': {
-        'send_contact': "📞 Отправить контакт",
-        'cancel': "❌ Отменить",
-        'send_location': "📍 Отправить локацию",
-        'enter_address': "🏠 Ввести адрес вручную",
-        'start_over': "🔄 Начать сначала",
-        'my_orders': "📦 Мои заказы",
-        'edit_order': "✏️ Редактировать заказ", # Not implemented yet
-        'manage_db': "🔧 Управление базой данных", # Admin only
-        'skip': "Пропустить",
-        'back': "⬅️ Назад",
-        # Admin buttons (inline) - text for buttons shown to ADMIN (use TEXT dict)
-        'admin_clear_clients': "🗑️ Очистить клиентов",
-        'admin_clear_orders': "🗑️ Очистить заказы",
-        'admin_confirm_yes': "✅ Да",
-        'admin_confirm_no': "❌ Нет",
-    },
-    'uz': {
-        'send_contact': "📞 Kontaktni yuborish",
-        'cancel': "❌ Bekor qilish",
-        'send_location': "📍 Joylashuvni yuboring",
-        'enter_address': "🏠 Manzilni qo'lda kiritish",
-        'start_over': "🔄 Yangi boshlash",
-        'my_orders': "📦 Buyurtmalarim",
-        'edit_order': "✏️ Buyurtmani tahrirlash", # Not implemented yet
-        'manage_db': "🔧 Bazani boshqarish", # Admin only
-        'skip': "O'tkazib yuborish",
-        'back': "⬅️ Orqaga",
-        # Admin buttons (inline) - text for buttons shown to ADMIN (use TEXT dict)
-        'admin_clear_clients': "🗑️ Mijozlarni tozalash",
-        'admin_clear_orders': "🗑️ Buyurtmalarni tozalash",
-        'admin_confirm_yes': "✅ Ha",
-        'admin_confirm_no': "❌ Yo'q",
-    }
-}
+def read_settings_file(path: str) -> dict:
+    """
+    SETTINGS_FILE format: {"admin_chat_ids": [1, 2], "group_chat_id": -100123 or null,
+    "texts": {"ru": {"order_confirmed": "..."}}} (a null text removes the override). Raises ValueError/OSError.
+    """
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError("settings file must contain a JSON object")
+    values = {}
+    if 'admin_chat_ids' in data:
+        admin_ids = data['admin_chat_ids']
+        values['admin_chat_ids'] = ",".join(map(str, admin_ids)) if isinstance(admin_ids, list) else str(admin_ids)
+    if 'group_chat_id' in data:
+        values['group_chat_id'] = "" if data['group_chat_id'] is None else str(data['group_chat_id'])
+    for lang, texts in (data.get('texts') or {}).items():
+        for text_key, text in texts.items():
+            values[f"text:{lang}:{text_key}"] = text
+    return values
+
+
+async def watch_settings_file(path: str, interval: int):
+    """Polls the file's mtime; a new version (also the one found at start) is stored in the settings table and applied."""
+    last_mtime = None
+    while True:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime is not None and mtime != last_mtime:
+            last_mtime = mtime
+            try:
+                await save_settings(read_settings_file(path))
+                logger.info(f"Applied settings from {path}")
+            except (ValueError, OSError) as e:
+                logger.error(f"Settings file {path} not applied: {e}")
+        await asyncio.sleep(interval)
 
 
 # --- Functions for creating keyboards ---
+# Static keyboards come from the registry (built once per language/arguments); only keyboards with per-user
+# content (saved addresses, slots, order status buttons...) are built per call.
+@keyboards.static
 def kb_main(lang, is_admin=False, is_registered=False):
     """Main menu keyboard"""
     kb = []
@@ -381,6 +1834,11 @@ def kb_main(lang, is_admin=False, is_registered=False):
     if not is_registered:
         kb.append([KeyboardButton(text=BTN[lang]['send_contact'], request_contact=True)])
 
+    # Registered users can repeat their last order in one tap or manage recurring deliveries
+    if is_registered:
+        kb.append([KeyboardButton(text=BTN[lang]['repeat_order'])])
+        kb.append([KeyboardButton(text=BTN[lang]['my_subscriptions'])])
+
     # Always show "My Orders"
     kb.append([KeyboardButton(text=BTN[lang]['my_orders'])])
 
@@ -396,11 +1854,12 @@ def kb_main(lang, is_admin=False, is_registered=False):
         kb.append([KeyboardButton(text=BTN[lang]['manage_db'])])
 
     # Always show "Change Language"
-    kb.append([KeyboardButton(text=TEXT[lang]['change_lang'])]) # Language change button
+    kb.append([KeyboardButton(text=BTN[lang]['change_lang'])]) # Language change button
 
     return ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
 
-def kb_location(lang):
+@keyboards.static
+def kb_send_location(lang):
     """Keyboard for location selection/manual address input"""
     return ReplyKeyboardMarkup(
         keyboard=[
@@ -411,6 +1870,16 @@ def kb_location(lang):
         resize_keyboard=True
     )
 
+def kb_location(lang, saved_addresses=()):
+    """kb_send_location with saved addresses on top (built per call then, reusing the static rows)"""
+    if not saved_addresses:
+        return kb_send_location(lang)
+    return ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text=label)] for label in saved_addresses] + kb_send_location(lang).keyboard,
+        resize_keyboard=True
+    )
+
+@keyboards.static
 def kb_cancel_back(lang):
     """Keyboard with Cancel and Back buttons"""
     return ReplyKeyboardMarkup(
@@ -421,6 +1890,7 @@ def kb_cancel_back(lang):
         resize_keyboard=True
     )
 
+@keyboards.static
 def kb_additional(lang):
     """Keyboard for additional contact with Skip, Back, Cancel"""
     return ReplyKeyboardMarkup(
@@ -432,6 +1902,7 @@ def kb_additional(lang):
         resize_keyboard=True
     )
 
+@keyboards.static
 def kb_quantity(lang):
     """Keyboard for quantity input with Back, Cancel"""
     return ReplyKeyboardMarkup(
@@ -442,22 +1913,38 @@ def kb_quantity(lang):
         resize_keyboard=True
     )
 
-def kb_language_select():
-    """Language selection keyboard"""
-    # Language selection keyboard text should probably be static or detect browser lang,
-    # but for simplicity, we use hardcoded buttons.
+def kb_slots(lang, labels: list):
+    """Keyboard with delivery slot options (one per row) plus Back, Cancel"""
     return ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text='🇷🇺 Русский'), KeyboardButton(text='🇺🇿 Ўзбек')]],
+        keyboard=[[KeyboardButton(text=label)] for label in labels] + kb_cancel_back(lang).keyboard,
         resize_keyboard=True
     )
 
+@keyboards.static
+def kb_order_confirm():
+    """Inline keyboard to confirm or cancel the order summary"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✅", callback_data="order_confirm")],
+        [InlineKeyboardButton(text="❌", callback_data="order_cancel")]
+    ])
+
+@keyboards.static
+def kb_language_select():
+    """Language selection keyboard: a button per locale file, two per row"""
+    buttons = [KeyboardButton(text=catalog.language_name(lang)) for lang in catalog.files]
+    return ReplyKeyboardMarkup(keyboard=[buttons[i:i + 2] for i in range(0, len(buttons), 2)], resize_keyboard=True)
+
+@keyboards.static
 def kb_admin_db(lang):
     """Inline keyboard for admin DB actions"""
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text=BTN[lang]['admin_clear_clients'], callback_data="admin_clear_clients")],
         [InlineKeyboardButton(text=BTN[lang]['admin_clear_orders'], callback_data="admin_clear_orders")],
+        [InlineKeyboardButton(text=BTN[lang]['admin_open_orders'], callback_data="admin_open")],
+        [InlineKeyboardButton(text=BTN[lang]['admin_bulk_status'], callback_data="admin_bulk")],
     ])
 
+@keyboards.static
 def kb_admin_confirm(lang, action_type):
     """Inline confirmation keyboard for admin action"""
     # action_type will be either 'clients' or 'orders'
@@ -468,32 +1955,39 @@ def kb_admin_confirm(lang, action_type):
         ]
     ])
 
-def kb_admin_order_status(order_id: int, lang: str) -> InlineKeyboardMarkup:
-    """Inline keyboard for changing order status by admins."""
-    # Buttons should send callback_data in format "set_status:<order_id>:<status_key>"
+def kb_admin_order_status(order_id: int, lang: str, status: str = 'pending'):
+    """Inline keyboard for changing order status by admins. Only actions allowed from `status`; None if there are none."""
+    # Buttons should send callback_data in format "set_status:<order_id>:<action>"
     # Admin buttons texts usually on one language (e.g., Russian) for admin chat convenience.
     # Here, we use the admin's language from TEXT[lang].
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text=TEXT[lang]['admin_status_accept'], callback_data=f"set_status:{order_id}:accept"),
-            InlineKeyboardButton(text=TEXT[lang]['admin_status_reject'], callback_data=f"set_status:{order_id}:reject")
-        ],
-        [
-            InlineKeyboardButton(text=TEXT[lang]['admin_status_complete'], callback_data=f"set_status:{order_id}:complete")
-        ]
-    ])
-    return kb
+    buttons = [
+        InlineKeyboardButton(text=TEXT[lang][f'admin_status_{action}'], callback_data=f"set_status:{order_id}:{action}")
+        for action, (_, allowed) in ORDER_STATUS_TRANSITIONS.items() if status in allowed
+    ]
+    if not buttons:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[buttons[i:i + 2] for i in range(0, len(buttons), 2)])
+
+
+def warm_keyboards(lang: str) -> int:
+    """Builds and serializes a language's static keyboards, so the first replies do not pay for it. Returns their number."""
+    markups = [kb_main(lang, admin, registered) for admin in (False, True) for registered in (False, True)]
+    markups += [kb_location(lang), kb_cancel_back(lang), kb_additional(lang), kb_quantity(lang), kb_admin_db(lang),
+                kb_admin_confirm(lang, 'clients'), kb_admin_confirm(lang, 'orders')]
+    for markup in markups:
+        keyboards.payload(markup, bot.session, bot)
+    return len(markups)
 
 
 # --- Handlers for general buttons (work regardless of state or in specific states) ---
 
 # Handler for "Cancel" button (works in any OrderForm state)
-@dp.message(StateFilter(OrderForm), F.text.in_([BTN['ru']['cancel'], BTN['uz']['cancel']]))
+@dp.message(StateFilter(OrderForm), Button('cancel'))
 async def handle_cancel_btn(message: types.Message, state: FSMContext):
     await cancel_process(message, state)
 
 # Handler for "Back" button (works in specific OrderForm states)
-@dp.message(StateFilter(OrderForm.address, OrderForm.additional, OrderForm.quantity), F.text.in_([BTN['ru']['back'], BTN['uz']['back']]))
+@dp.message(StateFilter(OrderForm.address, OrderForm.additional, OrderForm.quantity, OrderForm.slot), Button('back'))
 async def handle_back_btn(message: types.Message, state: FSMContext):
     data = await state.get_data()
     lang = await get_user_lang(message.from_user.id, state)
@@ -502,7 +1996,7 @@ async def handle_back_btn(message: types.Message, state: FSMContext):
 
     if current_state == OrderForm.address.state:
         # From address back to location
-        await message.reply(TEXT[lang]['send_location'], reply_markup=kb_location(lang))
+        await message.reply(TEXT[lang]['send_location'], reply_markup=await location_keyboard(message.from_user.id, lang, state))
         await state.set_state(OrderForm.location)
         await state.update_data(address=None) # Reset entered address
     elif current_state == OrderForm.additional.state:
@@ -515,31 +2009,36 @@ async def handle_back_btn(message: types.Message, state: FSMContext):
         await message.reply(TEXT[lang]['additional_prompt'], reply_markup=kb_additional(lang))
         await state.set_state(OrderForm.additional)
         await state.update_data(quantity=None) # Reset quantity
+    elif current_state == OrderForm.slot.state:
+        # From slot back to quantity
+        await message.reply(quantity_prompt(lang, data.get('zone')), reply_markup=kb_quantity(lang))
+        await state.set_state(OrderForm.quantity)
+        await state.update_data(slot_options=None)
 
 
 # Handler for "Skip" button (works in OrderForm.additional state)
-@dp.message(OrderForm.additional, F.text.in_([BTN['ru']['skip'], BTN['uz']['skip']]))
+@dp.message(OrderForm.additional, Button('skip'))
 async def handle_skip_btn(message: types.Message, state: FSMContext):
     data = await state.get_data()
     lang = await get_user_lang(message.from_user.id, state)
     await state.update_data(additional_contact=None) # Save as None
-    await message.reply(TEXT[lang]['input_quantity'].format(price=PRICE_PER_BOTTLE), reply_markup=kb_quantity(lang))
+    await message.reply(quantity_prompt(lang, data.get('zone')), reply_markup=kb_quantity(lang))
     await state.set_state(OrderForm.quantity)
 
 # Handler for "Start Over" button (works in any state)
-@dp.message(F.text.in_([BTN['ru']['start_over'], BTN['uz']['start_over']]))
+@dp.message(Button('start_over'))
 async def handle_start_over_btn(message: types.Message, state: FSMContext):
     await cmd_start(message, state) # Essentially restarts the process like /start
 
 # Handler for "Change Language" button (works in any state)
-@dp.message(F.text.in_([TEXT['ru']['change_lang'], TEXT['uz']['change_lang']]))
+@dp.message(Button('change_lang'))
 async def handle_change_lang_btn(message: types.Message, state: FSMContext):
     await state.clear() # Clear current state (including order)
     await message.reply(TEXT['ru']['choose_language'], reply_markup=kb_language_select())
     await state.set_state(LangSelect.choosing)
 
 # Handler for "My Orders" button (works in any state)
-@dp.message(F.text.in_([BTN['ru']['my_orders'], BTN['uz']['my_orders']]))
+@dp.message(Button('my_orders'))
 async def handle_my_orders_btn(message: types.Message, state: FSMContext):
     uid = message.from_user.id
     lang = await get_user_lang(uid, state)
@@ -554,41 +2053,37 @@ async def handle_my_orders_btn(message: types.Message, state: FSMContext):
     # If not registered, the "My Orders" button shouldn't be visible via kb_main,
     # but we handle defensively in case they managed to send the text.
     if not is_registered:
-         await message.reply(TEXT[lang]['access_denied'], reply_markup=kb_main(lang, uid in ADMIN_CHAT_IDS, is_registered))
+         await message.reply(TEXT[lang]['access_denied'], reply_markup=kb_main(lang, is_admin(uid), is_registered))
          # Ensure state is clear if access is denied outside of expected flow
          await state.clear()
          return
 
     try:
-        async with db.execute("SELECT order_id, order_time, quantity, status, address, location_lat, location_lon FROM orders WHERE user_id=? ORDER BY order_time DESC", (uid,)) as cur:
+        # Served by idx_orders_user_ts, newest first
+        async with db.execute("SELECT order_id, order_ts, order_time, quantity, status, address, location_lat, location_lon FROM orders WHERE user_id=? ORDER BY order_ts DESC", (uid,)) as cur:
             orders = await cur.fetchall()
     except Exception as e:
         logger.error(f"Error getting orders for user {uid}: {e}")
-        await message.reply(TEXT[lang]['error_processing'], reply_markup=kb_main(lang, uid in ADMIN_CHAT_IDS, True))
+        await message.reply(TEXT[lang]['error_processing'], reply_markup=kb_main(lang, is_admin(uid), True))
         await state.clear() # Clear state on DB error
         return
 
 
     if not orders:
-        await message.reply(TEXT[lang]['no_orders'], reply_markup=kb_main(lang, uid in ADMIN_CHAT_IDS, True))
+        await message.reply(TEXT[lang]['no_orders'], reply_markup=kb_main(lang, is_admin(uid), True))
         await state.clear() # Clear state after showing no orders
         return
 
     order_list = [TEXT[lang]['my_orders_title']]
     for order in orders:
-        order_id, order_time_str, quantity, status_key, address, lat, lon = order
-        try:
-            order_dt = datetime.strptime(order_time_str, "%Y-%m-%d %H:%M:%S")
-            localized_order_time = localize_date(order_dt, lang)
-        except (ValueError, TypeError):
-            logger.warning(f"Date parsing error for order {order_id}: {order_time_str}")
-            localized_order_time = order_time_str # Use raw string if parsing fails
+        order_id, order_ts, order_time_str, quantity, status_key, address, lat, lon = order
+        localized_order_time = format_order_time(order_ts, order_time_str, lang)
 
         # Get localized status text
-        localized_status = STATUS_MAP.get(status_key, {}).get(lang, status_key)
+        localized_status = status_text(status_key, lang)
 
         # Determine how to show address/location
-        display_address = address if address else (TEXT[lang]['location_not_specified'] if lat is None else TEXT[lang].get('location', 'Location/Joylashuv'))
+        display_address = address if address else (TEXT[lang]['location_not_specified'] if lat is None else TEXT[lang]['location'])
 
 
         order_list.append(
@@ -601,11 +2096,67 @@ async def handle_my_orders_btn(message: types.Message, state: FSMContext):
             )
         )
 
-    await message.reply("\n\n".join(order_list), reply_markup=kb_main(lang, uid in ADMIN_CHAT_IDS, True))
+    await message.reply("\n\n".join(order_list), reply_markup=kb_main(lang, is_admin(uid), True))
     await state.clear() # Clear state after showing orders
 
+# Handler for "Repeat last order" button (works in any state)
+# Prefills the order from the latest one and jumps straight to the confirmation summary.
+@dp.message(Button('repeat_order'))
+async def handle_repeat_order_btn(message: types.Message, state: FSMContext):
+    uid = message.from_user.id
+    lang = await get_user_lang(uid, state)
+
+    row = None
+    if db:
+        try:
+            # One query for everything the summary needs: last order + current client info
+            async with db.execute(
+                "SELECT o.contact, o.additional_contact, o.location_lat, o.location_lon, o.district, o.zone, o.address, o.quantity, "
+                "c.name, c.username, c.contact "
+                "FROM orders o JOIN clients c ON c.user_id = o.user_id "
+                "WHERE o.user_id=? ORDER BY o.order_id DESC LIMIT 1", (uid,)
+            ) as cur:
+                row = await cur.fetchone()
+        except Exception as e:
+            logger.error(f"Error loading last order for user {uid}: {e}")
+            await message.reply(TEXT[lang]['error_processing'], reply_markup=kb_main(lang, is_admin(uid), await is_user_registered(uid)))
+            await state.clear()
+            return
+
+    if not row or not row[8]:
+        # No previous order (or not registered): nothing to repeat
+        await message.reply(TEXT[lang]['no_orders'], reply_markup=kb_main(lang, is_admin(uid), await is_user_registered(uid)))
+        await state.clear()
+        return
+
+    order_contact, additional_contact, lat, lon, district, zone, address, quantity, name, username, client_contact = row
+    contact = client_contact or order_contact
+
+    await state.clear()
+    await state.update_data(language=lang, name=name, contact=contact)
+
+    if lat is not None and zone_index:
+        # Delivery zones may have changed since the last order
+        zone = zone_index.lookup(lat, lon)
+        if zone is None and SERVICE_ZONE_MODE == 'reject':
+            await message.reply(TEXT[lang]['out_of_zone'], reply_markup=await location_keyboard(uid, lang, state))
+            await state.set_state(OrderForm.location)
+            return
+
+    await state.update_data(
+        additional_contact=additional_contact, location_lat=lat, location_lon=lon,
+        district=district, zone=zone, address=address, quantity=quantity
+    )
+    logger.info(f"User {uid} repeats last order ({quantity} bottles)")
+    if await ask_delivery_slot(message, state, lang):
+        return
+    data = await state.get_data()
+    summary = build_order_summary(lang, data, {"name": name, "contact": contact, "username": username})
+    await message.reply(summary, reply_markup=kb_order_confirm())
+    await state.set_state(OrderForm.confirm)
+
 # Handler for "Edit Order" button (placeholder)
-@dp.message(F.text.in_([BTN['ru']['edit_order'], BTN['uz']['edit_order']]))
+@dp.message(Button('edit_order'))
 async def handle_edit_order_btn(message: types.Message, state: FSMContext):
     uid = message.from_user.id
     lang = await get_user_lang(uid, state)
@@ -614,23 +2165,23 @@ async def handle_edit_order_btn(message: types.Message, state: FSMContext):
     is_registered = await is_user_registered(uid)
 
     if is_registered:
-        await message.reply(TEXT[lang]['feature_not_implemented'], reply_markup=kb_main(lang, uid in ADMIN_CHAT_IDS, True))
+        await message.reply(TEXT[lang]['feature_not_implemented'], reply_markup=kb_main(lang, is_admin(uid), True))
         await state.clear() # Clear state after showing the message
     else:
         # Should not happen if keyboards are correct, but handle defensively
-        await message.reply(TEXT[lang]['access_denied'], reply_markup=kb_main(lang, uid in ADMIN_CHAT_IDS, False))
+        await message.reply(TEXT[lang]['access_denied'], reply_markup=kb_main(lang, is_admin(uid), False))
         await state.clear() # Clear state if access denied unexpectedly
 
 
 # --- Admin button handlers ---
 
 # Handler for "Manage Database" button
-@dp.message(F.text.in_([BTN['ru']['manage_db'], BTN['uz']['manage_db']]))
+@dp.message(Button('manage_db'))
 async def handle_manage_db_btn(message: types.Message, state: FSMContext):
     uid = message.from_user.id
     lang = await get_user_lang(uid, state) # Use admin's language preference
 
-    if uid not in ADMIN_CHAT_IDS:
+    if not is_admin(uid):
         await message.reply(TEXT[lang]['access_denied'], reply_markup=kb_main(lang, False, await is_user_registered(uid)))
         await state.clear() # Clear state if non-admin tries this
         return
@@ -652,7 +2203,7 @@ async def handle_admin_clear_callback(callback: types.CallbackQuery, state: FSMC
     lang = await get_user_lang(uid, state) # Use admin's language preference
 
     # Basic admin check again, although AdminStates.main should prevent non-admins
-    if uid not in ADMIN_CHAT_IDS:
+    if not is_admin(uid):
          await callback.message.edit_text(TEXT[lang]['access_denied'], reply_markup=None)
          await state.clear()
          return
@@ -682,7 +2233,7 @@ async def handle_admin_clear_callback(callback: types.CallbackQuery, state: FSMC
          await bot.send_message(uid, TEXT[lang]['error_processing'] + "\n" + TEXT[lang]['action_cancelled'], reply_markup=None)
          await state.clear()
          is_registered = await is_user_registered(uid)
-         await bot.send_message(uid, TEXT[lang]['back_to_main'], reply_markup=kb_main(lang, uid in ADMIN_CHAT_IDS, is_registered))
+         await bot.send_message(uid, TEXT[lang]['back_to_main'], reply_markup=kb_main(lang, is_admin(uid), is_registered))
 
 
 # Handler for confirming client clear
@@ -693,7 +2244,7 @@ async def handle_confirm_clear_clients(callback: types.CallbackQuery, state: FSM
     lang = await get_user_lang(uid, state) # Use admin's language preference
 
     # Basic admin check
-    if uid not in ADMIN_CHAT_IDS:
+    if not is_admin(uid):
          await callback.message.edit_text(TEXT[lang]['access_denied'], reply_markup=None)
          await state.clear()
          return
@@ -706,6 +2257,9 @@ async def handle_confirm_clear_clients(callback: types.CallbackQuery, state: FSM
             # DELETE FROM clients with CASCADE will also delete associated orders
             if db:
                 await db.execute("DELETE FROM clients")
+                await db.execute("DELETE FROM addresses")
+                await db.execute("DELETE FROM subscriptions")
+                await db.execute("DELETE FROM order_messages")
                 await db.commit()
                 response_text = TEXT[lang]['db_clients_cleared']
                 logger.info(f"Admin {uid} cleared clients (and orders) database.")
@@ -731,7 +2285,7 @@ async def handle_confirm_clear_clients(callback: types.CallbackQuery, state: FSM
     await state.clear() # Exit admin state
     is_registered = await is_user_registered(uid)
     # Send main menu after admin action
-    await bot.send_message(uid, TEXT[lang]['back_to_main'], reply_markup=kb_main(lang, uid in ADMIN_CHAT_IDS, is_registered))
+    await bot.send_message(uid, TEXT[lang]['back_to_main'], reply_markup=kb_main(lang, is_admin(uid), is_registered))
 
 
 # Handler for confirming order clear
@@ -742,7 +2296,7 @@ async def handle_confirm_clear_orders(callback: types.CallbackQuery, state: FSMC
     lang = await get_user_lang(uid, state) # Use admin's language preference
 
     # Basic admin check
-    if uid not in ADMIN_CHAT_IDS:
+    if not is_admin(uid):
          await callback.message.edit_text(TEXT[lang]['access_denied'], reply_markup=None)
          await state.clear()
          return
@@ -754,7 +2308,11 @@ async def handle_confirm_clear_orders(callback: types.CallbackQuery, state: FSMC
         try:
             if db:
                 await db.execute("DELETE FROM orders")
+                await db.execute("DELETE FROM order_messages")
+                await db.execute("DELETE FROM slot_reservations")
                 await db.commit()
+                if slot_index:
+                    slot_index.reserved.clear()
                 response_text = TEXT[lang]['db_orders_cleared']
                 logger.info(f"Admin {uid} cleared orders database.")
             else:
@@ -767,19 +2325,890 @@ async def handle_confirm_clear_orders(callback: types.CallbackQuery, state: FSMC
     else: # action == 'no'
         logger.info(f"Admin {uid} cancelled order clear.")
 
-    # Edit the confirmation message with the result
+    # Edit the confirmation message with the result
+    try:
+        await callback.message.edit_text(response_text, reply_markup=None)
+    except Exception as e:
+        logger.error(f"Failed to edit message after admin orders clear {uid}: {e}")
+        # If editing fails, send a new message
+        await bot.send_message(uid, response_text, reply_markup=None)
+
+
+    await state.clear() # Exit admin state
+    is_registered = await is_user_registered(uid)
+    # Send main menu after admin action
+    await bot.send_message(uid, TEXT[lang]['back_to_main'], reply_markup=kb_main(lang, is_admin(uid), is_registered))
+
+
+# --- Recurring deliveries (subscriptions) ---
+# Callback data: "sub:new:<order_id>:<days>" subscribe to an order's delivery, "sub:cancel:<subscription_id>".
+SUBSCRIPTION_INTERVALS_DAYS = (7, 10, 14) # Offered after an order is confirmed
+SUBSCRIPTIONS_LIMIT = 3 # Active subscriptions per client
+SECONDS_PER_DAY = 86400
+
+
+class SubscriptionScheduler:
+    """
+    Creates orders for due subscriptions.
+    Only subscriptions due within the next `horizon` seconds are kept in memory, in a heap ordered by next_run
+    (loaded through the idx_subscriptions_next_run partial index). The loop sleeps until the earliest of them
+    or the end of the window, then loads the next window: no timer per subscription and no periodic table scans.
+    Due subscriptions are turned into orders `batch_size` at a time, one transaction per batch.
+    """
+
+    def __init__(self, horizon: int = 3600, batch_size: int = 100):
+        self.horizon = horizon
+        self.batch_size = batch_size
+        self.heap = [] # (next_run, subscription_id); may hold stale entries, batches re-check next_run in SQL
+        self.horizon_end = 0
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.stopping = False
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        """Lets the loop finish the batch in progress (orders and their notifications) and exit; see shutdown()."""
+        self.stopping = True
+        self.wakeup.set()
+
+    def schedule(self, subscription_id: int, next_run: int):
+        """Registers a new or rescheduled subscription; ignored if it falls after the loaded window."""
+        if next_run <= self.horizon_end:
+            heapq.heappush(self.heap, (next_run, subscription_id))
+            self.wakeup.set()
+
+    async def load_window(self, now: int):
+        self.horizon_end = now + self.horizon
+        async with db.execute(
+            "SELECT next_run, subscription_id FROM subscriptions WHERE active = 1 AND next_run <= ?", (self.horizon_end,)
+        ) as cur:
+            self.heap = [(row[0], row[1]) for row in await cur.fetchall()]
+        heapq.heapify(self.heap)
+        logger.info(f"Subscription scheduler: {len(self.heap)} subscriptions due in the next {self.horizon} s")
+
+    async def run(self):
+        while not self.stopping:
+            now = int(time.time())
+            try:
+                if now >= self.horizon_end:
+                    await self.load_window(now)
+                due = []
+                while self.heap and self.heap[0][0] <= now:
+                    due.append(heapq.heappop(self.heap)[1])
+                for i in range(0, len(due), self.batch_size):
+                    if self.stopping:
+                        break # The rest keep their next_run in the DB
+                    await self.run_batch(due[i:i + self.batch_size], now)
+            except Exception as e:
+                # Popped subscriptions keep their next_run in the DB and are picked up with the next window
+                logger.error(f"Subscription scheduler error: {e}")
+
+            wake_at = min(self.heap[0][0], self.horizon_end) if self.heap else self.horizon_end
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), max(wake_at - time.time(), 0))
+            except asyncio.TimeoutError:
+                pass
+
+    @staticmethod
+    def create_orders(conn, subscription_ids: list, now: int) -> tuple:
+        """
+        Unit of work of run_batch (run_in_db): creates the orders of the due subscriptions and moves them
+        to their next run. Returns (order cards, {subscription_id: next_run}).
+        """
+        placeholders = ", ".join('?' * len(subscription_ids))
+        order_time_str = datetime.fromtimestamp(now, TIMEZONE).strftime("%Y-%m-%d %H:%M:%S")
+        # The `next_run <= now` re-check skips cancelled and already processed (stale heap) subscriptions
+        cur = conn.execute(
+            "INSERT INTO orders(user_id, contact, phone_e164, additional_contact, location_lat, location_lon, district, zone, "
+            "address, quantity, order_time, order_ts, status, subscription_id) "
+            "SELECT user_id, contact, phone_e164, additional_contact, location_lat, location_lon, district, zone, "
+            "address, quantity, ?, ?, 'pending', subscription_id "
+            f"FROM subscriptions WHERE subscription_id IN ({placeholders}) AND active = 1 AND next_run <= ? "
+            f"RETURNING {ORDER_CARD_COLUMNS}",
+            (order_time_str, now, *subscription_ids, now)
+        )
+        rows = cur.fetchall()
+        columns = [col[0] for col in cur.description or ()]
+        orders = [dict(zip(columns, row)) for row in rows]
+        # Priced like client orders: at creation, with the stored total
+        for order in orders:
+            order['unit_price'] = price_per_bottle(order['zone'], order['quantity'], now)
+            order['total'] = order['unit_price'] * order['quantity']
+        conn.executemany("UPDATE orders SET unit_price=?, total=? WHERE order_id=?",
+                         [(order['unit_price'], order['total'], order['order_id']) for order in orders])
+        # Next run is the first one after now (missed runs while the bot was down are skipped, not piled up)
+        next_runs = dict(conn.execute(
+            "UPDATE subscriptions SET next_run = next_run + interval_days * ? * ((? - next_run) / (interval_days * ?) + 1) "
+            f"WHERE subscription_id IN ({placeholders}) AND active = 1 AND next_run <= ? RETURNING subscription_id, next_run",
+            (SECONDS_PER_DAY, now, SECONDS_PER_DAY, *subscription_ids, now)
+        ).fetchall())
+        return orders, next_runs
+
+    async def run_batch(self, subscription_ids: list, now: int):
+        """Creates the orders of one batch of due subscriptions (one DB round-trip) and notifies about them."""
+        orders, next_runs = await run_in_db(self.create_orders, subscription_ids, now)
+
+        if orders:
+            logger.info(f"Subscription scheduler created orders {[order['order_id'] for order in orders]}")
+        for subscription_id, next_run in next_runs.items():
+            self.schedule(subscription_id, next_run)
+
+        # Normal notification paths: admin copies with status buttons + a message to the client
+        semaphore = asyncio.Semaphore(STATUS_NOTIFY_CONCURRENCY)
+
+        async def notify(order):
+            async with semaphore:
+                await notify_new_order(order)
+                client_lang = order.get('language') or 'ru'
+                next_run = next_runs.get(order['subscription_id'])
+                try:
+                    await bot.send_message(order['user_id'], TEXT[client_lang]['subscription_order_created'].format(
+                        subscription_id=order['subscription_id'],
+                        order_id=order['order_id'],
+                        quantity=order['quantity'],
+                        next_date=localize_ts(next_run, client_lang) if next_run else '-'
+                    ))
+                except Exception as e:
+                    logger.error(f"Failed to notify client {order['user_id']} about subscription order {order['order_id']}: {e}")
+
+        await asyncio.gather(*(notify(order) for order in orders))
+
+
+async def count_active_subscriptions(user_id: int) -> int:
+    async with db.execute("SELECT COUNT(*) FROM subscriptions WHERE user_id=? AND active = 1", (user_id,)) as cur:
+        return (await cur.fetchone())[0]
+
+
+async def subscription_offer_keyboard(user_id: int, lang: str, order_id: int, active_subscriptions: int = None):
+    """
+    Inline buttons offering to repeat an order's delivery every N days; None if the client is at the limit.
+    `active_subscriptions` skips counting them when the caller already knows.
+    """
+    try:
+        if active_subscriptions is None:
+            active_subscriptions = await count_active_subscriptions(user_id) if db else SUBSCRIPTIONS_LIMIT
+        if active_subscriptions >= SUBSCRIPTIONS_LIMIT:
+            return None
+    except Exception as e:
+        logger.warning(f"Could not count subscriptions of {user_id}: {e}")
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text=BTN[lang]['subscribe_every'].format(days=days), callback_data=f"sub:new:{order_id}:{days}")
+        for days in SUBSCRIPTION_INTERVALS_DAYS
+    ]])
+
+
+async def render_subscriptions(user_id: int, lang: str):
+    """Text and cancel buttons for the client's active subscriptions."""
+    async with db.execute(
+        "SELECT subscription_id, quantity, interval_days, address, location_lat, next_run FROM subscriptions "
+        "WHERE user_id=? AND active = 1 ORDER BY next_run", (user_id,)
+    ) as cur:
+        subscriptions = await cur.fetchall()
+    if not subscriptions:
+        return TEXT[lang]['no_subscriptions'], None
+
+    lines = [TEXT[lang]['my_subscriptions_title']]
+    buttons = []
+    for subscription_id, quantity, interval_days, address, lat, next_run in subscriptions:
+        display_address = address or (TEXT[lang]['location_not_specified'] if lat is None else TEXT[lang]['location'])
+        lines.append(TEXT[lang]['subscription_info'].format(
+            subscription_id=subscription_id,
+            quantity=quantity,
+            days=interval_days,
+            address=display_address,
+            next_date=localize_ts(next_run, lang)
+        ))
+        buttons.append([InlineKeyboardButton(
+            text=BTN[lang]['subscription_cancel'].format(subscription_id=subscription_id),
+            callback_data=f"sub:cancel:{subscription_id}"
+        )])
+    return "\n\n".join(lines), InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+@dp.message(Button('my_subscriptions'))
+async def handle_my_subscriptions_btn(message: types.Message, state: FSMContext):
+    uid = message.from_user.id
+    lang = await get_user_lang(uid, state)
+    await state.clear()
+    try:
+        text, kb = await render_subscriptions(uid, lang)
+    except Exception as e:
+        logger.error(f"Error getting subscriptions for user {uid}: {e}")
+        await message.reply(TEXT[lang]['error_processing'])
+        return
+    await message.reply(text, reply_markup=kb)
+
+
+@dp.callback_query(F.data.startswith("sub:"))
+async def handle_subscription_callback(callback: types.CallbackQuery, state: FSMContext):
+    uid = callback.from_user.id
+    lang = await get_user_lang(uid, state)
+    parts = callback.data.split(':')
+
+    try:
+        if parts[1] == 'new' and len(parts) == 4 and int(parts[3]) in SUBSCRIPTION_INTERVALS_DAYS:
+            order_id, days = int(parts[2]), int(parts[3])
+            if await count_active_subscriptions(uid) >= SUBSCRIPTIONS_LIMIT:
+                await callback.answer(TEXT[lang]['subscription_limit'].format(limit=SUBSCRIPTIONS_LIMIT), show_alert=True)
+                return
+            # Copy the delivery details from the client's own order; the first run is `days` from now
+            async with db.execute(
+                "INSERT INTO subscriptions(user_id, quantity, interval_days, contact, phone_e164, additional_contact, "
+                "address, location_lat, location_lon, district, zone, next_run) "
+                "SELECT user_id, quantity, ?, contact, phone_e164, additional_contact, address, location_lat, location_lon, "
+                "district, zone, ? FROM orders WHERE order_id=? AND user_id=? RETURNING subscription_id, quantity, next_run",
+                (days, int(time.time()) + days * SECONDS_PER_DAY, order_id, uid)
+            ) as cur:
+                row = await cur.fetchone()
+            await db.commit()
+            if not row:
+                await callback.answer(TEXT[lang]['order_not_found'].format(order_id=order_id), show_alert=True)
+                return
+            subscription_id, quantity, next_run = row
+            if subscription_scheduler:
+                subscription_scheduler.schedule(subscription_id, next_run)
+            logger.info(f"User {uid} subscribed to order {order_id} every {days} days (subscription {subscription_id})")
+            await callback.message.edit_reply_markup(reply_markup=None)
+            await callback.message.answer(TEXT[lang]['subscription_created'].format(
+                quantity=quantity, days=days, next_date=localize_ts(next_run, lang)
+            ))
+        elif parts[1] == 'cancel' and len(parts) == 3:
+            subscription_id = int(parts[2])
+            async with db.execute(
+                "UPDATE subscriptions SET active = 0 WHERE subscription_id=? AND user_id=? AND active = 1", (subscription_id, uid)
+            ) as cur:
+                cancelled = cur.rowcount
+            await db.commit()
+            if cancelled:
+                logger.info(f"User {uid} cancelled subscription {subscription_id}")
+            text, kb = await render_subscriptions(uid, lang)
+            await callback.message.edit_text(TEXT[lang]['subscription_cancelled'].format(subscription_id=subscription_id) + "\n\n" + text, reply_markup=kb)
+        else:
+            await callback.answer(TEXT[lang]['invalid_input'], show_alert=True)
+            return
+        await callback.answer()
+    except Exception as e:
+        logger.error(f"Error processing subscription callback {callback.data} by user {uid}: {e}")
+        await callback.answer(TEXT[lang]['error_processing'], show_alert=True)
+
+
+# --- Open orders (shared by the bulk status panel and the open orders dashboard) ---
+# Both walk the idx_orders_open partial index, so completed/rejected history does not slow them down.
+
+async def fetch_open_orders(after_id: int = 0, limit: int = 10, before_id: int = None) -> list:
+    """
+    Open (not final) orders, oldest first, keyset-paginated by order_id:
+    the page after `after_id`, or the page before `before_id` if given.
+    Rows: (order_id, status, quantity, name, order_ts, order_time, address, location_lat).
+    """
+    if before_id is not None:
+        where, order, params = "o.order_id < ?", "DESC", (before_id, limit)
+    else:
+        where, order, params = "o.order_id > ?", "ASC", (after_id, limit)
+    async with db.execute(
+        "SELECT o.order_id, o.status, o.quantity, c.name, o.order_ts, o.order_time, o.address, o.location_lat "
+        "FROM orders o LEFT JOIN clients c ON c.user_id = o.user_id "
+        f"WHERE o.{OPEN_STATUSES_SQL} AND {where} ORDER BY o.order_id {order} LIMIT ?", params
+    ) as cur:
+        rows = await cur.fetchall()
+    return rows[::-1] if before_id is not None else rows
+
+
+async def count_open_orders() -> dict:
+    """Number of open orders per status (a scan of the idx_orders_open covering index)."""
+    async with db.execute(f"SELECT status, COUNT(*) FROM orders WHERE {OPEN_STATUSES_SQL} GROUP BY status") as cur:
+        return dict(await cur.fetchall())
+
+
+# --- Admin bulk status panel ---
+# Callback data: "bulk:t:<order_id>" toggle, "bulk:page" select page, "bulk:none" clear selection,
+# "bulk:next"/"bulk:prev" paging, "bulk:a:<action>" apply action, "bulk:close" back to the DB menu.
+BULK_PAGE_SIZE = 10
+
+
+async def render_bulk_panel(lang: str, state: FSMContext):
+    """Builds the bulk panel for the current page and selection; remembers the page's order ids in FSM data."""
+    data = await state.get_data()
+    pages = data.get('bulk_pages') or [0] # Keyset cursors (last seen order_id) of visited pages, last one is current
+    selected = set(data.get('bulk_selected') or [])
+    rows = await fetch_open_orders(pages[-1], BULK_PAGE_SIZE + 1)
+    has_next = len(rows) > BULK_PAGE_SIZE
+    rows = rows[:BULK_PAGE_SIZE]
+    await state.update_data(bulk_page_ids=[row[0] for row in rows])
+
+    back_row = [InlineKeyboardButton(text=BTN[lang]['bulk_close'], callback_data="bulk:close")]
+    if not rows and len(pages) == 1:
+        return TEXT[lang]['bulk_empty'], InlineKeyboardMarkup(inline_keyboard=[back_row])
+
+    keyboard = []
+    for order_id, status_key, quantity, name, *_ in rows:
+        mark = "☑️" if order_id in selected else "⬜"
+        label = f"{mark} №{order_id} · {quantity} · {status_text(status_key, lang)}"
+        if name:
+            label += f" · {name[:20]}"
+        keyboard.append([InlineKeyboardButton(text=label, callback_data=f"bulk:t:{order_id}")])
+    nav = []
+    if len(pages) > 1:
+        nav.append(InlineKeyboardButton(text="⬅️", callback_data="bulk:prev"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="➡️", callback_data="bulk:next"))
+    if nav:
+        keyboard.append(nav)
+    keyboard.append([
+        InlineKeyboardButton(text=BTN[lang]['bulk_select_page'], callback_data="bulk:page"),
+        InlineKeyboardButton(text=BTN[lang]['bulk_clear_selection'], callback_data="bulk:none"),
+    ])
+    if selected:
+        actions = [
+            InlineKeyboardButton(text=f"{TEXT[lang][f'admin_status_{action}']} ({len(selected)})", callback_data=f"bulk:a:{action}")
+            for action in ORDER_STATUS_TRANSITIONS
+        ]
+        keyboard.extend(actions[i:i + 2] for i in range(0, len(actions), 2))
+    keyboard.append(back_row)
+    return TEXT[lang]['bulk_title'].format(selected=len(selected)), InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+@dp.callback_query(AdminStates.main, F.data == "admin_bulk")
+async def handle_admin_bulk_open(callback: types.CallbackQuery, state: FSMContext):
+    uid = callback.from_user.id
+    lang = await get_user_lang(uid, state) # Use admin's language preference
+
+    if not is_admin(uid):
+        await callback.answer(TEXT[lang]['access_denied'], show_alert=True)
+        await state.clear()
+        return
+
+    await state.set_state(AdminStates.bulk_status)
+    await state.update_data(bulk_pages=[0], bulk_selected=[])
+    try:
+        text, kb = await render_bulk_panel(lang, state)
+        await callback.message.edit_text(text, reply_markup=kb)
+        await callback.answer()
+    except Exception as e:
+        logger.error(f"Error opening bulk status panel for admin {uid}: {e}")
+        await callback.answer(TEXT[lang]['error_processing'], show_alert=True)
+
+
+@dp.callback_query(AdminStates.bulk_status, F.data.startswith("bulk:"))
+async def handle_admin_bulk_callback(callback: types.CallbackQuery, state: FSMContext):
+    uid = callback.from_user.id
+    lang = await get_user_lang(uid, state) # Use admin's language preference
+
+    if not is_admin(uid):
+        await callback.answer(TEXT[lang]['access_denied'], show_alert=True)
+        await state.clear()
+        return
+
+    parts = callback.data.split(':')
+    data = await state.get_data()
+    selected = set(data.get('bulk_selected') or [])
+    pages = data.get('bulk_pages') or [0]
+    summary = None
+
+    try:
+        if parts[1] == 't' and len(parts) == 3:
+            selected ^= {int(parts[2])}
+        elif parts[1] == 'page':
+            selected |= set(data.get('bulk_page_ids') or [])
+        elif parts[1] == 'none':
+            selected.clear()
+        elif parts[1] == 'next' and data.get('bulk_page_ids'):
+            pages.append(data['bulk_page_ids'][-1])
+        elif parts[1] == 'prev' and len(pages) > 1:
+            pages.pop()
+        elif parts[1] == 'close':
+            await state.set_state(AdminStates.main)
+            await state.update_data(bulk_pages=None, bulk_selected=None, bulk_page_ids=None)
+            await callback.message.edit_text(TEXT[lang]['choose_admin_action'], reply_markup=kb_admin_db(lang))
+            await callback.answer()
+            return
+        elif parts[1] == 'a' and len(parts) == 3 and parts[2] in ORDER_STATUS_TRANSITIONS:
+            if not selected:
+                await callback.answer(TEXT[lang]['bulk_nothing_selected'], show_alert=True)
+                return
+            action_key = parts[2]
+            new_status_key = ORDER_STATUS_TRANSITIONS[action_key][0]
+            # One compare-and-set UPDATE for the whole selection; orders in a wrong status are skipped
+            orders = await transition_orders_status(sorted(selected), action_key, uid)
+            changed_ids = [order['order_id'] for order in orders]
+            skipped_ids = sorted(selected - set(changed_ids))
+            logger.info(f"Admin {uid} bulk-updated orders {changed_ids} to '{new_status_key}' (skipped: {skipped_ids})")
+
+            summary_lines = []
+            if changed_ids:
+                summary_lines.append(TEXT[lang]['bulk_result'].format(
+                    status=status_text(new_status_key, lang),
+                    count=len(changed_ids),
+                    order_ids=", ".join(f"№{order_id}" for order_id in changed_ids)
+                ))
+            if skipped_ids:
+                summary_lines.append(TEXT[lang]['bulk_skipped'].format(order_ids=", ".join(f"№{order_id}" for order_id in skipped_ids)))
+            summary = "\n".join(summary_lines)
+            selected.clear()
+        else:
+            await callback.answer(TEXT[lang]['invalid_input'], show_alert=True)
+            return
+
+        await state.update_data(bulk_selected=sorted(selected), bulk_pages=pages)
+        text, kb = await render_bulk_panel(lang, state)
+        if summary:
+            text = f"{summary}\n\n{text}"
+        await callback.message.edit_text(text, reply_markup=kb)
+        await callback.answer()
+    except Exception as e:
+        logger.error(f"Error processing bulk status callback {callback.data} by admin {uid}: {e}")
+        await callback.answer(TEXT[lang]['error_processing'], show_alert=True)
+        return
+
+    if summary and changed_ids:
+        # Batched fan-out: admin copies + client notifications for all changed orders
+        await notify_status_changes(orders, callback.from_user.full_name, callback.from_user.username or "N/A")
+
+
+# --- Admin open orders dashboard ---
+# Callback data (stateless, keyset cursors travel in the data): "open:n:<last_id>" next page,
+# "open:b:<first_id>" previous page, "open:o:<order_id>" open the order card with status buttons, "open:close".
+OPEN_ORDERS_PAGE_SIZE = 10
+
+
+async def render_open_orders_page(lang: str, after_id: int = 0, before_id: int = None):
+    """Builds the text and keyboard for one page of the open orders dashboard."""
+    counts = await count_open_orders()
+    rows = await fetch_open_orders(after_id, OPEN_ORDERS_PAGE_SIZE + 1, before_id)
+    # One extra row tells whether there is a page further in the paging direction
+    has_more = len(rows) > OPEN_ORDERS_PAGE_SIZE
+    if has_more:
+        rows = rows[1:] if before_id is not None else rows[:OPEN_ORDERS_PAGE_SIZE]
+    if not rows and (after_id or before_id is not None):
+        # The cursor's neighbours were closed meanwhile: start over from the oldest open order
+        return await render_open_orders_page(lang)
+    back_row = [InlineKeyboardButton(text=BTN[lang]['bulk_close'], callback_data="open:close")]
+    if not rows:
+        return TEXT[lang]['open_orders_empty'], InlineKeyboardMarkup(inline_keyboard=[back_row])
+
+    lines = [
+        TEXT[lang]['open_orders_title'].format(total=sum(counts.values())),
+        " | ".join(f"{status_text(status, lang)}: {counts.get(status, 0)}" for status in OPEN_STATUSES),
+    ]
+    keyboard, buttons = [], []
+    for order_id, status_key, quantity, name, order_ts, order_time_str, address, lat in rows:
+        order_time_display = format_order_time(order_ts, order_time_str, lang)
+        display_address = address or (TEXT[lang]['location_not_specified'] if lat is None else TEXT[lang]['location'])
+        lines.append(
+            f"№{order_id} | {order_time_display} | {quantity} | {status_text(status_key, lang)}\n"
+            f"👤 {name or TEXT[lang]['not_specified']} | 📍 {display_address}"
+        )
+        buttons.append(InlineKeyboardButton(text=f"№{order_id}", callback_data=f"open:o:{order_id}"))
+    keyboard.extend(buttons[i:i + 5] for i in range(0, len(buttons), 5))
+
+    nav = []
+    if (before_id is not None and has_more) or (before_id is None and after_id > 0):
+        nav.append(InlineKeyboardButton(text="⬅️", callback_data=f"open:b:{rows[0][0]}"))
+    if (before_id is None and has_more) or before_id is not None:
+        nav.append(InlineKeyboardButton(text="➡️", callback_data=f"open:n:{rows[-1][0]}"))
+    if nav:
+        keyboard.append(nav)
+    keyboard.append(back_row)
+    return "\n\n".join(lines), InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+@dp.callback_query(AdminStates.main, F.data == "admin_open")
+async def handle_admin_open_orders(callback: types.CallbackQuery, state: FSMContext):
+    uid = callback.from_user.id
+    lang = await get_user_lang(uid, state) # Use admin's language preference
+
+    if not is_admin(uid):
+        await callback.answer(TEXT[lang]['access_denied'], show_alert=True)
+        await state.clear()
+        return
+
+    try:
+        text, kb = await render_open_orders_page(lang)
+        await callback.message.edit_text(text, reply_markup=kb)
+        await callback.answer()
+    except Exception as e:
+        logger.error(f"Error opening open orders dashboard for admin {uid}: {e}")
+        await callback.answer(TEXT[lang]['error_processing'], show_alert=True)
+
+
+@dp.callback_query(F.data.startswith("open:"))
+async def handle_open_orders_callback(callback: types.CallbackQuery, state: FSMContext):
+    uid = callback.from_user.id
+    lang = await get_user_lang(uid, state)
+
+    if not is_admin(uid):
+        await callback.answer(TEXT[lang]['access_denied'], show_alert=True)
+        return
+
+    parts = callback.data.split(':')
+    try:
+        if parts[1] == 'close':
+            await state.set_state(AdminStates.main)
+            await callback.message.edit_text(TEXT[lang]['choose_admin_action'], reply_markup=kb_admin_db(lang))
+        elif parts[1] in ('n', 'b') and len(parts) == 3:
+            cursor = int(parts[2])
+            text, kb = await (render_open_orders_page(lang, after_id=cursor) if parts[1] == 'n' else render_open_orders_page(lang, before_id=cursor))
+            await callback.message.edit_text(text, reply_markup=kb)
+        elif parts[1] == 'o' and len(parts) == 3:
+            order_id = int(parts[2])
+            order = await fetch_order_card(order_id)
+            if not order:
+                await callback.answer(TEXT[lang]['order_not_found'].format(order_id=order_id), show_alert=True)
+                return
+            # A new copy of the admin notification; tracked so later status changes update it as well
+            sent = await bot.send_message(
+                callback.message.chat.id, render_admin_order_text(order, lang), parse_mode=ParseMode.HTML,
+                reply_markup=kb_admin_order_status(order_id, lang, order['status'])
+            )
+            await db.execute("INSERT OR IGNORE INTO order_messages(order_id, chat_id, message_id) VALUES(?, ?, ?)",
+                             (order_id, sent.chat.id, sent.message_id))
+            await db.commit()
+        else:
+            await callback.answer(TEXT[lang]['invalid_input'], show_alert=True)
+            return
+        await callback.answer()
+    except Exception as e:
+        logger.error(f"Error processing open orders callback {callback.data} by admin {uid}: {e}")
+        await callback.answer(TEXT[lang]['error_processing'], show_alert=True)
+
+
+# --- Admin full-text search over orders and clients (/find) ---
+FIND_PAGE_SIZE = 5
+FIND_WORD_RE = re.compile(r"\w+")
+FIND_PHONE_RE = re.compile(r"[\d\s()+\-]+")
+
+
+def build_fts_query(text: str) -> str:
+    """
+    Turns free admin input into a safe FTS5 MATCH expression.
+    Every word becomes a quoted prefix term (all terms must match). Phone-like input is
+    collapsed to its digits so '+998 90 123-45-67' and '901234567' find the same client.
+    """
+    text = text.strip()
+    if FIND_PHONE_RE.fullmatch(text):
+        digits = re.sub(r"\D", "", text)
+        if len(digits) >= 5:
+            # Contacts are indexed both in full and as the local 9-digit number (see orders_fts triggers)
+            return f'"{digits[-9:]}"*'
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in FIND_WORD_RE.findall(text))
+
+
+async def search_orders(query: str, offset: int, limit: int) -> list:
+    """Ranked (bm25) full-text search over orders_fts joined with order and client data."""
+    async with db.execute(
+        "SELECT o.order_id, o.order_ts, o.order_time, o.status, o.quantity, o.address, o.location_lat, o.contact, c.name, c.username "
+        "FROM orders_fts JOIN orders o ON o.order_id = orders_fts.rowid "
+        "LEFT JOIN clients c ON c.user_id = o.user_id "
+        "WHERE orders_fts MATCH ? ORDER BY rank, o.order_id DESC LIMIT ? OFFSET ?",
+        (query, limit, offset)
+    ) as cur:
+        return await cur.fetchall()
+
+
+async def render_find_page(lang: str, text: str, offset: int):
+    """Builds the text and pagination keyboard for one page of /find results."""
+    match_query = build_fts_query(text)
+    rows = await search_orders(match_query, offset, FIND_PAGE_SIZE + 1) if match_query else []
+    has_next = len(rows) > FIND_PAGE_SIZE
+    rows = rows[:FIND_PAGE_SIZE]
+
+    if not rows:
+        return TEXT[lang]['find_no_results'].format(query=text), None
+
+    lines = [TEXT[lang]['find_results_title'].format(query=text, start=offset + 1, end=offset + len(rows))]
+    for order_id, order_ts, order_time_str, status_key, quantity, address, lat, contact, name, username in rows:
+        order_time_display = format_order_time(order_ts, order_time_str, lang)
+        display_name = name or TEXT[lang]['not_specified']
+        if username:
+            display_name += f" (@{username})"
+        display_address = address or (TEXT[lang]['location_not_specified'] if lat is None else TEXT[lang]['location'])
+        lines.append(
+            f"№{order_id} | {order_time_display} | {quantity} | {status_text(status_key, lang)}\n"
+            f"👤 {display_name} | 📞 {contact or TEXT[lang]['not_specified']}\n"
+            f"📍 {display_address}"
+        )
+
+    nav = []
+    if offset > 0:
+        nav.append(InlineKeyboardButton(text="⬅️", callback_data=f"find:{max(offset - FIND_PAGE_SIZE, 0)}"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="➡️", callback_data=f"find:{offset + FIND_PAGE_SIZE}"))
+    kb = InlineKeyboardMarkup(inline_keyboard=[nav]) if nav else None
+    return "\n\n".join(lines), kb
+
+
+@dp.message(Command("find"))
+async def cmd_find(message: types.Message, command: CommandObject, state: FSMContext):
+    uid = message.from_user.id
+    lang = await get_user_lang(uid, state)
+
+    if not is_admin(uid):
+        await message.reply(TEXT[lang]['access_denied'])
+        return
+    if not fts_enabled:
+        await message.reply(TEXT[lang]['find_unavailable'])
+        return
+
+    query = (command.args or "").strip()
+    if not query:
+        await message.reply(TEXT[lang]['find_usage'])
+        return
+
+    # The query is kept in FSM data so pagination callbacks only carry the offset (callback_data is 64 bytes max)
+    await state.update_data(find_query=query)
+    try:
+        text, kb = await render_find_page(lang, query, 0)
+    except Exception as e:
+        logger.error(f"Error searching orders for admin {uid} (query: {query}): {e}")
+        await message.reply(TEXT[lang]['error_processing'])
+        return
+    await message.reply(text, reply_markup=kb)
+
+
+@dp.callback_query(F.data.startswith("find:"))
+async def handle_find_page(callback: types.CallbackQuery, state: FSMContext):
+    uid = callback.from_user.id
+    lang = await get_user_lang(uid, state)
+
+    if not is_admin(uid):
+        await callback.answer(TEXT[lang]['access_denied'], show_alert=True)
+        return
+
+    query = (await state.get_data()).get('find_query')
+    if not query:
+        await callback.answer(TEXT[lang]['find_expired'], show_alert=True)
+        return
+
+    try:
+        offset = max(int(callback.data.split(':')[1]), 0)
+        text, kb = await render_find_page(lang, query, offset)
+        await callback.message.edit_text(text, reply_markup=kb)
+        await callback.answer()
+    except Exception as e:
+        logger.error(f"Error paginating search for admin {uid} (query: {query}, data: {callback.data}): {e}")
+        await callback.answer(TEXT[lang]['error_processing'], show_alert=True)
+
+
+# --- Admin lookup by phone (/phone) ---
+PHONE_LOOKUP_ORDERS_LIMIT = 5
+
+
+@dp.message(Command("phone"))
+async def cmd_phone(message: types.Message, command: CommandObject, state: FSMContext):
+    uid = message.from_user.id
+    lang = await get_user_lang(uid, state)
+
+    if not is_admin(uid):
+        await message.reply(TEXT[lang]['access_denied'])
+        return
+
+    query = (command.args or "").strip()
+    if not query:
+        await message.reply(TEXT[lang]['phone_usage'])
+        return
+    phone = normalize_phone(query)
+    if not phone:
+        await message.reply(TEXT[lang]['phone_invalid'].format(query=query))
+        return
+
+    try:
+        # Both lookups are equality matches on the indexed phone_e164 columns
+        async with db.execute("SELECT user_id, name, username, language FROM clients WHERE phone_e164=?", (phone,)) as cur:
+            clients = await cur.fetchall()
+        async with db.execute(
+            "SELECT order_id, order_ts, order_time, status, quantity, address, location_lat FROM orders "
+            "WHERE phone_e164=? ORDER BY order_id DESC LIMIT ?", (phone, PHONE_LOOKUP_ORDERS_LIMIT)
+        ) as cur:
+            orders = await cur.fetchall()
+    except Exception as e:
+        logger.error(f"Error looking up phone {phone} for admin {uid}: {e}")
+        await message.reply(TEXT[lang]['error_processing'])
+        return
+
+    if not clients and not orders:
+        await message.reply(TEXT[lang]['phone_not_found'].format(phone=phone))
+        return
+
+    lines = []
+    if clients:
+        lines.append(TEXT[lang]['phone_clients_title'].format(phone=phone))
+        for client_id, name, username, client_lang in clients:
+            lines.append(
+                f"👤 {name or TEXT[lang]['not_specified']}" + (f" (@{username})" if username else "")
+                + f" | 🆔 {client_id} | 🌐 {client_lang or '-'}"
+            )
+    if orders:
+        lines.append("")
+        lines.append(TEXT[lang]['phone_orders_title'])
+        for order_id, order_ts, order_time_str, status_key, quantity, address, lat in orders:
+            order_time_display = format_order_time(order_ts, order_time_str, lang)
+            display_address = address or (TEXT[lang]['location_not_specified'] if lat is None else TEXT[lang]['location'])
+            lines.append(TEXT[lang]['order_info'].format(
+                order_id=order_id,
+                order_time=order_time_display,
+                quantity=quantity,
+                status=status_text(status_key, lang),
+                address=display_address
+            ))
+    await message.reply("\n".join(lines))
+
+
+# --- Admin price list (/price) ---
+PRICE_DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+def render_price_tiers(lang: str, tiers: list) -> str:
+    return "\n".join(TEXT[lang]['price_tier_line'].format(quantity=q, price=p) for q, p in tiers)
+
+
+def parse_price_tiers(args: list):
+    """["16000", "10:15000", "50:14000"] -> [(1, 16000), (10, 15000), (50, 14000)]; None if invalid or no base price."""
+    tiers = {}
+    for arg in args:
+        quantity_str, _, price_str = arg.rpartition(':')
+        try:
+            quantity, price = int(quantity_str or 1), int(price_str)
+        except ValueError:
+            return None
+        if quantity <= 0 or price <= 0:
+            return None
+        tiers[quantity] = price
+    return sorted(tiers.items()) if 1 in tiers else None
+
+
+@dp.message(Command("price"))
+async def cmd_price(message: types.Message, command: CommandObject, state: FSMContext):
+    """
+    /price - current and scheduled price lists; /price reload - re-read the prices table;
+    /price [YYYY-MM-DD] <price> [<qty>:<price> ...] - a new price list, effective now or from that date.
+    """
+    uid = message.from_user.id
+    lang = await get_user_lang(uid, state)
+
+    if not is_admin(uid):
+        await message.reply(TEXT[lang]['access_denied'])
+        return
+
+    args = (command.args or "").split()
+    try:
+        if not args:
+            lines = [TEXT[lang]['price_title'].format(since=price_book.since() or '-'), render_price_tiers(lang, price_book.tiers())]
+            for since, tiers in price_book.upcoming():
+                lines += ["", TEXT[lang]['price_scheduled'].format(since=since), render_price_tiers(lang, tiers)]
+            lines += ["", TEXT[lang]['price_usage']]
+            await message.reply("\n".join(lines))
+            return
+        if args == ['reload']:
+            await reload_price_book()
+            await message.reply(TEXT[lang]['price_reloaded'] + "\n\n" + render_price_tiers(lang, price_book.tiers()))
+            return
+
+        now_str = local_now().strftime("%Y-%m-%d %H:%M:%S")
+        effective_from = now_str
+        if PRICE_DATE_RE.match(args[0]):
+            effective_from = args.pop(0) + " 00:00:00"
+        tiers = parse_price_tiers(args)
+        if not tiers or effective_from < now_str[:10] + " 00:00:00":
+            await message.reply(TEXT[lang]['price_invalid'] + "\n\n" + TEXT[lang]['price_usage'])
+            return
+        # A list set again for the same moment replaces the old one as a whole
+        await db.execute("DELETE FROM prices WHERE effective_from=?", (effective_from,))
+        await db.executemany(
+            "INSERT INTO prices(effective_from, min_quantity, price, created_by) VALUES(?, ?, ?, ?)",
+            [(effective_from, quantity, price, uid) for quantity, price in tiers]
+        )
+        await db.commit()
+        await reload_price_book()
+        logger.info(f"Admin {uid} set price list {tiers} effective from {effective_from}")
+        await message.reply(TEXT[lang]['price_updated'].format(since=effective_from) + "\n\n" + render_price_tiers(lang, tiers))
+    except Exception as e:
+        logger.error(f"Error processing /price {command.args} by admin {uid}: {e}")
+        await message.reply(TEXT[lang]['error_processing'])
+
+
+# --- Admin runtime settings (/settings, /set, /reload) ---
+SETTING_ALIASES = {'admins': 'admin_chat_ids', 'group': 'group_chat_id'}
+
+
+@dp.message(Command("settings"))
+async def cmd_settings(message: types.Message, state: FSMContext):
+    uid = message.from_user.id
+    lang = await get_user_lang(uid, state)
+
+    if not is_admin(uid):
+        await message.reply(TEXT[lang]['access_denied'])
+        return
+
+    overrides = [f"{text_lang}:{text_key}" for text_lang, texts in settings.texts.items() for text_key in texts]
+    await message.reply(TEXT[lang]['settings_title'].format(
+        admins=", ".join(map(str, sorted(settings.admin_ids))) or '-',
+        group=settings.group_chat_id if settings.group_chat_id is not None else '-',
+        texts=", ".join(overrides) or '-',
+        file=SETTINGS_FILE or '-',
+    ) + "\n\n" + TEXT[lang]['settings_usage'])
+
+
+@dp.message(Command("set"))
+async def cmd_set(message: types.Message, command: CommandObject, state: FSMContext):
+    """/set admins <ids> | /set group <chat_id|off> | /set text <lang> <key> <text|->"""
+    uid = message.from_user.id
+    lang = await get_user_lang(uid, state)
+
+    if not is_admin(uid):
+        await message.reply(TEXT[lang]['access_denied'])
+        return
+
+    name, _, value = (command.args or "").strip().partition(' ')
     try:
-        await callback.message.edit_text(response_text, reply_markup=None)
+        if name == 'text':
+            parts = value.split(None, 2)
+            if len(parts) != 3:
+                raise ValueError("expected: text <lang> <key> <text>")
+            text_lang, text_key, text = parts
+            values = {f"text:{text_lang}:{text_key}": None if text.strip() == '-' else text}
+        elif name in SETTING_ALIASES:
+            values = {SETTING_ALIASES[name]: value}
+            # An admin cannot remove themselves (and so lock everyone out)
+            if name == 'admins' and str(uid) not in normalize_setting('admin_chat_ids', value).split(','):
+                await message.reply(TEXT[lang]['settings_lockout'])
+                return
+        else:
+            await message.reply(TEXT[lang]['settings_usage'])
+            return
+        await save_settings(values, uid)
+    except ValueError as e:
+        await message.reply(TEXT[lang]['settings_invalid'].format(error=e) + "\n\n" + TEXT[lang]['settings_usage'])
+        return
     except Exception as e:
-        logger.error(f"Failed to edit message after admin orders clear {uid}: {e}")
-        # If editing fails, send a new message
-        await bot.send_message(uid, response_text, reply_markup=None)
+        logger.error(f"Error saving setting {name} by admin {uid}: {e}")
+        await message.reply(TEXT[lang]['error_processing'])
+        return
+    logger.info(f"Admin {uid} changed settings: {list(values)}")
+    await message.reply(TEXT[lang]['settings_saved'])
 
 
-    await state.clear() # Exit admin state
-    is_registered = await is_user_registered(uid)
-    # Send main menu after admin action
-    await bot.send_message(uid, TEXT[lang]['back_to_main'], reply_markup=kb_main(lang, uid in ADMIN_CHAT_IDS, is_registered))
+@dp.message(Command("reload"))
+async def cmd_reload(message: types.Message, state: FSMContext):
+    """Re-reads the settings and prices tables (after they were edited outside the bot)."""
+    uid = message.from_user.id
+    lang = await get_user_lang(uid, state)
+
+    if not is_admin(uid):
+        await message.reply(TEXT[lang]['access_denied'])
+        return
+
+    try:
+        await reload_settings()
+        await reload_price_book()
+    except Exception as e:
+        logger.error(f"Error reloading settings for admin {uid}: {e}")
+        await message.reply(TEXT[lang]['error_processing'])
+        return
+    await message.reply(TEXT[lang]['settings_reloaded'])
 
 
 # --- Handler for admin order status change ---
@@ -787,9 +3216,6 @@ async def handle_confirm_clear_orders(callback: types.CallbackQuery, state: FSMC
 # It uses get_user_lang without state argument to get admin's lang from DB.
 @dp.callback_query(F.data.startswith("set_status:"))
 async def handle_admin_set_status(callback: types.CallbackQuery):
-    # Answer callback immediately
-    await callback.answer()
-
     uid = callback.from_user.id
     # Determine admin language by querying DB directly (as state is not active)
     admin_lang = 'ru' # Default admin lang
@@ -809,7 +3235,7 @@ async def handle_admin_set_status(callback: types.CallbackQuery):
     admin_username = callback.from_user.username or "N/A"
 
 
-    if uid not in ADMIN_CHAT_IDS:
+    if not is_admin(uid):
         await callback.answer(TEXT[admin_lang]['access_denied'], show_alert=True)
         return
 
@@ -820,165 +3246,47 @@ async def handle_admin_set_status(callback: types.CallbackQuery):
             await callback.answer(TEXT[admin_lang]['invalid_input'], show_alert=True)
             return
         order_id = int(parts[1])
-        action_key = parts[2] # 'accept', 'reject', 'complete'
-        new_status_key = ADMIN_STATUS_CALLBACK_MAP.get(action_key)
-
-        if not new_status_key:
+        action_key = parts[2] # 'accept', 'start', 'reject', 'complete'
+        if action_key not in ORDER_STATUS_TRANSITIONS:
             await callback.answer(TEXT[admin_lang]['invalid_input'], show_alert=True)
             return
+        new_status_key = ORDER_STATUS_TRANSITIONS[action_key][0]
 
         if not db:
              await callback.answer(TEXT[admin_lang]['error_processing'] + " DB not connected.", show_alert=True)
              logger.error(f"DB not connected for admin status update (admin {uid})")
              return
 
-        # Get current status, client_id, and all order data for summary
-        async with db.execute("SELECT user_id, status, contact, additional_contact, address, quantity, order_time, location_lat, location_lon FROM orders WHERE order_id=?", (order_id,)) as cur:
-            order_row = await cur.fetchone()
-
-        if not order_row:
-            await callback.answer(TEXT[admin_lang]['order_not_found'].format(order_id=order_id), show_alert=True)
-            try:
-                await callback.message.edit_reply_markup(reply_markup=None) # Remove buttons if order not found
-            except Exception as e:
-                logger.warning(f"Failed to remove buttons from order message {order_id}: {e}")
-            return
-
-        client_id, current_status_key, contact, additional_contact, address, quantity, order_time_str, lat, lon = order_row
+        # Compare-and-set: the UPDATE only matches if the current status allows the action,
+        # so of two admins clicking at once exactly one wins. Returns the order card for rendering.
+        order = await transition_order_status(order_id, action_key, uid)
 
-        # Check if the current status is final
-        final_statuses = ['completed', 'rejected'] # Keys of final statuses
-        if current_status_key in final_statuses:
-            await callback.answer(TEXT[admin_lang]['order_already_finalized'].format(order_id=order_id, status=STATUS_MAP.get(current_status_key,{}).get(admin_lang, current_status_key)), show_alert=True)
-            # Remove buttons if status is final
+        if not order:
+            # Lost the race or stale button: find out why (rare path, extra query is fine here)
+            order = await fetch_order_card(order_id)
+            if not order:
+                await callback.answer(TEXT[admin_lang]['order_not_found'].format(order_id=order_id), show_alert=True)
+                kb = None # Remove buttons if order not found
+            else:
+                current_status_key = order['status']
+                current_status_text = status_text(current_status_key, admin_lang)
+                text_key = 'order_already_finalized' if current_status_key in FINAL_STATUSES else 'order_status_conflict'
+                await callback.answer(TEXT[admin_lang][text_key].format(order_id=order_id, status=current_status_text), show_alert=True)
+                # Tracked copies were already updated by the winning change; fix the buttons of the clicked one
+                chat_lang = (await chat_languages([callback.message.chat.id]))[callback.message.chat.id]
+                kb = kb_admin_order_status(order_id, chat_lang, current_status_key)
             try:
-                await callback.message.edit_reply_markup(reply_markup=None)
+                await callback.message.edit_reply_markup(reply_markup=kb)
             except Exception as e:
-                 logger.warning(f"Failed to remove buttons from finalized order {order_id} in chat {callback.message.chat.id}: {e}")
+                logger.warning(f"Failed to update buttons of order message {order_id} in chat {callback.message.chat.id}: {e}")
             return
 
-        # Update status in DB
-        await db.execute("UPDATE orders SET status=? WHERE order_id=?", (new_status_key, order_id))
-        await db.commit()
         logger.info(f"Order №{order_id} status updated to '{new_status_key}' by admin {uid}")
+        await callback.answer()
 
-        # Get localized text for the new status for the admin
-        new_status_text_admin = STATUS_MAP.get(new_status_key, {}).get(admin_lang, new_status_key)
-
-
-        # Edit the message in the admin chat/group
-        try:
-            # Add info about the admin who changed the status
-            log_message = TEXT[admin_lang]['admin_status_update_log'].format(
-                order_id=order_id,
-                status=new_status_text_admin, # Use localized text for admin
-                admin_name=admin_name,
-                admin_username=admin_username
-            )
-            current_text = callback.message.text
-
-            # Pattern to find the old status line (e.g., "✨ Статус: Ожидание обработки")
-            status_line_pattern = re.compile(r"✨ Статус: .*")
-            match = status_line_pattern.search(current_text)
-
-            updated_text = current_text # Start with the original text
-
-            if match:
-                 # Replace the existing status line with the new one
-                 updated_text = status_line_pattern.sub(f"✨ Статус: {new_status_text_admin}", updated_text)
-            else:
-                 # If status line wasn't found (unexpected), append it as a fallback
-                 updated_text += f"\n✨ Статус: {new_status_text_admin}"
-
-            # Ensure the log message is appended. Find where logs might start (usually after a double newline or before <i>)
-            log_start_index = updated_text.find("\n\n<i>") # Look for the start of an italic log block
-            if log_start_index != -1:
-                 # If previous logs exist, replace them
-                 updated_text = updated_text[:log_start_index + 2].strip() + f"\n<i>{log_message}</i>" # Add newline before new log
-            else:
-                 # If no previous logs, add the new log block
-                 updated_text += f"\n\n<i>{log_message}</i>"
-
-
-            await callback.message.edit_text(
-                updated_text,
-                parse_mode=ParseMode.HTML,
-                reply_markup=None # Remove buttons after processing the change
-            )
-        except Exception as e:
-            logger.error(f"Failed to edit order message {order_id} in chat {callback.message.chat.id} during status update: {e}")
-            # If editing fails, send a new log message
-            try:
-                 # Get admin lang again in case the previous attempt failed
-                 current_admin_lang_for_retry = 'ru' # Fallback
-                 try:
-                      if db:
-                           async with db.execute("SELECT language FROM clients WHERE user_id=?", (uid,)) as cur:
-                                row = await cur.fetchone()
-                                if row and row[0]:
-                                     current_admin_lang_for_retry = row[0]
-                 except Exception: pass # Ignore errors here
-
-                 retry_log_message = TEXT[current_admin_lang_for_retry]['admin_status_update_log'].format(
-                    order_id=order_id,
-                    status=STATUS_MAP.get(new_status_key, {}).get(current_admin_lang_for_retry, new_status_key),
-                    admin_name=admin_name,
-                    admin_username=admin_username
-                 )
-                 await bot.send_message(callback.message.chat.id, f"<i>{retry_log_message}</i>", parse_mode=ParseMode.HTML)
-                 # Also try to remove buttons from the original message if editing text failed but markup might succeed
-                 try:
-                      await callback.message.edit_reply_markup(reply_markup=None)
-                 except Exception as e2:
-                      logger.warning(f"Failed to remove buttons from order message {order_id} after edit failure: {e2}")
-
-            except Exception as e3:
-                 logger.error(f"Failed to send log message about status update for order {order_id}: {e3}")
-
-
-        # Notify the client about the status change
-        client_lang = await get_user_lang(client_id) # Get client's language
-        client_new_status_text = STATUS_MAP.get(new_status_key, {}).get(client_lang, new_status_key) # Localize status for client
-
-        # Formulate order summary for the client (can reuse logic from confirm_order)
-        total = quantity * PRICE_PER_BOTTLE
-        display_address = address if address else (TEXT[client_lang].get('location_not_specified', 'Location not specified') if lat is None else TEXT[client_lang].get('location', 'Location/Joylashuv'))
-
-        # Get client name, contact, username from DB for the summary
-        client_info_db = {}
-        try:
-            if db:
-                async with db.execute("SELECT name, contact, username FROM clients WHERE user_id=?", (client_id,)) as cur:
-                    row = await cur.fetchone()
-                    if row:
-                        client_info_db = {"name": row[0], "contact": row[1], "username": row[2]}
-            else:
-                 logger.warning(f"DB not connected for retrieving client info {client_id} for notification")
-        except Exception as e:
-             logger.error(f"Error fetching client info {client_id} for status notification: {e}")
-             # Fallback to data from order_row if DB fetch fails
-             client_info_db = {"name": "N/A", "contact": contact, "username": ""} # Use contact from order if name/username missing
-
-
-        client_summary = (
-            f"👤 {client_info_db.get('name', TEXT[client_lang].get('not_specified', 'N/A'))}" + (f" (@{client_info_db.get('username')})" if client_info_db.get('username') else "") + "\n"
-            f"📞 Основной: {client_info_db.get('contact', TEXT[client_lang].get('not_specified', 'N/A'))}\n" # Use contact from DB/fallback
-            f"📞 Доп.: {additional_contact or ('–' if client_lang == 'ru' else '–')}\n"
-            f"📍 Адрес: {display_address}\n" # Show address or location placeholder
-            f"🔢 Количество: {quantity} " + ("шт" if client_lang == "ru" else "dona") + f" (Общая сумма: {total:,} " + ("сум" if client_lang == "ru" else "so'm") + ")\n"
-        )
-
-        client_notification_text = TEXT[client_lang]['client_status_update'].format(
-            order_id=order_id,
-            status=client_new_status_text, # Use localized text for the client
-            order_summary=client_summary
-        )
-        try:
-            await bot.send_message(client_id, client_notification_text)
-        except Exception as e:
-            # Client might have blocked the bot or chat doesn't exist
-            logger.error(f"Failed to send status update notification for order {order_id} to client {client_id}: {e}")
-
+        # Re-render all copies of the notification (admin chats and group) from the order data
+        # and notify the client about the status change
+        await notify_status_changes([order], admin_name, admin_username, extra_message=(callback.message.chat.id, callback.message.message_id))
 
     except Exception as e:
         logger.error(f"Error processing status change callback {callback.data} by admin {uid}: {e}")
@@ -1038,7 +3346,7 @@ async def cmd_start(message: types.Message, state: FSMContext):
         # Send greeting and prompt to start order (location)
         greeting_text = TEXT[lang]['greeting_prompt'].format(name=name)
         next_step_text = TEXT[lang]['send_location']
-        await message.reply(greeting_text + next_step_text, reply_markup=kb_location(lang))
+        await message.reply(greeting_text + next_step_text, reply_markup=await location_keyboard(uid, lang, state))
         await state.set_state(OrderForm.location)
     else:
         # User is new or exists but name is empty (needs full registration)
@@ -1048,9 +3356,9 @@ async def cmd_start(message: types.Message, state: FSMContext):
         await state.set_state(LangSelect.choosing)
 
 
-@dp.message(LangSelect.choosing, F.text.in_(["🇷🇺 Русский", "🇺🇿 Ўзбек"]))
-async def process_lang(message: types.Message, state: FSMContext):
-    lang = "ru" if message.text.startswith("🇷🇺") else "uz"
+@dp.message(LangSelect.choosing, LanguageButton())
+async def process_lang(message: types.Message, state: FSMContext, chosen_lang: str):
+    lang = chosen_lang
     await state.update_data(language=lang) # Save chosen language to state
     uid = message.from_user.id
     usernm = message.from_user.username or ""
@@ -1070,7 +3378,7 @@ async def process_lang(message: types.Message, state: FSMContext):
              await message.reply(TEXT[lang]['error_processing'])
              await state.clear()
              # is_user_registered will be False here as name is not set yet
-             await message.reply(TEXT[lang]['process_cancelled'], reply_markup=kb_main(lang, uid in ADMIN_CHAT_IDS, False))
+             await message.reply(TEXT[lang]['process_cancelled'], reply_markup=kb_main(lang, is_admin(uid), False))
              return
     else:
          logger.warning(f"DB not connected in process_lang. User {uid} language preference not saved to DB.")
@@ -1101,8 +3409,8 @@ async def reg_contact(message: types.Message, state: FSMContext):
         try:
             # Update client record with contact and username
             await db.execute(
-                "UPDATE clients SET contact=?, username=? WHERE user_id=?",
-                (formatted, usernm, uid))
+                "UPDATE clients SET contact=?, phone_e164=?, username=? WHERE user_id=?",
+                (formatted, normalize_phone(num), usernm, uid))
             await db.commit()
             logger.info(f"User {uid} saved contact: {formatted}")
         except Exception as e:
@@ -1213,19 +3521,67 @@ async def prompt_name_again(message: types.Message, state: FSMContext):
 async def loc_received(message: types.Message, state: FSMContext):
     lang = await get_user_lang(message.from_user.id, state) # Get lang from state
     loc = message.location
-    # Save location and clear address in state
-    await state.update_data(location_lat=loc.latitude, location_lon=loc.longitude, address=None)
-    logger.info(f"User {message.from_user.id} sent location: {loc.latitude}, {loc.longitude}")
+    # Check the delivery zone right away, before the user fills in the rest of the order
+    zone = zone_index.lookup(loc.latitude, loc.longitude) if zone_index else None
+    if zone_index and zone is None and SERVICE_ZONE_MODE == 'reject':
+        logger.info(f"User {message.from_user.id} sent location outside delivery zones: {loc.latitude}, {loc.longitude}")
+        # Stay in OrderForm.location so the user can send another location or type an address
+        return await message.reply(TEXT[lang]['out_of_zone'], reply_markup=await location_keyboard(message.from_user.id, lang, state))
+
+    # Resolve district offline (grid index lookup, no external service)
+    district = district_index.lookup(loc.latitude, loc.longitude) if district_index else None
+    # Save location, district and zone, clear address in state
+    await state.update_data(location_lat=loc.latitude, location_lon=loc.longitude, district=district, zone=zone, address=None)
+    logger.info(f"User {message.from_user.id} sent location: {loc.latitude}, {loc.longitude} (district: {district}, zone: {zone})")
     # Prompt for address clarification (optional but good practice)
     await message.reply(TEXT[lang]['address_prompt'], reply_markup=kb_cancel_back(lang))
     await state.set_state(OrderForm.address)
 
+# Handler for saved address buttons in OrderForm.location state
+@dp.message(OrderForm.location, F.text.startswith(SAVED_ADDRESS_PREFIX))
+async def handle_saved_address(message: types.Message, state: FSMContext):
+    uid = message.from_user.id
+    lang = await get_user_lang(uid, state) # Get lang from state
+    data = await state.get_data()
+    address_id = (data.get('saved_addresses') or {}).get(message.text)
+
+    row = None
+    if address_id is not None and db:
+        try:
+            async with db.execute(
+                "SELECT address, location_lat, location_lon, district, zone FROM addresses WHERE address_id=? AND user_id=?",
+                (address_id, uid)
+            ) as cur:
+                row = await cur.fetchone()
+        except Exception as e:
+            logger.error(f"Error loading saved address {address_id} for user {uid}: {e}")
+    if not row:
+        # Stale keyboard or address removed: show the current list again
+        return await message.reply(TEXT[lang]['invalid_input'] + "\n\n" + TEXT[lang]['send_location'], reply_markup=await location_keyboard(uid, lang, state))
+
+    address, lat, lon, district, zone = row
+    if lat is not None and zone_index:
+        # Delivery zones may have changed since the address was saved
+        zone = zone_index.lookup(lat, lon)
+        if zone is None and SERVICE_ZONE_MODE == 'reject':
+            return await message.reply(TEXT[lang]['out_of_zone'], reply_markup=await location_keyboard(uid, lang, state))
+
+    await state.update_data(location_lat=lat, location_lon=lon, district=district, zone=zone, address=address)
+    logger.info(f"User {uid} picked saved address {address_id}")
+    if address:
+        # Address text is already known: go straight to the additional contact step
+        await message.reply(TEXT[lang]['additional_prompt'], reply_markup=kb_additional(lang))
+        await state.set_state(OrderForm.additional)
+    else:
+        await message.reply(TEXT[lang]['address_prompt'], reply_markup=kb_cancel_back(lang))
+        await state.set_state(OrderForm.address)
+
 # Handler for "Enter address manually" button in OrderForm.location state
-@dp.message(OrderForm.location, F.text.in_([BTN['ru']['enter_address'], BTN['uz']['enter_address']]))
+@dp.message(OrderForm.location, Button('enter_address'))
 async def enter_addr_manual(message: types.Message, state: FSMContext):
     lang = await get_user_lang(message.from_user.id, state) # Get lang from state
-    # Clear location and address in state
-    await state.update_data(location_lat=None, location_lon=None, address=None)
+    # Clear location, district, zone and address in state
+    await state.update_data(location_lat=None, location_lon=None, district=None, zone=None, address=None)
     logger.info(f"User {message.from_user.id} chose manual address entry.")
     # Prompt for address
     await message.reply(TEXT[lang]['address_prompt'], reply_markup=kb_cancel_back(lang))
@@ -1237,7 +3593,7 @@ async def handle_location_text_input(message: types.Message, state: FSMContext):
     lang = await get_user_lang(message.from_user.id, state) # Get lang from state
     # This handler fires if user sends text not matching location buttons.
     # Guide them back to expected input.
-    await message.reply(TEXT[lang]['invalid_input'] + "\n\n" + TEXT[lang]['send_location'], reply_markup=kb_location(lang))
+    await message.reply(TEXT[lang]['invalid_input'] + "\n\n" + TEXT[lang]['send_location'], reply_markup=await location_keyboard(message.from_user.id, lang, state))
 
 
 @dp.message(OrderForm.address, F.text) # Catches any text in this state (Back/Cancel buttons caught earlier)
@@ -1272,7 +3628,8 @@ async def handle_additional_text(message: types.Message, state: FSMContext):
     logger.info(f"User {message.from_user.id} entered additional contact: {extra}")
 
     # Move to the next step: ask for quantity
-    await message.reply(TEXT[lang]['input_quantity'].format(price=PRICE_PER_BOTTLE), reply_markup=kb_quantity(lang))
+    data = await state.get_data()
+    await message.reply(quantity_prompt(lang, data.get('zone')), reply_markup=kb_quantity(lang))
     await state.set_state(OrderForm.quantity)
 
 @dp.message(OrderForm.additional) # Catches any other content type in this state
@@ -1286,23 +3643,26 @@ async def prompt_additional_again(message: types.Message, state: FSMContext):
 
 @dp.message(OrderForm.quantity, F.text) # Catches any text in this state (Back/Cancel buttons caught earlier)
 async def handle_quantity_text(message: types.Message, state: FSMContext):
-    data = await state.get_data()
     lang = await get_user_lang(message.from_user.id, state) # Get lang from state
     text = message.text.strip()
 
     # Validate input as a positive integer
     if not text.isdigit() or int(text) <= 0:
-        err = TEXT[lang]['invalid_input'] + (" Enter a positive number." if lang == "ru" else " Iltimas, musbat raqam kiriting.")
+        err = TEXT[lang]['invalid_input'] + " " + TEXT[lang]['enter_positive_number']
         return await message.reply(err)
 
     qty = int(text)
     await state.update_data(quantity=qty) # Save quantity to state
 
-    # Get updated data from state for summary
+    if not await ask_delivery_slot(message, state, lang):
+        await send_order_summary(message, state, lang, message.from_user)
+
+
+async def send_order_summary(message: types.Message, state: FSMContext, lang: str, user: types.User):
+    """Sends the order summary with the confirm buttons and moves to OrderForm.confirm."""
     data = await state.get_data()
-    total = qty * PRICE_PER_BOTTLE
 
-    uid = message.from_user.id
+    uid = user.id
     user_info_db = {}
     if db:
         try:
@@ -1311,61 +3671,93 @@ async def handle_quantity_text(message: types.Message, state: FSMContext):
                 row = await cur.fetchone()
                 if row:
                     user_info_db = {"name": row[0], "contact": row[1], "username": row[2]}
-            else:
-                 logger.warning(f"Client {uid} not found in DB for summary after quantity step.") # Should not happen if flow is correct
+                else:
+                    logger.warning(f"Client {uid} not found in DB for summary after quantity step.") # Should not happen if flow is correct
         except Exception as e:
              logger.error(f"Error fetching client info {uid} for summary: {e}")
              # Fallback to state data if DB fetch fails
-             user_info_db = {"name": data.get('name'), "contact": data.get('contact'), "username": message.from_user.username}
+             user_info_db = {"name": data.get('name'), "contact": data.get('contact'), "username": user.username}
     else:
          logger.warning(f"DB not connected for fetching client info {uid} for summary.")
          # Fallback to state data
-         user_info_db = {"name": data.get('name'), "contact": data.get('contact'), "username": message.from_user.username}
+         user_info_db = {"name": data.get('name'), "contact": data.get('contact'), "username": user.username}
 
 
     # Prefer data from DB if available, otherwise use state data or placeholder
-    display_name = user_info_db.get('name') or data.get('name', TEXT[lang].get('not_specified', 'Not specified'))
-    username = user_info_db.get('username', "")
-    display_name_with_username = f"{display_name} (@{username})" if username else display_name
-    contact_display = user_info_db.get('contact') or data.get('contact', TEXT[lang].get('not_specified', 'Not specified'))
-    additional_contact_display = data.get('additional_contact') or ('–' if lang == 'ru' else '–')
-    # Show address or location placeholder based on what's in state
-    address_display = data.get('address') or (TEXT[lang].get('location_not_specified', 'Location not specified') if data.get('location_lat') is None else TEXT[lang].get('location', 'Location/Joylashuv'))
-
-
-    summary = (
-        f"{TEXT[lang]['order_summary']}\n\n"
-        f"👤 {display_name_with_username}\n"
-        f"📞 Основной: {contact_display}\n" # Use contact from DB/state
-        f"📞 Доп.: {additional_contact_display}\n"
-        f"📍 Адрес: {address_display}\n" # Show address or location placeholder
-        f"🔢 Количество: {qty} " + ("шт" if lang == "ru" else "dona") + f" (Общая сумма: {total:,} " + ("сум" if lang == "ru" else "so'm") + ")\n"
-    )
-
-    # Confirmation keyboard
-    kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅", callback_data="order_confirm")],
-        [InlineKeyboardButton(text="❌", callback_data="order_cancel")]
-    ])
-    await message.reply(summary, reply_markup=kb)
+    summary = build_order_summary(lang, data, user_info_db)
+    await message.reply(summary, reply_markup=kb_order_confirm())
     await state.set_state(OrderForm.confirm)
 
 @dp.message(OrderForm.quantity) # Catches any other content type in this state
 async def prompt_quantity_again(message: types.Message, state: FSMContext):
     lang = await get_user_lang(message.from_user.id, state)
+    data = await state.get_data()
     # "Back" and "Cancel" buttons are handled separately
 
     # Reply with the quantity prompt again
-    await message.reply(TEXT[lang]['invalid_input'] + "\n\n" + TEXT[lang]['input_quantity'].format(price=PRICE_PER_BOTTLE), reply_markup=kb_quantity(lang))
+    await message.reply(TEXT[lang]['invalid_input'] + "\n\n" + quantity_prompt(lang, data.get('zone')), reply_markup=kb_quantity(lang))
+
+
+@dp.message(OrderForm.slot, F.text)
+async def handle_slot_choice(message: types.Message, state: FSMContext):
+    lang = await get_user_lang(message.from_user.id, state)
+    data = await state.get_data()
+    choice = (data.get('slot_options') or {}).get(message.text)
+    if not choice:
+        return await prompt_slot_again(message, state)
+    slot_date, slot = choice
+    await state.update_data(delivery_date=slot_date, delivery_slot=slot, slot_options=None)
+    await send_order_summary(message, state, lang, message.from_user)
+
+@dp.message(OrderForm.slot) # Catches any other input in this state
+async def prompt_slot_again(message: types.Message, state: FSMContext):
+    lang = await get_user_lang(message.from_user.id, state)
+    data = await state.get_data()
+    # "Back" and "Cancel" buttons are handled separately
+    await message.reply(TEXT[lang]['invalid_input'] + "\n\n" + TEXT[lang]['choose_slot'], reply_markup=kb_slots(lang, list(data.get('slot_options') or {})))
 
 
 # --- Handlers for order confirmation inline buttons ---
+def store_order(conn, values: tuple, address_values: tuple, slot: tuple = None) -> tuple:
+    """
+    Unit of work of a confirmed order (run_in_db): slot reservation, the order and its address book entry.
+    `slot` is (delivery_date, delivery_slot, quantity) when a slot was chosen.
+    Returns (order card, slot reserved count, client's active subscriptions); the card is None if the slot
+    filled up in the meantime.
+    """
+    reserved = None
+    if slot:
+        ok, reserved = slot_index.reserve(conn, *slot)
+        if not ok:
+            return None, reserved, None
+    # RETURNING gives the whole card (client name/username included), no follow-up query needed
+    cur = conn.execute(
+        "INSERT INTO orders(user_id, contact, phone_e164, additional_contact, location_lat, location_lon, district, zone, address, quantity, unit_price, total, order_time, order_ts, status, delivery_date, delivery_slot) "
+        f"VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING {ORDER_CARD_COLUMNS}",
+        values
+    )
+    row = cur.fetchall()[0]
+    order = dict(zip([col[0] for col in cur.description], row))
+    # Remember the address in the client's address book (same transaction as the order)
+    conn.execute(
+        "INSERT INTO addresses(user_id, address_key, address, location_lat, location_lon, district, zone, last_used) VALUES(?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT(user_id, address_key) DO UPDATE SET address=excluded.address, location_lat=excluded.location_lat, "
+        "location_lon=excluded.location_lon, district=excluded.district, zone=excluded.zone, "
+        "last_used=excluded.last_used, use_count=use_count + 1",
+        address_values
+    )
+    # For the subscription offer shown with the confirmation
+    active_subscriptions = conn.execute(
+        "SELECT COUNT(*) FROM subscriptions WHERE user_id = ? AND active = 1", (order['user_id'],)
+    ).fetchall()[0][0]
+    return order, reserved, active_subscriptions
+
 
 @dp.callback_query(StateFilter(OrderForm.confirm), F.data == "order_confirm")
 async def confirm_order(callback: types.CallbackQuery, state: FSMContext):
     data = await state.get_data()
     lang = await get_user_lang(callback.from_user.id, state) # Get lang from state
-    await callback.answer("✅ Подтверждено!" if lang == "ru" else "✅ Tasdiqlandi!")
+    await callback.answer(TEXT[lang]['confirmed_alert'])
 
     uid = callback.from_user.id
 
@@ -1375,12 +3767,16 @@ async def confirm_order(callback: types.CallbackQuery, state: FSMContext):
     location_lat = data.get("location_lat")
     location_lon = data.get("location_lon")
     address = data.get("address")
+    district = data.get("district")
+    zone = data.get("zone")
     quantity = data.get("quantity")
+    delivery_date = data.get("delivery_date")
+    delivery_slot = data.get("delivery_slot")
 
     # Final data validation before saving
     if not (contact and (address or (location_lat is not None and location_lon is not None)) and quantity is not None):
          logger.error(f"Missing essential data for order from user {uid}. State: {data}")
-         error_message = TEXT[lang]['error_processing'] + " " + (TEXT[lang]['start_over'] if lang == "ru" else "Yangi boshlash tugmasini bosib qaytadan urinib ko'ring.")
+         error_message = TEXT[lang]['error_processing'] + " " + TEXT[lang]['start_over_hint']
          try:
              # Attempt to edit the confirmation message to show the error
              await callback.message.edit_text(callback.message.text + "\n\n" + error_message, reply_markup=None)
@@ -1389,30 +3785,34 @@ async def confirm_order(callback: types.CallbackQuery, state: FSMContext):
 
          await state.clear() # Clear state
          # Send main menu
-         await bot.send_message(uid, TEXT[lang]['back_to_main'], reply_markup=kb_main(lang, uid in ADMIN_CHAT_IDS, await is_user_registered(uid)))
+         await bot.send_message(uid, TEXT[lang]['back_to_main'], reply_markup=kb_main(lang, is_admin(uid), await is_user_registered(uid)))
          return
 
-    now = datetime.now()
+    now = local_now()
+    order_ts = int(now.timestamp())
     order_time_str = now.strftime("%Y-%m-%d %H:%M:%S")
-    localized_date_str_admin = localize_date(now, 'ru') # Use RU for admin notification time
+    # Priced once, at confirmation; the stored total is what admins and the client see from now on
+    unit_price = price_per_bottle(zone, quantity, order_ts)
+    total = unit_price * quantity
 
-    order_id = None
+    order = None
     if db:
         try:
-            cursor = await db.cursor()
-            # Initial status 'pending'
-            await cursor.execute(
-                "INSERT INTO orders(user_id, contact, additional_contact, location_lat, location_lon, address, quantity, order_time, status) VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                (uid, contact, additional_contact, location_lat, location_lon, address, quantity, order_time_str, 'pending')
+            # Slot reservation, order (initial status 'pending') and address book in one transaction and one DB round-trip
+            order, reserved, active_subscriptions = await run_in_db(
+                store_order,
+                (uid, contact, normalize_phone(contact), additional_contact, location_lat, location_lon, district, zone, address, quantity, unit_price, total, order_time_str, order_ts, 'pending', delivery_date, delivery_slot),
+                (uid, address_key(address, location_lat, location_lon), address, location_lat, location_lon, district, zone, order_time_str),
+                (delivery_date, delivery_slot, quantity) if delivery_slot and slot_index else None
             )
-            await db.commit()
-            order_id = cursor.lastrowid
-            await cursor.close()
-            logger.info(f"New order №{order_id} created by user {uid}")
+            if reserved is not None:
+                slot_index.reserved[(delivery_date, delivery_slot)] = reserved
+            if order:
+                logger.info(f"New order №{order['order_id']} created by user {uid}")
 
         except Exception as e:
             logger.error(f"Error saving order to DB for user {uid}: {e}")
-            error_message = TEXT[lang]['error_processing'] + " " + (TEXT[lang]['back_to_main'] if lang == "ru" else "Bosh menyuga qaytish.")
+            error_message = TEXT[lang]['error_processing'] + " " + TEXT[lang]['back_to_main']
             try:
                 # Attempt to edit the confirmation message to show the error
                 await callback.message.edit_text(callback.message.text + "\n\n" + error_message, reply_markup=None)
@@ -1420,107 +3820,56 @@ async def confirm_order(callback: types.CallbackQuery, state: FSMContext):
                  await bot.send_message(uid, error_message)
 
             await state.clear() # Clear state
-            await bot.send_message(uid, TEXT[lang]['back_to_main'], reply_markup=kb_main(lang, uid in ADMIN_CHAT_IDS, await is_user_registered(uid)))
+            await bot.send_message(uid, TEXT[lang]['back_to_main'], reply_markup=kb_main(lang, is_admin(uid), await is_user_registered(uid)))
             return
     else:
          logger.error(f"DB not connected. Cannot save order for user {uid}. State: {data}")
-         error_message = TEXT[lang]['error_processing'] + " DB not connected." + " " + (TEXT[lang]['back_to_main'] if lang == "ru" else "Bosh menyuga qaytish.")
+         error_message = TEXT[lang]['error_processing'] + " DB not connected." + " " + TEXT[lang]['back_to_main']
          try:
              await callback.message.edit_text(callback.message.text + "\n\n" + error_message, reply_markup=None)
          except Exception:
               await bot.send_message(uid, error_message)
 
          await state.clear()
-         await bot.send_message(uid, TEXT[lang]['back_to_main'], reply_markup=kb_main(lang, uid in ADMIN_CHAT_IDS, await is_user_registered(uid)))
+         await bot.send_message(uid, TEXT[lang]['back_to_main'], reply_markup=kb_main(lang, is_admin(uid), await is_user_registered(uid)))
          return # Exit if order could not be saved
 
-
-    # Get client name, username from DB (more reliable after successful save)
-    user_info_db = {}
-    if db:
+    if order is None:
+        # Another order took the last capacity after the keyboard was shown: offer the slots again
+        logger.info(f"Delivery slot {delivery_date} {delivery_slot} filled up before user {uid} confirmed the order")
         try:
-            async with db.execute("SELECT name, username FROM clients WHERE user_id=?", (uid,)) as cur:
-                row = await cur.fetchone()
-                if row:
-                    user_info_db = {"name": row[0], "username": row[1]}
-            else:
-                 logger.warning(f"Client {uid} not found in DB after order save for admin notification.")
-                 # Fallback to state data if DB fetch fails (unlikely after successful insert/update)
-                 user_info_db = {"name": data.get('name'), "username": callback.from_user.username}
-
+            await callback.message.edit_text(callback.message.text + "\n\n" + TEXT[lang]['slot_full'], reply_markup=None)
         except Exception as e:
-             logger.error(f"Error fetching client info {uid} for admin notification: {e}")
-             # Fallback to state data
-             user_info_db = {"name": data.get('name'), "username": callback.from_user.username}
-    else: # Fallback if DB was not connected at all (should have exited earlier, but defensive)
-        user_info_db = {"name": data.get('name'), "username": callback.from_user.username}
-
-
-    full_name = user_info_db.get('name', TEXT['ru'].get('not_specified', 'Не указан')) # Use RU for admin
-    uname = user_info_db.get('username', "")
-    display_name = f"{full_name} (@{uname})" if uname else full_name
-    # Use contact from state (validated) or fallback
-    contact_display = data.get('contact') or TEXT['ru'].get('not_specified', 'Не указан')
-    additional_contact_display = data.get('additional_contact') or ('–') # Use RU dash for admin
-    # Show address or location placeholder for admin message (in RU)
-    address_display = data.get('address') or (TEXT['ru'].get('location_not_specified', 'Локация не указана') if location_lat is None else TEXT['ru'].get('location', 'Локация'))
-
-
-    total = quantity * PRICE_PER_BOTTLE
-
-    msg_to_admin = (
-        f"📣 <b>Новый заказ</b> (№{order_id})\n\n"
-        f"👤 {display_name}\n"
-        f"📞 Основной: {contact_display}\n"
-        f"📞 Доп.: {additional_contact_display}\n"
-        f"📍 Адрес: {address_display}\n" # Show address or "Location" if lat/lon exist (in RU)
-        f"🔢 Количество: {quantity} шт (Общая сумма: {total:,} сум)\n"
-        f"⏰ Время заказа: {localized_date_str_admin}\n" # Always RU for admin
-        f"🆔 User ID: <code>{uid}</code>\n"
-        f"✨ Статус: {STATUS_MAP['pending']['ru']}" # Initial status text for admin is always in Russian
-    )
-
-    # Notify admins and group with inline status buttons (in Russian)
-    # We assume admins prefer buttons in Russian
-    admin_order_kb = kb_admin_order_status(order_id, 'ru') # Admin buttons are always in Russian
-
-    # Collect all recipients (admins + group chat if configured)
-    all_recipients = set(ADMIN_CHAT_IDS)
-    if GROUP_CHAT_ID is not None:
-        all_recipients.add(GROUP_CHAT_ID)
+            logger.warning(f"Failed to edit summary message of user {uid} after slot overflow: {e}")
+        if not await ask_delivery_slot(callback.message, state, lang):
+            await send_order_summary(callback.message, state, lang, callback.from_user)
+        return
 
-    # Send notification message and location to all recipients
-    for chat_id in all_recipients:
-        try:
-            # Send text message first
-            await bot.send_message(chat_id, msg_to_admin, parse_mode=ParseMode.HTML, reply_markup=admin_order_kb)
-            # Then send location if available
-            if location_lat is not None and location_lon is not None:
-                await bot.send_location(chat_id, location_lat, location_lon)
-        except Exception as e:
-            # Log error if sending to a specific chat fails, but continue
-            logger.error(f"Failed to send order notification {order_id} to chat {chat_id}: {e}")
+    order_id = order['order_id']
+    # The card from INSERT ... RETURNING already has the client's name and username
+    is_registered = bool(order.get('name'))
+    if not is_registered:
+        order['name'] = data.get('name')
+    await notify_new_order(order)
 
-    # Edit user's message to remove buttons and add confirmation text
+    # Edit user's message: confirmation text instead of the buttons, plus an offer to make the delivery recurring
     try:
-        await callback.message.edit_reply_markup(reply_markup=None) # Remove inline buttons
-        # Append confirmation text to the existing summary
-        await callback.message.edit_text(callback.message.text + "\n\n" + TEXT[lang]['order_confirmed'], reply_markup=None)
+        offer_kb = await subscription_offer_keyboard(uid, lang, order_id, active_subscriptions)
+        await callback.message.edit_text(callback.message.text + "\n\n" + TEXT[lang]['order_confirmed'], reply_markup=offer_kb)
     except Exception as e:
          logger.warning(f"Failed to edit message after order confirmation {order_id} for user {uid}: {e}")
          # Send a new message if editing fails
          await bot.send_message(uid, TEXT[lang]['order_confirmed'], reply_markup=None)
 
     # Clear state and return to main menu for the user
-    is_registered = await is_user_registered(uid) # Re-check registration status
-    await bot.send_message(uid, TEXT[lang]['back_to_main'], reply_markup=kb_main(lang, uid in ADMIN_CHAT_IDS, is_registered))
+    await bot.send_message(uid, TEXT[lang]['back_to_main'], reply_markup=kb_main(lang, is_admin(uid), is_registered))
     await state.clear() # Clear state after successful order
 
 
 @dp.callback_query(StateFilter(OrderForm.confirm), F.data == "order_cancel")
 async def cancel_order_callback(callback: types.CallbackQuery, state: FSMContext):
     lang = await get_user_lang(callback.from_user.id, state) # Get lang from state
-    await callback.answer("❌ Отменено" if lang == "ru" else "❌ Bekor qilindi")
+    await callback.answer(TEXT[lang]['cancelled_alert'])
 
     uid = callback.from_user.id
 
@@ -1536,7 +3885,7 @@ async def cancel_order_callback(callback: types.CallbackQuery, state: FSMContext
 
     # Clear state and return to main menu for the user
     is_registered = await is_user_registered(uid) # Re-check registration status
-    await bot.send_message(uid, TEXT[lang]['back_to_main'], reply_markup=kb_main(lang, uid in ADMIN_CHAT_IDS, is_registered))
+    await bot.send_message(uid, TEXT[lang]['back_to_main'], reply_markup=kb_main(lang, is_admin(uid), is_registered))
     await state.clear() # Clear state after cancellation
 
 
@@ -1548,7 +3897,7 @@ async def cancel_process(message: types.Message, state: FSMContext):
     is_registered = await is_user_registered(uid) # Re-check registration status
 
     await state.clear() # Clear the state
-    await message.reply(TEXT[lang]['process_cancelled'], reply_markup=kb_main(lang, uid in ADMIN_CHAT_IDS, is_registered))
+    await message.reply(TEXT[lang]['process_cancelled'], reply_markup=kb_main(lang, is_admin(uid), is_registered))
 
 
 # --- Default handler (catches all other messages) ---
@@ -1571,7 +3920,7 @@ async def default_other_handler(message: types.Message, state: FSMContext):
          return
     # If in any other FSM state where this content type is not handled specifically,
     # or if outside FSM states.
-    await message.reply(TEXT[lang]['invalid_input'] + " " + TEXT[lang]['back_to_main'], reply_markup=kb_main(lang, uid in ADMIN_CHAT_IDS, is_registered))
+    await message.reply(TEXT[lang]['invalid_input'] + " " + TEXT[lang]['back_to_main'], reply_markup=kb_main(lang, is_admin(uid), is_registered))
     await state.clear() # Clear state on unexpected input type
 
 # Default handler for text messages that were not handled by other handlers
@@ -1592,11 +3941,155 @@ async def default_text_handler(message: types.Message, state: FSMContext):
     # If user is not in language selection or another FSM state,
     # or if it's just garbage input outside of states.
     # kb_main will be built considering user registration status.
-    await message.reply(TEXT[lang]['invalid_input'] + " " + TEXT[lang]['back_to_main'], reply_markup=kb_main(lang, uid in ADMIN_CHAT_IDS, is_registered))
+    await message.reply(TEXT[lang]['invalid_input'] + " " + TEXT[lang]['back_to_main'], reply_markup=kb_main(lang, is_admin(uid), is_registered))
     await state.clear() # Clear state on unexpected text input
 
 
 # --- Database Initialization ---
+async def ensure_column(table: str, column: str, definition: str):
+    """Adds a column to an existing table if it is missing (lightweight migration)."""
+    async with db.execute(f"PRAGMA table_info({table})") as cur:
+        columns = [row[1] for row in await cur.fetchall()]
+    if column not in columns:
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        logger.info(f"Migration: added column {table}.{column}")
+
+
+# Contact is indexed as stored (already normalized by fmt_phone) plus its last 9 digits,
+# so admins can search by the local number without the +998 prefix.
+FTS_ORDER_ROW_SQL = (
+    "SELECT {o}.order_id, "
+    "(SELECT name FROM clients WHERE user_id = {o}.user_id), "
+    "(SELECT username FROM clients WHERE user_id = {o}.user_id), "
+    "COALESCE({o}.contact, '') || ' ' || substr(COALESCE({o}.contact, ''), -9), "
+    "{o}.address, {o}.additional_contact"
+)
+
+
+async def init_search_index():
+    """Creates the FTS5 index over orders/clients and the triggers keeping it in sync."""
+    global fts_enabled
+    async with db.execute("SELECT 1 FROM sqlite_master WHERE name='orders_fts'") as cur:
+        exists = await cur.fetchone() is not None
+    try:
+        await db.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS orders_fts USING fts5("
+            "name, username, contact, address, additional_contact, "
+            "tokenize='unicode61 remove_diacritics 2')"
+        )
+    except aiosqlite.OperationalError as e:
+        # SQLite built without FTS5: the bot works, only /find is unavailable
+        logger.warning(f"FTS5 is not available, admin search disabled: {e}")
+        fts_enabled = False
+        return
+
+    await db.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS orders_fts_ai AFTER INSERT ON orders BEGIN
+            INSERT INTO orders_fts(rowid, name, username, contact, address, additional_contact)
+            {FTS_ORDER_ROW_SQL.format(o='new')};
+        END
+    ''')
+    await db.execute('''
+        CREATE TRIGGER IF NOT EXISTS orders_fts_ad AFTER DELETE ON orders BEGIN
+            DELETE FROM orders_fts WHERE rowid = old.order_id;
+        END
+    ''')
+    await db.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS orders_fts_au AFTER UPDATE OF user_id, contact, address, additional_contact ON orders BEGIN
+            DELETE FROM orders_fts WHERE rowid = old.order_id;
+            INSERT INTO orders_fts(rowid, name, username, contact, address, additional_contact)
+            {FTS_ORDER_ROW_SQL.format(o='new')};
+        END
+    ''')
+    await db.execute('''
+        CREATE TRIGGER IF NOT EXISTS clients_fts_au AFTER UPDATE OF name, username ON clients BEGIN
+            UPDATE orders_fts SET name = new.name, username = new.username
+            WHERE rowid IN (SELECT order_id FROM orders WHERE user_id = new.user_id);
+        END
+    ''')
+
+    if not exists:
+        # First start with the index: backfill existing orders once
+        await db.execute(
+            "INSERT INTO orders_fts(rowid, name, username, contact, address, additional_contact) "
+            + FTS_ORDER_ROW_SQL.format(o='orders') + " FROM orders"
+        )
+        logger.info("Full-text search index created and backfilled.")
+    fts_enabled = True
+
+
+async def backfill_phone_e164():
+    """
+    Fills phone_e164 of the rows where it is NULL (written before the column existed, or since with a contact that
+    is not an Uzbek number). A contact that is not an Uzbek number gets '' so it is not looked at again on the next start.
+    """
+    for table, key in (('clients', 'user_id'), ('orders', 'order_id')):
+        async with db.execute(f"SELECT {key}, contact FROM {table} WHERE phone_e164 IS NULL AND contact IS NOT NULL") as cur:
+            rows = await cur.fetchall()
+        if not rows:
+            continue
+        updates = [(normalize_phone(contact) or '', row_id) for row_id, contact in rows]
+        await db.executemany(f"UPDATE {table} SET phone_e164=? WHERE {key}=?", updates)
+        await db.commit()
+        normalized = sum(1 for phone, _ in updates if phone)
+        logger.info(f"Migration: normalized {normalized} phone numbers in {table} ({len(updates) - normalized} not Uzbek numbers)")
+
+
+async def backfill_order_totals():
+    """
+    Stores unit_price/total on orders created before they were stored, priced as of their order_ts (backfilled by
+    init_db; an order whose order_time could not be parsed is priced at today's prices).
+    """
+    async with db.execute("SELECT order_id, zone, quantity, order_ts FROM orders WHERE total IS NULL") as cur:
+        rows = await cur.fetchall()
+    updates = []
+    for order_id, zone, quantity, order_ts in rows:
+        unit_price = price_per_bottle(zone, quantity, order_ts)
+        updates.append((unit_price, unit_price * quantity, order_id))
+    if updates:
+        await db.executemany("UPDATE orders SET unit_price=?, total=? WHERE order_id=?", updates)
+        await db.commit()
+        logger.info(f"Migration: stored totals of {len(updates)} orders")
+
+
+async def backfill_order_ts():
+    """Fills order_ts of orders created before it was stored, from order_time (written in the server's local time)."""
+    async with db.execute(
+        "UPDATE orders SET order_ts = CAST(strftime('%s', order_time, 'utc') AS INTEGER) "
+        "WHERE order_ts IS NULL AND order_time IS NOT NULL"
+    ) as cur:
+        updated = cur.rowcount
+    if updated > 0:
+        logger.info(f"Migration: stored order_ts of {updated} orders")
+
+
+async def init_status_history():
+    """Triggers filling order_status_history and keeping it append-only."""
+    await db.execute('''
+        CREATE TRIGGER IF NOT EXISTS orders_status_history_ai AFTER INSERT ON orders BEGIN
+            INSERT INTO order_status_history(order_id, old_status, new_status, admin_id)
+            VALUES (new.order_id, NULL, new.status, new.status_admin_id);
+        END
+    ''')
+    await db.execute('''
+        CREATE TRIGGER IF NOT EXISTS orders_status_history_au AFTER UPDATE OF status ON orders
+        WHEN old.status IS NOT new.status BEGIN
+            INSERT INTO order_status_history(order_id, old_status, new_status, admin_id)
+            VALUES (new.order_id, old.status, new.status, new.status_admin_id);
+        END
+    ''')
+    await db.execute('''
+        CREATE TRIGGER IF NOT EXISTS order_status_history_no_update BEFORE UPDATE ON order_status_history BEGIN
+            SELECT RAISE(ABORT, 'order_status_history is append-only');
+        END
+    ''')
+    await db.execute('''
+        CREATE TRIGGER IF NOT EXISTS order_status_history_no_delete BEFORE DELETE ON order_status_history BEGIN
+            SELECT RAISE(ABORT, 'order_status_history is append-only');
+        END
+    ''')
+
+
 async def init_db():
     """Initializes the database (creates tables if they don't exist)."""
     logger.info("Initializing database...")
@@ -1611,6 +4104,7 @@ async def init_db():
                 user_id INTEGER PRIMARY KEY,
                 username TEXT,
                 contact TEXT,
+                phone_e164 TEXT, -- Canonical +998XXXXXXXXX form of contact (NULL if not an Uzbek number, '' once backfill_phone_e164 checked it)
                 name TEXT, -- Full name or passport photo indicator
                 language TEXT -- User's preferred language ('ru' or 'uz')
             )
@@ -1621,17 +4115,163 @@ async def init_db():
                 order_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER, -- Link to the client who placed the order
                 contact TEXT, -- Client's primary contact (saved at order time)
+                phone_e164 TEXT, -- Canonical +998XXXXXXXXX form of contact (NULL if not an Uzbek number, '' once backfill_phone_e164 checked it)
                 additional_contact TEXT, -- Additional contact for this specific order
                 location_lat REAL, -- Latitude if location was sent
                 location_lon REAL, -- Longitude if location was sent
                 address TEXT, -- Manual address input
+                district TEXT, -- District id resolved offline from location (see DISTRICTS_PATH)
+                zone TEXT, -- Delivery zone id (see SERVICE_ZONES_PATH), NULL for manual address or out-of-zone
                 quantity INTEGER, -- Number of bottles
-                order_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP, -- Time the order was placed
+                order_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP, -- Time the order was placed (text in TIMEZONE; older rows in server time)
+                order_ts INTEGER, -- Same as Unix time: what lists sort, filter and render by (in TIMEZONE)
                 status TEXT DEFAULT 'pending', -- Order status: 'pending', 'accepted', 'in_progress', 'completed', 'rejected'
+                status_admin_id INTEGER, -- Admin who set the current status (see ORDER_STATUS_TRANSITIONS)
+                subscription_id INTEGER, -- Set for orders created by a subscription
+                delivery_date TEXT, -- Delivery day (YYYY-MM-DD) chosen at the slot step, NULL without slots
+                delivery_slot TEXT, -- Delivery slot ("HH:MM-HH:MM", see DELIVERY_SLOTS)
+                unit_price INTEGER, -- Price per bottle: the zone's volume tier in force when the order was placed
+                total INTEGER, -- unit_price * quantity
                 -- Foreign key to clients table with CASCADE delete
                 FOREIGN KEY (user_id) REFERENCES clients (user_id) ON DELETE CASCADE
             )
         ''')
+        # Create saved addresses table (client's address book) if it doesn't exist
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS addresses (
+                address_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                address_key TEXT NOT NULL, -- Normalized address text or rounded coordinates, see address_key()
+                address TEXT,
+                location_lat REAL,
+                location_lon REAL,
+                district TEXT,
+                zone TEXT,
+                use_count INTEGER DEFAULT 1,
+                last_used TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (user_id, address_key),
+                FOREIGN KEY (user_id) REFERENCES clients (user_id) ON DELETE CASCADE
+            )
+        ''')
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_addresses_user_last_used ON addresses(user_id, last_used DESC)")
+        # Copies of each order notification (admin chats + group), so status changes can update all of them
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS order_messages (
+                order_id INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                PRIMARY KEY (order_id, chat_id, message_id),
+                FOREIGN KEY (order_id) REFERENCES orders (order_id) ON DELETE CASCADE
+            )
+        ''')
+        # Recurring deliveries: delivery details copied from the order the client subscribed to
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS subscriptions (
+                subscription_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                quantity INTEGER NOT NULL,
+                interval_days INTEGER NOT NULL,
+                contact TEXT,
+                phone_e164 TEXT,
+                additional_contact TEXT,
+                address TEXT,
+                location_lat REAL,
+                location_lon REAL,
+                district TEXT,
+                zone TEXT,
+                next_run INTEGER NOT NULL, -- Unix time of the next order
+                active INTEGER NOT NULL DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES clients (user_id) ON DELETE CASCADE
+            )
+        ''')
+        # Scheduler windows are range scans over this index; cancelled subscriptions are not in it
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_next_run ON subscriptions(next_run) WHERE active = 1")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_subscriptions_user ON subscriptions(user_id)")
+        # Runtime settings (see Settings); seeded from the environment on the first start
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                updated_by INTEGER, -- Admin who changed it (NULL for the seed and the settings file)
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        await db.executemany("INSERT OR IGNORE INTO settings(key, value) VALUES(?, ?)", [
+            ('admin_chat_ids', ",".join(map(str, ADMIN_CHAT_IDS))),
+            ('group_chat_id', str(GROUP_CHAT_ID) if GROUP_CHAT_ID is not None else ""),
+        ])
+        # Price lists with volume tiers: rows with the same effective_from form one list (see PriceBook)
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS prices (
+                price_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                effective_from TEXT NOT NULL, -- YYYY-MM-DD HH:MM:SS
+                min_quantity INTEGER NOT NULL DEFAULT 1, -- Tier applies from this many bottles
+                price INTEGER NOT NULL, -- Per bottle
+                created_by INTEGER, -- Admin who set it (NULL for the initial PRICE_PER_BOTTLE seed)
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (effective_from, min_quantity)
+            )
+        ''')
+        await db.execute(
+            "INSERT INTO prices(effective_from, min_quantity, price) SELECT '1970-01-01 00:00:00', 1, ? WHERE NOT EXISTS (SELECT 1 FROM prices)",
+            (PRICE_PER_BOTTLE,)
+        )
+        # Bottles reserved per delivery slot; updated in the order transaction (see SlotIndex.reserve)
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS slot_reservations (
+                slot_date TEXT NOT NULL, -- YYYY-MM-DD
+                slot TEXT NOT NULL, -- HH:MM-HH:MM as configured in DELIVERY_SLOTS
+                reserved INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (slot_date, slot)
+            ) WITHOUT ROWID
+        ''')
+        # Append-only audit log of order status changes, written by triggers (see init_status_history)
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS order_status_history (
+                history_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                order_id INTEGER NOT NULL,
+                old_status TEXT, -- NULL for the initial status of a new order
+                new_status TEXT NOT NULL,
+                admin_id INTEGER, -- Admin who changed the status (NULL when the client placed the order)
+                changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_order_status_history_order ON order_status_history(order_id, history_id)")
+        # Migrations for databases created by older versions
+        await ensure_column('orders', 'district', 'TEXT')
+        await ensure_column('orders', 'zone', 'TEXT')
+        await ensure_column('clients', 'phone_e164', 'TEXT')
+        await ensure_column('orders', 'phone_e164', 'TEXT')
+        await ensure_column('orders', 'status_admin_id', 'INTEGER')
+        await ensure_column('orders', 'subscription_id', 'INTEGER')
+        await ensure_column('orders', 'delivery_date', 'TEXT')
+        await ensure_column('orders', 'delivery_slot', 'TEXT')
+        await ensure_column('orders', 'unit_price', 'INTEGER')
+        await ensure_column('orders', 'total', 'INTEGER')
+        await ensure_column('orders', 'order_ts', 'INTEGER')
+        await backfill_order_ts()
+        await init_status_history()
+        # A rejected order gives its bottles back to the slot (SlotIndex.release mirrors this in memory)
+        await db.execute('''
+            CREATE TRIGGER IF NOT EXISTS orders_slot_release AFTER UPDATE OF status ON orders
+            WHEN new.status = 'rejected' AND old.status != 'rejected' AND new.delivery_slot IS NOT NULL
+            BEGIN
+                UPDATE slot_reservations SET reserved = MAX(reserved - new.quantity, 0)
+                WHERE slot_date = new.delivery_date AND slot = new.delivery_slot;
+            END
+        ''')
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_clients_phone_e164 ON clients(phone_e164)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_orders_phone_e164 ON orders(phone_e164)")
+        # Time ranges (API since/until) and a client's orders newest first
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_orders_ts ON orders(order_ts)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_ts ON orders(user_id, order_ts)")
+        # Partial index: only open orders, so it stays small however many completed orders accumulate
+        await db.execute(f"CREATE INDEX IF NOT EXISTS idx_orders_open ON orders(order_id, status) WHERE {OPEN_STATUSES_SQL}")
+        await backfill_phone_e164()
+        await reload_price_book()
+        await reload_settings()
+        await init_search_index()
         await db.commit()
         logger.info("Database initialized.")
     except Exception as e:
@@ -1640,40 +4280,483 @@ async def init_db():
          exit(1)
 
 
+# --- Admin JSON API (read-only, mounted on the webhook aiohttp app under /api) ---
+API_FETCH_SIZE = 200 # Rows fetched from the DB cursor per NDJSON chunk
+API_BOOT_ID = os.urandom(4).hex() # Part of version ETags: total_changes() starts from zero on every start
+SSE_KEEPALIVE_SECONDS = 15 # Comment frames keep idle connections open through Render's proxy
+
+
+def api_error(status: int, message: str) -> web.Response:
+    return web.json_response({'error': message}, status=status)
+
+
+@web.middleware
+async def api_auth_middleware(request, handler):
+    """Bearer token check (constant-time) for every /api route; 503 until startup is complete (see main())."""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip().encode(), ADMIN_API_TOKEN.encode()):
+        response = api_error(401, 'unauthorized')
+        response.headers['WWW-Authenticate'] = 'Bearer'
+        return response
+    if not webhook_gate.ready.is_set():
+        return api_error(503, 'starting')
+    return await handler(request)
+
+
+def etag_matches(request, etag: str) -> bool:
+    """If-None-Match check (weak comparison, as RFC 9110 requires for If-None-Match)."""
+    if not request.if_none_match:
+        return False
+    value = etag.removeprefix('W/').strip('"')
+    return any(tag.value == '*' or tag.value == value for tag in request.if_none_match)
+
+
+async def db_version_etag() -> str:
+    """
+    Weak ETag that changes whenever the database changes: total_changes() counts rows written by our
+    connection (the bot is the only writer), data_version catches commits from other connections.
+    Cheap to compute, so list/aggregate endpoints can answer 304 without running their queries.
+    """
+    async with db.execute("SELECT total_changes(), (SELECT data_version FROM pragma_data_version())") as cur:
+        changes, data_version = await cur.fetchone()
+    return f'W/"{API_BOOT_ID}.{changes}.{data_version}"'
+
+
+def api_json_response(request, data, etag: str = None) -> web.Response:
+    """JSON response with an ETag (a hash of the body unless given); 304 if the client already has it."""
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    etag = etag or '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+    if etag_matches(request, etag):
+        return web.Response(status=304, headers={'ETag': etag})
+    return web.Response(body=body, content_type='application/json', charset='utf-8', headers={'ETag': etag})
+
+
+async def api_list_orders(request):
+    """
+    GET /api/orders?after=<order_id>&limit=<n>&status=<status>&since=<unix time>&until=<unix time>
+    Streams orders (oldest first) as NDJSON straight from the DB cursor. Without limit streams everything.
+    Cursor pagination: pass the last order_id you received as `after`. since/until select orders placed
+    in [since, until) by order_ts.
+    """
+    try:
+        after = int(request.query.get('after', 0))
+        limit = int(request.query['limit']) if 'limit' in request.query else None
+        since = int(request.query['since']) if 'since' in request.query else None
+        until = int(request.query['until']) if 'until' in request.query else None
+    except ValueError:
+        return api_error(400, 'after, limit, since and until must be integers')
+    if limit is not None and limit < 1:
+        return api_error(400, 'limit must be positive')
+    status = request.query.get('status')
+    if status is not None and status not in ORDER_STATUSES:
+        return api_error(400, f"unknown status, expected one of: {', '.join(ORDER_STATUSES)}")
+
+    etag = await db_version_etag()
+    if etag_matches(request, etag):
+        return web.Response(status=304, headers={'ETag': etag})
+
+    sql, params = f"SELECT {ORDER_CARD_COLUMNS} FROM orders WHERE order_id > ?", [after]
+    if status is not None:
+        sql += " AND status = ?"
+        params.append(status)
+    if since is not None:
+        sql += " AND order_ts >= ?"
+        params.append(since)
+    if until is not None:
+        sql += " AND order_ts < ?"
+        params.append(until)
+    sql += " ORDER BY order_id"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+
+    response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson; charset=utf-8', 'ETag': etag})
+    await response.prepare(request)
+    async with db.execute(sql, params) as cur:
+        columns = [col[0] for col in cur.description]
+        while rows := await cur.fetchmany(API_FETCH_SIZE):
+            chunk = "".join(json.dumps(dict(zip(columns, row)), ensure_ascii=False, separators=(',', ':')) + "\n" for row in rows)
+            await response.write(chunk.encode('utf-8'))
+    await response.write_eof()
+    return response
+
+
+async def api_get_order(request):
+    """GET /api/orders/{order_id}"""
+    try:
+        order_id = int(request.match_info['order_id'])
+    except ValueError:
+        return api_error(400, 'order_id must be an integer')
+    order = await fetch_order_card(order_id)
+    if not order:
+        return api_error(404, 'order not found')
+    return api_json_response(request, order)
+
+
+async def api_get_client(request):
+    """GET /api/clients/{user_id}: client profile with order counts per status."""
+    try:
+        user_id = int(request.match_info['user_id'])
+    except ValueError:
+        return api_error(400, 'user_id must be an integer')
+    async with db.execute("SELECT user_id, username, contact, NULLIF(phone_e164, '') AS phone_e164, name, language FROM clients WHERE user_id=?", (user_id,)) as cur:
+        row = await cur.fetchone()
+        if row is None:
+            return api_error(404, 'client not found')
+        client = dict(zip([col[0] for col in cur.description], row))
+    async with db.execute("SELECT status, COUNT(*), MAX(order_id) FROM orders WHERE user_id=? GROUP BY status", (user_id,)) as cur:
+        rows = await cur.fetchall()
+    client['orders_by_status'] = {status: count for status, count, _ in rows}
+    client['last_order_id'] = max((last_id for _, _, last_id in rows), default=None)
+    return api_json_response(request, client)
+
+
+async def api_stats(request):
+    """GET /api/stats: order and client totals."""
+    etag = await db_version_etag()
+    if etag_matches(request, etag):
+        return web.Response(status=304, headers={'ETag': etag})
+    async with db.execute("SELECT status, COUNT(*), COALESCE(SUM(quantity), 0) FROM orders GROUP BY status") as cur:
+        rows = await cur.fetchall()
+    async with db.execute("SELECT COUNT(*) FROM clients") as cur:
+        (clients_total,) = await cur.fetchone()
+    stats = {
+        'orders_total': sum(count for _, count, _ in rows),
+        'orders_by_status': {status: count for status, count, _ in rows},
+        'bottles_by_status': {status: bottles for status, _, bottles in rows},
+        'clients_total': clients_total,
+    }
+    return api_json_response(request, stats, etag)
+
+
+async def api_events(request):
+    """
+    GET /api/events: Server-Sent Events feed of 'order_created' and 'order_status' events (data is the order card).
+    Pushed from the in-process EventBus, so screens do not poll the DB. There is no replay:
+    on (re)connect a screen loads the current state from /api/orders once and then applies events.
+    """
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream; charset=utf-8',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no', # Disable proxy buffering
+    })
+    await response.prepare(request)
+    queue = event_bus.subscribe()
+    logger.info(f"Event subscriber connected from {request.remote} ({len(event_bus.subscribers)} total)")
+    try:
+        await response.write(b": connected\n\n")
+        while True:
+            try:
+                frame = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                await response.write(b": keepalive\n\n")
+                continue
+            if frame is None: # Dropped by the bus as a slow consumer
+                break
+            await response.write(frame)
+    except ConnectionResetError:
+        pass # Client went away
+    finally:
+        event_bus.unsubscribe(queue)
+        logger.info(f"Event subscriber from {request.remote} disconnected")
+    return response
+
+
+def create_api_app() -> web.Application:
+    """Sub-application with the admin API routes (mounted under /api)."""
+    api = web.Application(middlewares=[api_auth_middleware])
+    api.router.add_get('/orders', api_list_orders)
+    api.router.add_get('/orders/{order_id}', api_get_order)
+    api.router.add_get('/clients/{user_id}', api_get_client)
+    api.router.add_get('/stats', api_stats)
+    api.router.add_get('/events', api_events)
+    return api
+
+
 # --- Main function to run the bot with webhook ---
-async def main():
-    global db
+# --- Webhook server lifecycle ---
+class WebhookGate:
+    """
+    Start and stop of the webhook server. As an aiogram outer middleware it counts the updates being handled: the
+    webhook handler acknowledges an update right away and handles it in a background task, so the HTTP requests say
+    nothing about it. The server listens before the DB is open (see main()): updates arriving until `ready` is set
+    wait for it. As an aiohttp middleware in front of the webhook route it answers 503 once closed: Telegram keeps
+    an update until it gets a 200, so it redelivers those to the next instance instead of losing them.
+    """
+
+    def __init__(self):
+        self.in_flight = 0
+        self.closed = False
+        self.ready = asyncio.Event()
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    async def __call__(self, handler, event: types.Update, data: dict):
+        self.in_flight += 1
+        self.idle.clear()
+        try:
+            if not self.ready.is_set():
+                await self.ready.wait()
+            return await handler(event, data)
+        finally:
+            self.in_flight -= 1
+            if not self.in_flight:
+                self.idle.set()
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        if self.closed and request.path == WEBHOOK_SECRET_PATH:
+            return web.Response(status=503, text="Shutting down")
+        return await handler(request)
+
+    def close(self):
+        self.closed = True
+
+
+webhook_gate = WebhookGate()
+dp.update.outer_middleware(webhook_gate)
+
+
+class HealthMonitor:
+    """
+    Readiness state for /health/ready, measured in the background so that a probe only reads it: a `SELECT 1`
+    every `interval` seconds (timing out after `interval`, so a wedged DB shows up) and the event loop lag,
+    i.e. how late a timer firing every `tick` seconds is.
+    """
+
+    tick = 0.5
+
+    def __init__(self, interval: float, max_loop_lag: float, max_in_flight: int):
+        self.interval = interval
+        self.max_loop_lag = max_loop_lag
+        self.max_in_flight = max_in_flight
+        self.loop_lag = 0.0
+        self.next_tick = None # Loop time the lag timer is due at
+        self.db_error = 'not checked yet' # None when the last ping succeeded
+        self.db_latency = None
+        self.db_checked = None # Loop time of the last finished ping
+        self.pending_ping = None # SELECT 1 not answered yet (it stays queued on aiosqlite's thread after a timeout)
+        self.ping_started = None
+        self.tasks = []
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self.measure_loop_lag()), asyncio.create_task(self.ping_db_forever())]
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+
+    async def measure_loop_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self.next_tick = loop.time() + self.tick
+            await asyncio.sleep(self.tick)
+            self.loop_lag = max(loop.time() - self.next_tick, 0.0)
+
+    async def ping_db(self):
+        """
+        Waits up to `interval` for a `SELECT 1`. A ping that timed out cannot be taken back from aiosqlite's queue,
+        so while it is unanswered no new one is queued: the next call waits for the same one.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            if db is None:
+                raise RuntimeError("not connected")
+            if self.pending_ping is None:
+                self.ping_started = loop.time()
+                self.pending_ping = asyncio.ensure_future(db.execute_fetchall("SELECT 1"))
+            await asyncio.wait_for(asyncio.shield(self.pending_ping), self.interval)
+            self.db_error = None
+        except asyncio.TimeoutError:
+            self.db_error = f"no answer to SELECT 1 for {loop.time() - self.ping_started:.1f} s"
+        except Exception as e:
+            self.db_error = str(e) or type(e).__name__
+        finally:
+            if self.pending_ping is not None and self.pending_ping.done():
+                self.pending_ping = None
+        self.db_checked = loop.time()
+        self.db_latency = self.db_checked - (self.ping_started or self.db_checked)
+
+    async def ping_db_forever(self):
+        while True:
+            await self.ping_db()
+            await asyncio.sleep(self.interval)
+
+    def readiness(self) -> tuple:
+        """(ready, report): report holds the measurements and the reasons for not being ready."""
+        now = asyncio.get_running_loop().time()
+        # A timer that is overdue right now counts too (e.g. the loop was just blocked for a while)
+        loop_lag = max(self.loop_lag, now - self.next_tick) if self.next_tick else 0.0
+        reasons = []
+        if webhook_gate.closed:
+            reasons.append("shutting down")
+        elif not webhook_gate.ready.is_set():
+            reasons.append("starting")
+        if self.db_error:
+            reasons.append(f"database: {self.db_error}")
+        elif now - self.db_checked > 2 * self.interval + self.tick:
+            reasons.append(f"database: last successful check {now - self.db_checked:.0f} s ago")
+        if loop_lag > self.max_loop_lag:
+            reasons.append(f"event loop lag {loop_lag * 1000:.0f} ms > {self.max_loop_lag * 1000:.0f} ms")
+        if webhook_gate.in_flight > self.max_in_flight:
+            reasons.append(f"{webhook_gate.in_flight} updates in progress > {self.max_in_flight}")
+        report = {
+            'status': 'unavailable' if reasons else 'ok',
+            'reasons': reasons,
+            'db_latency_ms': None if self.db_latency is None else round(self.db_latency * 1000, 1),
+            'db_checked_seconds_ago': None if self.db_checked is None else round(now - self.db_checked, 1),
+            'loop_lag_ms': round(loop_lag * 1000, 1),
+            'updates_in_flight': webhook_gate.in_flight,
+            'event_subscribers': len(event_bus.subscribers),
+        }
+        return not reasons, report
+
+
+health_monitor = HealthMonitor(HEALTH_CHECK_SECONDS, HEALTH_MAX_LOOP_LAG_MS / 1000, HEALTH_MAX_IN_FLIGHT)
+
+
+async def health_live(request):
+    """Liveness: the process and its event loop answer."""
+    return web.json_response({'status': 'ok'})
+
+
+async def health_ready(request):
+    """Readiness from the last background measurements (see HealthMonitor): 200, or 503 with the reasons."""
+    ready, report = health_monitor.readiness()
+    return web.json_response(report, status=200 if ready else 503)
+
+
+async def shutdown(runner: web.AppRunner = None, site: web.TCPSite = None):
+    """
+    Graceful stop: stop listening and refuse new webhook updates, wait (until SHUTDOWN_TIMEOUT in total) for the
+    updates being handled and for the scheduler's batch in progress, commit what is pending, then close the web
+    server, the bot session and the DB, in that order. The webhook is kept unless DELETE_WEBHOOK_ON_SHUTDOWN.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SHUTDOWN_TIMEOUT
+    webhook_gate.close()
+    if site:
+        await site.stop()
+    await asyncio.sleep(0) # Let updates acknowledged just before start their handling (and show up in_flight)
+    if settings_watcher:
+        settings_watcher.cancel()
+    health_monitor.stop()
+    if subscription_scheduler:
+        subscription_scheduler.stop()
+
+    if webhook_gate.in_flight:
+        logger.info(f"Waiting for {webhook_gate.in_flight} updates in progress...")
+        try:
+            await asyncio.wait_for(webhook_gate.idle.wait(), max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            logger.warning(f"{webhook_gate.in_flight} updates still in progress after {SHUTDOWN_TIMEOUT} s, they will be cut off")
+    tasks = [task for task in (subscription_scheduler and subscription_scheduler.task, settings_watcher) if task]
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=max(deadline - loop.time(), 0))
+        for task in pending:
+            logger.warning(f"Background task {task.get_coro().__qualname__} did not finish in time, cancelling it")
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    event_bus.close()
+    if runner:
+        await runner.cleanup()
+    if DELETE_WEBHOOK_ON_SHUTDOWN:
+        try:
+            logger.info("Deleting webhook...")
+            await bot.delete_webhook()
+            logger.info("Webhook deleted.")
+        except Exception as e:
+            logger.warning(f"Failed to delete webhook on shutdown: {e}")
+    await bot.session.close()
+
+    # Close DB connection (after committing anything a cut-off handler left open)
+    if db:
+        try:
+            if db.in_transaction:
+                await db.commit()
+            await db.close()
+            logger.info("Database connection closed.")
+        except Exception as e:
+            logger.error(f"Error closing DB connection: {e}")
+
+
+async def open_database():
+    """Connects to the DB, creates/migrates the tables and loads the delivery slot capacity kept in memory."""
+    global db, slot_index
     logger.info(f"Connecting to database at {DATABASE_PATH}...")
     try:
         # Use the configured DATABASE_PATH
         db = await aiosqlite.connect(DATABASE_PATH)
         db.row_factory = aiosqlite.Row # Allow accessing columns by name
         logger.info("Database connection successful.")
+        # run_in_db uses aiosqlite internals: fail here, not on the first order, if an upgrade changed them
+        if not (hasattr(db, '_execute') and hasattr(db, '_conn')):
+            raise RuntimeError(f"aiosqlite {getattr(aiosqlite, '__version__', '?')} has no Connection._execute/_conn, needed by run_in_db")
         await init_db() # Initialize tables if they don't exist
     except Exception as e:
         logger.critical(f"Critical error connecting or initializing DB: {e}")
         # Critical failure: bot cannot work without DB
         exit(1)
 
-    logger.info("Starting bot with Webhook...")
-    # Log configuration values for debugging on Render
-    logger.info(f"ADMIN_CHAT_IDS: {ADMIN_CHAT_IDS}")
-    logger.info(f"GROUP_CHAT_ID: {GROUP_CHAT_ID}")
-    logger.info(f"PRICE_PER_BOTTLE: {PRICE_PER_BOTTLE}")
-    logger.info(f"WEBHOOK_URL: {WEBHOOK_URL}") # Log the final URL being set in Telegram
-    logger.info(f"WEBHOOK_PATH: {WEBHOOK_SECRET_PATH}")
-    logger.info(f"WEBAPP_HOST: {WEBAPP_HOST}")
-    logger.info(f"WEBAPP_PORT: {WEBAPP_PORT}")
-    logger.info(f"DATABASE_PATH: {DATABASE_PATH}")
+    # Delivery slot capacity is kept in memory; the slot keyboard is built without queries
+    if DELIVERY_SLOTS:
+        slot_index = SlotIndex(DELIVERY_SLOTS, SLOT_DAYS_AHEAD)
+        await slot_index.load()
+    else:
+        logger.info("DELIVERY_SLOTS is empty, delivery slot step disabled.")
+
+
+async def load_geo_indexes():
+    """Builds the district and delivery zone indexes in worker threads, alongside the DB init."""
+    global district_index, zone_index
+    # Offline district lookup (optional: orders just won't carry a district without DISTRICTS_PATH)
+    # Delivery zones are compiled once into the same grid index; lookups at the location step are in-memory
+    async def load(path):
+        return await asyncio.to_thread(load_polygon_index, path) if path else None
+
+    if not DISTRICTS_PATH:
+        logger.info("DISTRICTS_PATH is not set, district lookup disabled.")
+    district_index, zone_index = await asyncio.gather(load(DISTRICTS_PATH), load(SERVICE_ZONES_PATH))
+
 
+async def ensure_webhook() -> bool:
+    """
+    Sets the webhook unless Telegram already has it (the secret token is the URL path, so an unchanged URL means
+    unchanged settings). Returns True if it was set.
+    """
+    try:
+        info = await bot.get_webhook_info()
+        if info.url == WEBHOOK_URL:
+            logger.info("Webhook is already set, not setting it again.")
+            return False
+        logger.info(f"Webhook is {info.url or 'not set'}, setting it to {WEBHOOK_URL}...")
+    except Exception as e:
+        logger.warning(f"getWebhookInfo failed ({e}), setting webhook to {WEBHOOK_URL}...")
+    # Use secret_token for additional security - Telegram will include this in the header,
+    # and SimpleRequestHandler will verify it.
+    await bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET_PATH)
+    logger.info("Webhook successfully set.")
+    return True
+
+
+async def timed(timings: dict, name: str, coro):
+    """Awaits coro, recording its duration in seconds under timings[name]."""
+    started = time.perf_counter()
     try:
-        # Set webhook URL in Telegram
-        logger.info(f"Setting webhook URL to {WEBHOOK_URL}...")
-        # Use secret_token for additional security - Telegram will include this in the header,
-        # and SimpleRequestHandler will verify it.
-        await bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET_PATH)
-        logger.info("Webhook successfully set.")
+        return await coro
+    finally:
+        timings[name] = time.perf_counter() - started
+
 
+async def main():
+    global subscription_scheduler, settings_watcher
+    started = time.perf_counter()
+    timings = {}
+    logger.info("Starting bot with Webhook...")
+
+    runner = site = None
+    try:
         # Configure webhook handler
         webhook_request_handler = SimpleRequestHandler(
             dispatcher=dp,
@@ -1681,129 +4764,115 @@ async def main():
             secret_token=WEBHOOK_SECRET_PATH # Verify secret token from incoming updates
         )
 
-        # Create aiohttp web application
-        app = web.Application()
+        # Create aiohttp web application (webhook_gate refuses new updates on shutdown)
+        app = web.Application(middlewares=[webhook_gate.middleware])
 
         # Add the webhook handler route. Telegram POSTs updates to this path.
         # This MUST match WEBHOOK_SECRET_PATH
         app.router.add_post(WEBHOOK_SECRET_PATH, webhook_request_handler)
 
         # Add a health check endpoint (recommended for Render Web Services)
-        # Render uses this to check if your service is alive.
+        # Render uses this to check if your service is alive; 503 until startup is complete.
         async def health_check(request):
-            # You could add a simple DB check here too if needed:
-            # try:
-            #    if db: await db.execute("SELECT 1")
-            #    return web.Response(status=200, text="OK")
-            # except Exception:
-            #    return web.Response(status=500, text="DB Error")
-             return web.Response(status=200, text="OK")
+            if not webhook_gate.ready.is_set():
+                return web.Response(status=503, text="Starting")
+            return web.Response(status=200, text="OK")
 
 
         app.router.add_get("/health", health_check) # Render Health Check path
-        logger.info("Health check endpoint /health added.")
-
-        # Add any other routes if necessary (e.g., for specific testing)
-        # app.router.add_get("/test", lambda r: web.Response(text="Test OK"))
-
+        # Probes for orchestrators/monitoring: liveness, and readiness with the reasons as JSON
+        app.router.add_get("/health/live", health_live)
+        app.router.add_get("/health/ready", health_ready)
+        logger.info("Health check endpoints /health, /health/live, /health/ready added.")
+
+        # Read-only JSON API for the back-office dashboard
+        if ADMIN_API_TOKEN:
+            app.add_subapp("/api", create_api_app())
+            logger.info("Admin API endpoints /api/* added.")
+        else:
+            logger.info("ADMIN_API_TOKEN is not set, admin API disabled.")
 
         # Setup Aiogram with the aiohttp application.
         # This connects the dispatcher to the web application's router.
+        # Handlers are registered by their decorators.
         setup_application(app, dp, bot=bot)
 
-
-        # Register your handlers BEFORE starting the web server runner.
-        # Handlers are registered with the dispatcher (dp), not the aiohttp app.
-        # Order matters: Specific FSM -> General Buttons -> Defaults
-
-        # 1. Commands (/start)
-        dp.message.register(cmd_start, Command("start"))
-
-        # 2. FSM-specific button handlers (Cancel, Back, Skip)
-        dp.message.register(handle_cancel_btn, StateFilter(OrderForm), F.text.in_([BTN['ru']['cancel'], BTN['uz']['cancel']]))
-        dp.message.register(handle_back_btn, StateFilter(OrderForm.address, OrderForm.additional, OrderForm.quantity), F.text.in_([BTN['ru']['back'], BTN['uz']['back']]))
-        dp.message.register(handle_skip_btn, OrderForm.additional, F.text.in_([BTN['ru']['skip'], BTN['uz']['skip']]))
-
-        # 3. FSM handlers by content type/text for specific states
-        dp.message.register(process_lang, LangSelect.choosing, F.text.in_(["🇷🇺 Русский", "🇺🇿 Ўзбек"]))
-        dp.message.register(reg_contact, OrderForm.contact, F.content_type == ContentType.CONTACT) # Use enum
-        dp.message.register(prompt_contact_again, OrderForm.contact) # Catches other input in contact state
-        dp.message.register(reg_name_text, OrderForm.name, F.content_type == ContentType.TEXT) # Use enum
-        dp.message.register(reg_name_photo, OrderForm.name, F.content_type == ContentType.PHOTO) # Use enum
-        dp.message.register(prompt_name_again, OrderForm.name) # Catches other input in name state
-        dp.message.register(loc_received, OrderForm.location, F.content_type == ContentType.LOCATION) # Use enum
-        dp.message.register(enter_addr_manual, OrderForm.location, F.text.in_([BTN['ru']['enter_address'], BTN['uz']['enter_address']]))
-        dp.message.register(handle_location_text_input, OrderForm.location, F.text) # Catches invalid text in location state
-
-        dp.message.register(handle_address_text, OrderForm.address, F.text)
-        dp.message.register(prompt_address_again, OrderForm.address) # Catches other input in address state
-        dp.message.register(handle_additional_text, OrderForm.additional, F.text)
-        dp.message.register(prompt_additional_again, OrderForm.additional) # Catches other input in additional state
-        dp.message.register(handle_quantity_text, OrderForm.quantity, F.text)
-        dp.message.register(prompt_quantity_again, OrderForm.quantity) # Catches other input in quantity state
-
-
-        # 4. Inline button handlers (order confirmation/cancellation, admin status, admin confirms)
-        dp.callback_query.register(confirm_order, StateFilter(OrderForm.confirm), F.data == "order_confirm")
-        dp.callback_query.register(cancel_order_callback, StateFilter(OrderForm.confirm), F.data == "order_cancel")
-        dp.callback_query.register(handle_admin_clear_callback, AdminStates.main, F.data.startswith("admin_clear_"))
-        dp.callback_query.register(handle_confirm_clear_clients, AdminStates.confirm_clear_clients, F.data.startswith("admin_confirm_clients_"))
-        dp.callback_query.register(handle_confirm_clear_orders, AdminStates.confirm_clear_orders, F.data.startswith("admin_confirm_orders_"))
-        dp.callback_query.register(handle_admin_set_status, F.data.startswith("set_status:")) # Admin status handler (no state filter needed)
-
-        # 5. General button handlers (My Orders, Change Lang, Start Over, Manage DB) - can work from any state
-        # Need to be registered after FSM state handlers that might use the same text (like Cancel)
-        dp.message.register(handle_start_over_btn, F.text.in_([BTN['ru']['start_over'], BTN['uz']['start_over']]))
-        dp.message.register(handle_change_lang_btn, F.text.in_([TEXT['ru']['change_lang'], TEXT['uz']['change_lang']]))
-        dp.message.register(handle_my_orders_btn, F.text.in_([BTN['ru']['my_orders'], BTN['uz']['my_orders']]))
-        dp.message.register(handle_edit_order_btn, F.text.in_([BTN['ru']['edit_order'], BTN['uz']['edit_order']])) # Placeholder
-        dp.message.register(handle_manage_db_btn, F.text.in_([BTN['ru']['manage_db'], BTN['uz']['manage_db']])) # Admin only
-
-        # 6. Default handlers (catching everything else) - place LAST
-        # Handle unexpected content types first
-        dp.message.register(default_other_handler, ~F.text & ~F.content_type.in_([ContentType.CONTACT, ContentType.LOCATION, ContentType.PHOTO]))
-        # Handle unexpected text last
-        dp.message.register(default_text_handler, F.text)
-
-
-        # Start the aiohttp web server runner
-        # This is a blocking call that keeps the process alive, listening for requests
-        runner = web.AppRunner(app)
+        # Start the aiohttp web server runner first: updates arriving during the rest of the startup are accepted
+        # and wait in webhook_gate until it is ready.
+        # Requests still open after shutdown() drained the updates (e.g. API streams) get a few seconds more
+        runner = web.AppRunner(app, shutdown_timeout=5)
         await runner.setup()
         # Listen on the port provided by Render (ensure WEBAPP_PORT is cast to int)
         site = web.TCPSite(runner, host=WEBAPP_HOST, port=int(WEBAPP_PORT))
         logger.info(f"Starting web server on {WEBAPP_HOST}:{WEBAPP_PORT} for webhook path {WEBHOOK_SECRET_PATH}")
         await site.start()
+        timings['listening'] = time.perf_counter() - started
+        health_monitor.start()
+
+        # DB init, polygon indexes and the webhook check do not depend on each other
+        webhook_set, _, _ = await asyncio.gather(
+            timed(timings, 'webhook', ensure_webhook()),
+            timed(timings, 'db', open_database()),
+            timed(timings, 'geo', load_geo_indexes()),
+        )
+        # Old orders get their totals once the zone prices are known
+        await timed(timings, 'backfill', backfill_order_totals())
+
+        # Static keyboards of the loaded languages are built once now; lazily loaded languages get theirs on first use
+        for markup in (kb_order_confirm(), kb_language_select()):
+            keyboards.payload(markup, bot.session, bot)
+        prebuilt = sum(warm_keyboards(lang) for lang in list(catalog.tables))
+        logger.info(f"Keyboard registry: {prebuilt + 2} static keyboards prebuilt")
+
+        # Settings file (optional): changes are applied without a restart
+        if SETTINGS_FILE:
+            settings_watcher = asyncio.create_task(watch_settings_file(SETTINGS_FILE, SETTINGS_POLL_SECONDS))
+
+        # Recurring deliveries: in-process scheduler, keeps only the subscriptions due soon in memory
+        subscription_scheduler = SubscriptionScheduler()
+        subscription_scheduler.start()
+
+        await health_monitor.ping_db() # Readiness reflects the open DB right away, not after the next periodic ping
+        webhook_gate.ready.set()
+        timings['ready'] = time.perf_counter() - started
+        logger.info(
+            f"Startup: ready in {timings['ready']:.3f} s (listening after {timings['listening']:.3f} s; "
+            f"db {timings['db']:.3f} s, geo {timings['geo']:.3f} s, "
+            f"webhook {timings['webhook']:.3f} s ({'set' if webhook_set else 'unchanged'}) in parallel; "
+            f"backfill {timings['backfill']:.3f} s)"
+        )
 
-        # The web server will run until the process is stopped externally.
-        # Use asyncio.Event().wait() to keep the main coroutine alive indefinitely
-        # while the aiohttp server handles requests in the background.
-        await asyncio.Event().wait()
+        # Log configuration values for debugging on Render
+        logger.info(f"Admins: {sorted(settings.admin_ids)} (ADMIN_CHAT_IDS seed: {ADMIN_CHAT_IDS})")
+        logger.info(f"Group chat: {settings.group_chat_id} (GROUP_CHAT_ID seed: {GROUP_CHAT_ID})")
+        logger.info(f"SETTINGS_FILE: {SETTINGS_FILE or '-'}")
+        logger.info(f"PRICE_PER_BOTTLE: {PRICE_PER_BOTTLE} (initial price; current tiers: {price_book.tiers()})")
+        logger.info(f"WEBHOOK_URL: {WEBHOOK_URL}")
+        logger.info(f"WEBHOOK_PATH: {WEBHOOK_SECRET_PATH}")
+        logger.info(f"WEBAPP_HOST: {WEBAPP_HOST}")
+        logger.info(f"WEBAPP_PORT: {WEBAPP_PORT}")
+        logger.info(f"DATABASE_PATH: {DATABASE_PATH}")
+        logger.info(f"DISTRICTS_PATH: {DISTRICTS_PATH or '-'}")
+        logger.info(f"SERVICE_ZONES_PATH: {SERVICE_ZONES_PATH} (mode: {SERVICE_ZONE_MODE})")
+        logger.info(f"DELIVERY_SLOTS: {DELIVERY_SLOTS} (days ahead: {SLOT_DAYS_AHEAD})")
+
+        # The web server runs in the background until SIGTERM (Render deploy/restart) or SIGINT
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except (NotImplementedError, RuntimeError): # No signal handlers in this event loop (Windows)
+                pass
+        await stop_event.wait()
+        logger.info("Stop signal received.")
 
 
     except Exception as e:
         logger.error(f"Error during webhook server startup or operation: {e}")
     finally:
-        # Clean up webhook in Telegram and close DB connection on shutdown
         logger.info("Shutting down...")
-        # Try to delete webhook gracefully
-        try:
-             # Only delete webhook if API_TOKEN is available and bot object exists
-             if API_TOKEN and bot:
-                 logger.info("Deleting webhook...")
-                 await bot.delete_webhook()
-                 logger.info("Webhook deleted.")
-        except Exception as e:
-             logger.warning(f"Failed to delete webhook on shutdown: {e}")
-
-        # Close DB connection
-        if db:
-            try:
-                await db.close()
-                logger.info("Database connection closed.")
-            except Exception as e:
-                logger.error(f"Error closing DB connection: {e}")
-
+        await shutdown(runner, site)
         logger.info("Bot stopped.")
 
 